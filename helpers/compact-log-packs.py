@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import logging
+
+from janitor.logs import PackFileLogFileManager
+
+
+async def main(args):
+    async with PackFileLogFileManager(args.directory) as manager:
+        for name in await manager.compact(min_garbage_ratio=args.min_garbage_ratio):
+            logging.info("Compacted %s", name)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("directory", type=str, help="Pack log directory.")
+parser.add_argument(
+    "--min-garbage-ratio",
+    type=float,
+    default=0.5,
+    help="Minimum fraction of a pack that has to be unused to rewrite it.",
+)
+args = parser.parse_args()
+logging.basicConfig(level=logging.INFO)
+asyncio.run(main(args))
@@ -2,25 +2,305 @@
 
 import argparse
 import asyncio
+import json
+import logging
 import os
-import tempfile
+import time
+from collections import deque
+from typing import Optional
 
-import silver_platter  # noqa: E402, F401
+from aiohttp_openmetrics import REGISTRY, Counter, push_to_gateway
 from ognibuild.debian.build import BUILD_LOG_FILENAME
 
-from janitor import state  # noqa: E402
-from janitor.config import read_config  # noqa: E402
-from janitor.logs import get_log_manager  # noqa: E402
+from janitor import state
+from janitor.config import read_config
+from janitor.logs import copy_log, get_log_manager
+
+migrated_runs_count = Counter(
+    "migrated_runs_count", "Number of runs whose logs were migrated"
+)
+migrated_logs_count = Counter("migrated_logs_count", "Number of logs migrated")
+migrated_log_bytes = Counter(
+    "migrated_log_bytes", "Uncompressed size of the logs migrated, in bytes"
+)
+failed_runs_count = Counter(
+    "failed_runs_count", "Number of runs whose logs could not be migrated"
+)
+
+
+class Checkpoint:
+    """Persistent record of how far the migration has progressed.
+
+    Runs are started in id order but may finish out of order; the checkpoint
+    only moves past a run once it and all runs before it have finished.
+    """
+
+    def __init__(self, path: Optional[str]) -> None:
+        self.path = path
+        self.last_run_id: Optional[str] = None
+        self.failed: list[str] = []
+        self._outstanding: deque = deque()
+        self._entries: dict[str, list] = {}
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as f:
+                js = json.load(f)
+        except FileNotFoundError:
+            return
+        self.last_run_id = js["last_run_id"]
+        self.failed = js["failed"]
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"last_run_id": self.last_run_id, "failed": self.failed}, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def started(self, run_id: str) -> None:
+        entry = [run_id, False]
+        self._outstanding.append(entry)
+        self._entries[run_id] = entry
+
+    def finished(self, run_id: str, *, failed: bool = False) -> None:
+        if failed:
+            if run_id not in self.failed:
+                self.failed.append(run_id)
+        elif run_id in self.failed:
+            self.failed.remove(run_id)
+        try:
+            entry = self._entries.pop(run_id)
+        except KeyError:
+            # Retry of an earlier failure; doesn't affect the position.
+            return
+        entry[1] = True
+        while self._outstanding and self._outstanding[0][1]:
+            self.last_run_id = self._outstanding.popleft()[0]
+
+
+class Progress:
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.runs = 0
+        self.logs = 0
+        self.bytes = 0
+        self.failures = 0
+
+    def log_migrated(self, size: int) -> None:
+        self.logs += 1
+        self.bytes += size
+        migrated_logs_count.inc()
+        migrated_log_bytes.inc(size)
+
+    def run_migrated(self) -> None:
+        self.runs += 1
+        migrated_runs_count.inc()
+
+    def run_failed(self) -> None:
+        self.failures += 1
+        failed_runs_count.inc()
+
+    def __str__(self) -> str:
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        mib = self.bytes / (1024 * 1024)
+        return (
+            f"{self.runs} runs ({self.runs / elapsed:.1f}/s), {self.logs} logs, "
+            f"{mib:.1f} MiB ({mib / elapsed:.1f} MiB/s), {self.failures} failures"
+        )
+
+
+async def find_logfilenames(pool, from_manager, codebase, run_id):
+    logfilenames = []
+    if await from_manager.has_log(codebase, run_id, "worker.log"):
+        logfilenames.append("worker.log")
+    if await from_manager.has_log(codebase, run_id, BUILD_LOG_FILENAME):
+        logfilenames.append(BUILD_LOG_FILENAME)
+    i = 1
+    while await from_manager.has_log(codebase, run_id, f"{BUILD_LOG_FILENAME}.{i}"):
+        logfilenames.append(f"{BUILD_LOG_FILENAME}.{i}")
+        i += 1
+
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE run SET logfilenames = $1 WHERE id = $2", logfilenames, run_id
+        )
+    return logfilenames
+
+
+async def migrate_run(
+    pool, from_manager, to_manager, progress, codebase, run_id, logfilenames, *, delete
+):
+    if logfilenames is None:
+        logfilenames = await find_logfilenames(pool, from_manager, codebase, run_id)
+
+    logging.debug("Processing %s (%r)", run_id, logfilenames)
+    for name in logfilenames:
+        try:
+            size = await copy_log(from_manager, to_manager, codebase, run_id, name)
+        except FileNotFoundError:
+            continue
+        progress.log_migrated(size)
+        if delete:
+            await from_manager.delete_log(codebase, run_id, name)
+    progress.run_migrated()
+
+
+async def report_progress(args, checkpoint, progress):
+    while True:
+        await asyncio.sleep(args.report_interval)
+        checkpoint.save()
+        logging.info("Migrated %s; at run %s", progress, checkpoint.last_run_id)
+        if args.prometheus:
+            await push_to_gateway(
+                args.prometheus, job="janitor.migrate-logs", registry=REGISTRY
+            )
+
+
+async def main(args, config):
+    checkpoint = Checkpoint(args.checkpoint)
+    checkpoint.load()
+    progress = Progress()
+
+    if args.retry_failed:
+        query = (
+            "SELECT codebase, id, logfilenames FROM run WHERE id = ANY($1::text[]) "
+            "ORDER BY id"
+        )
+        params = [list(checkpoint.failed)]
+    elif checkpoint.last_run_id is not None:
+        logging.info("Resuming after run %s", checkpoint.last_run_id)
+        query = "SELECT codebase, id, logfilenames FROM run WHERE id > $1 ORDER BY id"
+        params = [checkpoint.last_run_id]
+    else:
+        query = "SELECT codebase, id, logfilenames FROM run ORDER BY id"
+        params = []
+
+    delete = not args.keep_source and args.from_location != args.to_location
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+
+    async with (
+        get_log_manager(args.from_location) as from_manager,
+        get_log_manager(args.to_location) as to_manager,
+        state.create_pool(config.database_location) as pool,
+    ):
+        to_manager.compression = args.compression
+        if args.compression == "zstd":
+            to_manager.compression_dictionary = await to_manager.get_dictionary(
+                args.dictionary_id
+            )
+            if args.dictionary_id is not None and (
+                to_manager.compression_dictionary is None
+            ):
+                parser.error(f"no such dictionary: {args.dictionary_id}")
+
+        async def worker():
+            while True:
+                row = await queue.get()
+                if row is None:
+                    return
+                try:
+                    await migrate_run(
+                        pool,
+                        from_manager,
+                        to_manager,
+                        progress,
+                        row["codebase"],
+                        row["id"],
+                        row["logfilenames"],
+                        delete=delete,
+                    )
+                except Exception:
+                    logging.exception("Failed to migrate logs for %s", row["id"])
+                    progress.run_failed()
+                    checkpoint.finished(row["id"], failed=True)
+                else:
+                    checkpoint.finished(row["id"])
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.concurrency)]
+        reporter = asyncio.create_task(report_progress(args, checkpoint, progress))
+        try:
+            # Stream the runs from a server-side cursor; the bounded queue
+            # keeps the cursor from running ahead of the workers.
+            async with pool.acquire() as conn, conn.transaction():
+                async for row in conn.cursor(query, *params, prefetch=args.batch_size):
+                    if not args.retry_failed:
+                        checkpoint.started(row["id"])
+                    await queue.put(row)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+            checkpoint.save()
+
+    logging.info("Migrated %s", progress)
+    if args.prometheus:
+        await push_to_gateway(
+            args.prometheus, job="janitor.migrate-logs", registry=REGISTRY
+        )
 
-loop = asyncio.get_event_loop()
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "--config", type=str, default="janitor.conf", help="Path to configuration."
 )
-parser.add_argument("from_location", type=str, nargs=1)
-parser.add_argument("to_location", type=str, nargs=1)
+parser.add_argument(
+    "--checkpoint",
+    type=str,
+    help="Path to file to record progress in, so that the migration can be resumed.",
+)
+parser.add_argument(
+    "--retry-failed",
+    action="store_true",
+    help="Only retry the runs that failed to migrate earlier.",
+)
+parser.add_argument(
+    "--concurrency", type=int, default=16, help="Number of runs to migrate at once."
+)
+parser.add_argument(
+    "--batch-size",
+    type=int,
+    default=1000,
+    help="Number of runs to fetch from the database at once.",
+)
+parser.add_argument(
+    "--compression",
+    choices=["gzip", "zstd"],
+    default="gzip",
+    help="Compression to store the migrated logs with.",
+)
+parser.add_argument(
+    "--dictionary-id",
+    type=int,
+    help="Id of the zstd dictionary to compress with (default: most recent).",
+)
+parser.add_argument(
+    "--keep-source",
+    action="store_true",
+    help="Do not remove logs from the source location after copying them.",
+)
+parser.add_argument(
+    "--report-interval",
+    type=int,
+    default=60,
+    help="Interval at which to report progress and save the checkpoint, in seconds.",
+)
+parser.add_argument(
+    "--prometheus", type=str, help="Prometheus push gateway to export to."
+)
+parser.add_argument("from_location", type=str)
+parser.add_argument("to_location", type=str)
 args = parser.parse_args()
+logging.basicConfig(level=logging.INFO)
+
+if args.retry_failed and not args.checkpoint:
+    parser.error("--retry-failed requires --checkpoint")
 
 try:
     with open(args.config) as f:
@@ -28,52 +308,4 @@ try:
 except FileNotFoundError:
     parser.error(f"config path {args.config} does not exist")
 
-from_manager = get_log_manager(args.from_location)
-to_manager = get_log_manager(args.to_location)
-
-
-async def reprocess_run(pool, codebase, log_id, logfilenames):
-    if logfilenames is None:
-        logfilenames = []
-        if await from_manager.has_log(codebase, log_id, "worker.log"):
-            logfilenames.append("worker.log")
-        if await from_manager.has_log(codebase, log_id, BUILD_LOG_FILENAME):
-            logfilenames.append(BUILD_LOG_FILENAME)
-        i = 1
-        while await from_manager.has_log(codebase, log_id, f"{BUILD_LOG_FILENAME}.{i}"):
-            log_name = f"{BUILD_LOG_FILENAME}.{i}"
-            logfilenames.append(log_name)
-            i += 1
-
-        async with pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE run SET logfilenames = $1 WHERE id = $2", logfilenames, log_id
-            )
-
-    print(f"Processing {log_id} ({logfilenames!r})")
-    with tempfile.TemporaryDirectory() as d:
-        for name in logfilenames:
-            try:
-                log = await from_manager.get_log(codebase, log_id, name)
-            except FileNotFoundError:
-                continue
-            path = os.path.join(d, name)
-            with open(path, "wb") as f:
-                f.write(log.read())
-            await to_manager.import_log(codebase, log_id, path)
-            await from_manager.delete_log(codebase, log_id, name)
-
-
-async def process_all_build_failures(db_location):
-    todo = []
-    async with state.create_pool(db_location) as pool, pool.acquire() as conn:
-        async with conn.transaction():
-            async for row in conn.cursor("SELECT codebase, id, logfilenames FROM run"):
-                todo.append(
-                    reprocess_run(pool, row["codebase"], row["id"], row["logfilenames"])
-                )
-    for i in range(0, len(todo), 100):
-        await asyncio.gather(*todo[i : i + 100])
-
-
-loop.run_until_complete(process_all_build_failures(config.database_location))
+asyncio.run(main(args, config))
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import logging
+import random
+
+import zstandard
+
+from janitor.config import read_config
+from janitor.logs import get_log_manager
+
+
+async def main(args, config):
+    rng = random.Random()
+    async with get_log_manager(config.logs_location) as manager:
+        # Reservoir sample of the available logs
+        sample = []
+        seen = 0
+        async for codebase, run_id, names in manager.iter_logs():
+            for name in names:
+                if args.name and name not in args.name:
+                    continue
+                seen += 1
+                if len(sample) < args.sample_size:
+                    sample.append((codebase, run_id, name))
+                else:
+                    i = rng.randrange(seen)
+                    if i < args.sample_size:
+                        sample[i] = (codebase, run_id, name)
+        logging.info("Training on %d of %d logs", len(sample), seen)
+        samples = []
+        for codebase, run_id, name in sample:
+            try:
+                samples.append((await manager.get_log(codebase, run_id, name)).read())
+            except FileNotFoundError:
+                continue
+        dictionary = zstandard.train_dictionary(args.dictionary_size, samples)
+        await manager.store_dictionary(dictionary.dict_id(), dictionary.as_bytes())
+        logging.info("Stored dictionary %d", dictionary.dict_id())
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--config", type=str, default="janitor.conf", help="Path to configuration."
+)
+parser.add_argument(
+    "--sample-size", type=int, default=2000, help="Number of logs to train on."
+)
+parser.add_argument(
+    "--dictionary-size",
+    type=int,
+    default=112 * 1024,
+    help="Size of the dictionary, in bytes.",
+)
+parser.add_argument(
+    "--name",
+    type=str,
+    action="append",
+    help="Only train on logs with this name (e.g. build.log).",
+)
+args = parser.parse_args()
+logging.basicConfig(level=logging.INFO)
+
+try:
+    with open(args.config) as f:
+        config = read_config(f)
+except FileNotFoundError:
+    parser.error(f"config path {args.config} does not exist")
+
+asyncio.run(main(args, config))
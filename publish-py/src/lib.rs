@@ -121,6 +121,10 @@ impl RateLimiter {
         self.0.inc(bucket)
     }
 
+    fn dec(&mut self, bucket: &str) {
+        self.0.dec(bucket)
+    }
+
     fn get_max_open(&self, bucket: &str) -> Option<usize> {
         self.0.get_max_open(bucket)
     }
@@ -1,5 +1,6 @@
 use clap::Parser;
 use minijinja::{self, AutoEscape, Environment, Value};
+use std::io::{Read, Write};
 use std::path::{Path, PathBuf};
 
 #[derive(Parser)]
@@ -8,6 +9,10 @@ struct Args {
     #[clap(short, long)]
     template_env_path: Option<PathBuf>,
 
+    /// Keep running, handling length-prefixed requests on stdin
+    #[clap(long)]
+    serve: bool,
+
     #[clap(flatten)]
     logs: janitor::logging::LoggingArgs,
 }
@@ -49,6 +54,56 @@ fn load_template_env(path: &Path) -> Environment {
     environment
 }
 
+fn add_external_url(template_env: &mut Environment, request: &janitor_publish::PublishOneRequest) {
+    template_env.add_global(
+        "external_url",
+        if let Some(external_url) = request.external_url.as_ref() {
+            Some(external_url.to_string().trim_end_matches('/').to_string())
+        } else {
+            None
+        },
+    );
+}
+
+/// Handle publish requests from stdin until it is closed.
+///
+/// Every request and response is a JSON document preceded by its length, as
+/// a 32-bit big-endian integer. Responses are objects with a "returncode"
+/// (0 on success, 1 on failure) and the "response" that would be printed
+/// when handling a single request.
+fn serve(template_env: Environment) -> std::io::Result<()> {
+    let mut input = std::io::stdin().lock();
+    let mut output = std::io::stdout().lock();
+    loop {
+        let mut header = [0u8; 4];
+        match input.read_exact(&mut header) {
+            Ok(()) => {}
+            Err(e) if e.kind() == std::io::ErrorKind::UnexpectedEof => return Ok(()),
+            Err(e) => return Err(e),
+        }
+        let mut body = vec![0u8; u32::from_be_bytes(header) as usize];
+        input.read_exact(&mut body)?;
+        let request: janitor_publish::PublishOneRequest = serde_json::from_slice(&body)?;
+
+        let mut request_env = template_env.clone();
+        add_external_url(&mut request_env, &request);
+
+        let response =
+            match janitor_publish::publish_one::publish_one(request_env, &request, &mut None) {
+                Ok(result) => {
+                    let result: janitor_publish::PublishOneResult = result.into();
+                    serde_json::json!({"returncode": 0, "response": result})
+                }
+                Err(e) => serde_json::json!({"returncode": 1, "response": e}),
+            };
+
+        let body = serde_json::to_vec(&response)?;
+        output.write_all(&(body.len() as u32).to_be_bytes())?;
+        output.write_all(&body)?;
+        output.flush()?;
+    }
+}
+
 fn main() {
     let args = Args::parse();
 
@@ -61,18 +116,20 @@ fn main() {
 
     args.logs.init();
 
+    let mut template_env = load_template_env(&templates_dir);
+
+    if args.serve {
+        if let Err(e) = serve(template_env) {
+            eprintln!("Error handling publish requests: {}", e);
+            std::process::exit(2);
+        }
+        return;
+    }
+
     let request: janitor_publish::PublishOneRequest =
         serde_json::from_reader(std::io::stdin()).unwrap();
 
-    let mut template_env = load_template_env(&templates_dir);
-    template_env.add_global(
-        "external_url",
-        if let Some(external_url) = request.external_url.as_ref() {
-            Some(external_url.to_string().trim_end_matches('/').to_string())
-        } else {
-            None
-        },
-    );
+    add_external_url(&mut template_env, &request);
 
     let publish_result: janitor_publish::PublishOneResult =
         match janitor_publish::publish_one::publish_one(template_env, &request, &mut None) {
@@ -86,6 +86,13 @@ pub trait RateLimiter: Send + Sync {
     /// * `bucket` - The bucket to increment
     fn inc(&mut self, bucket: &str);
 
+    /// Undo an increment for a bucket, e.g. when a merge proposal that a
+    /// slot was reserved for did not get created after all.
+    ///
+    /// # Arguments
+    /// * `bucket` - The bucket to decrement
+    fn dec(&mut self, bucket: &str);
+
     /// Get rate limit statistics.
     ///
     /// # Returns
@@ -130,6 +137,8 @@ impl RateLimiter for NonRateLimiter {
 
     fn inc(&mut self, _bucket: &str) {}
 
+    fn dec(&mut self, _bucket: &str) {}
+
     fn get_stats(&self) -> Option<RateLimitStats> {
         None
     }
@@ -194,6 +203,16 @@ impl RateLimiter for FixedRateLimiter {
         }
     }
 
+    fn dec(&mut self, bucket: &str) {
+        if let Some(current) = self
+            .open_mps_per_bucket
+            .as_mut()
+            .and_then(|open_mps_per_bucket| open_mps_per_bucket.get_mut(bucket))
+        {
+            *current = current.saturating_sub(1);
+        }
+    }
+
     fn get_stats(&self) -> Option<RateLimitStats> {
         self.open_mps_per_bucket
             .as_ref()
@@ -278,6 +297,16 @@ impl RateLimiter for SlowStartRateLimiter {
         }
     }
 
+    fn dec(&mut self, bucket: &str) {
+        if let Some(current) = self
+            .open_mps_per_bucket
+            .as_mut()
+            .and_then(|open_mps_per_bucket| open_mps_per_bucket.get_mut(bucket))
+        {
+            *current = current.saturating_sub(1);
+        }
+    }
+
     fn set_mps_per_bucket(
         &mut self,
         mps_per_bucket: &HashMap<MergeProposalStatus, HashMap<String, usize>>,
@@ -316,3 +345,32 @@ impl RateLimiter for SlowStartRateLimiter {
         }
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_fixed_rate_limiter_inc_dec() {
+        let mut limiter = FixedRateLimiter::new(1);
+        assert!(!limiter.check_allowed("default").is_allowed());
+        let mut mps_per_bucket = HashMap::new();
+        mps_per_bucket.insert(
+            MergeProposalStatus::Open,
+            HashMap::from([("default".to_string(), 1)]),
+        );
+        limiter.set_mps_per_bucket(&mps_per_bucket);
+        assert!(limiter.check_allowed("default").is_allowed());
+        limiter.inc("default");
+        assert!(!limiter.check_allowed("default").is_allowed());
+        limiter.dec("default");
+        assert!(limiter.check_allowed("default").is_allowed());
+        limiter.dec("default");
+        limiter.dec("default");
+        limiter.dec("other");
+        assert_eq!(
+            limiter.get_stats().unwrap().per_bucket,
+            HashMap::from([("default".to_string(), 0)])
+        );
+    }
+}
@@ -9,6 +9,7 @@ class RateLimiter:
     def set_mps_per_bucket(self, mps_per_bucket: dict[str, dict[str, int]]) -> None: ...
     def check_allowed(self, bucket: str) -> None: ...
     def inc(self, bucket: str) -> None: ...
+    def dec(self, bucket: str) -> None: ...
     def get_stats(self) -> dict[str, tuple[int, int | None]]: ...
 
 class SlowStartRateLimiter(RateLimiter):
@@ -2,5 +2,5 @@ def find_dist_log_failure(
     logf: str, length: int
 ) -> tuple[int, tuple[int, int], list[int] | None]: ...
 def find_build_log_failure(
-    logf: str, length: int
+    logf: bytes, length: int
 ) -> tuple[int, tuple[int, int], list[int] | None]: ...
@@ -16,21 +16,33 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
 import asyncio
+import fcntl
 import gzip
+import json
 import logging
+import mmap
 import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import weakref
 from abc import ABC, abstractmethod
+from bisect import bisect_right
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
 from datetime import datetime, timedelta
 from io import BytesIO
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Optional
 
 from aiohttp import (
     ClientResponseError,
     ClientSession,
-    ClientTimeout,
     ServerDisconnectedError,
 )
-from aiohttp_openmetrics import Counter
+from aiohttp_openmetrics import Counter, Gauge
 from yarl import URL
 
 if TYPE_CHECKING:
@@ -40,6 +52,226 @@ primary_logfile_upload_failed_count = Counter(
     "primary_logfile_upload_failed", "Number of failed logs to primary logfile target"
 )
 logfile_uploaded_count = Counter("logfile_uploads", "Number of uploaded log files")
+log_cache_hit_count = Counter("log_cache_hits", "Number of log cache hits")
+log_cache_miss_count = Counter("log_cache_misses", "Number of log cache misses")
+log_cache_eviction_count = Counter(
+    "log_cache_evictions", "Number of entries evicted from the log cache"
+)
+log_cache_size_gauge = Gauge("log_cache_size", "Size of the log cache in bytes")
+
+# Logs are stored as a series of independently compressed blocks of
+# (at least) this many bytes, so that parts of them can be read without
+# decompressing the whole file
+COMPRESSION_CHUNK_SIZE = 64 * 1024
+# Number of lines of context to record around failures in logs
+FAILURE_CONTEXT_LINES = 15
+# Version of the log index format
+LOG_INDEX_VERSION = 1
+# Compression level used for zstd compressed logs
+ZSTD_LEVEL = 10
+# Magic bytes at the start of each zstd frame
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Number of index entries to retrieve at a time when listing packed logs
+PACK_LIST_BATCH_SIZE = 10000
+# Default maximum size of the decompressed logs kept by CachingLogFileManager
+DEFAULT_LOG_CACHE_SIZE = 256 * 1024 * 1024
+# Maximum number of log files to compress at the same time
+MAX_CONCURRENT_LOG_COMPRESSIONS = 4
+# Maximum number of log files to upload at the same time, across all runs
+MAX_CONCURRENT_LOG_UPLOADS = 16
+# Compressed logs larger than this are uploaded to S3 in multiple parts
+S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+# Size of the parts of S3 multipart uploads; S3 requires at least 5MiB
+S3_MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+# Maximum number of pooled connections to the S3 endpoint
+S3_MAX_POOL_CONNECTIONS = 32
+
+_compression_executor = ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_LOG_COMPRESSIONS, thread_name_prefix="log-compression"
+)
+# Compression dictionaries that have been retrieved, by dictionary id
+_zstd_dictionaries: dict[int, bytes] = {}
+# Upload slots, per event loop
+_log_upload_semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _find_log_failure(name: str, path: str) -> Optional[dict[str, Any]]:
+    if name not in ("build.log", "dist.log"):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        from ._site import find_build_log_failure, find_dist_log_failure
+
+        if name == "build.log":
+            (line_count, include_lines, highlight_lines) = find_build_log_failure(
+                data, FAILURE_CONTEXT_LINES
+            )
+        else:
+            (line_count, include_lines, highlight_lines) = find_dist_log_failure(
+                data.decode("utf-8", "replace"), FAILURE_CONTEXT_LINES
+            )
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except BaseException as e:
+        # The analysers panic on logs they can't make sense of, which pyo3
+        # raises as a BaseException. Not finding the failure shouldn't stop
+        # the log from being stored.
+        logging.warning("Unable to find failure in %s (%s): %r", name, path, e)
+        return None
+    return {
+        "length": FAILURE_CONTEXT_LINES,
+        "line_count": line_count,
+        "include_lines": include_lines,
+        "highlight_lines": highlight_lines,
+    }
+
+
+def _compress_file(
+    orig_path: str, outf, mtime=None, name=None, compression="gzip", dictionary=None
+) -> dict[str, Any]:
+    if compression == "zstd":
+        import zstandard
+
+        cctx = zstandard.ZstdCompressor(
+            level=ZSTD_LEVEL,
+            dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None,
+        )
+        compress = cctx.compress
+    elif compression == "gzip":
+
+        def compress(block):
+            return gzip.compress(block, mtime=mtime)
+    else:
+        raise ValueError(f"unknown compression {compression}")
+    start = outf.tell()
+    blocks = []
+    line_count = 0
+    with open(orig_path, "rb") as inf:
+        while True:
+            block = inf.read(COMPRESSION_CHUNK_SIZE)
+            if not block:
+                break
+            # Lines never span blocks.
+            if not block.endswith(b"\n"):
+                block += inf.readline()
+            blocks.append([outf.tell() - start, line_count + 1])
+            outf.write(compress(block))
+            line_count += block.count(b"\n")
+            if not block.endswith(b"\n"):
+                line_count += 1
+    if not blocks:
+        outf.write(compress(b""))
+    return {
+        "version": LOG_INDEX_VERSION,
+        "compression": compression,
+        "size": outf.tell() - start,
+        "line_count": line_count,
+        "blocks": blocks,
+        "failure": _find_log_failure(name, orig_path) if name else None,
+    }
+
+
+async def compress_log(
+    orig_path: str, outf, mtime=None, name=None, compression="gzip", dictionary=None
+) -> dict[str, Any]:
+    """Compress a log file without blocking the event loop.
+
+    The log is written as a series of independently compressed blocks, each
+    holding whole lines. For gzip, the blocks together still form a valid
+    gzip file; for zstd, each block is a frame that records the id of the
+    dictionary it was compressed with.
+
+    Args:
+      orig_path: Path to the uncompressed log file
+      outf: Binary file object to write the compressed data to
+      mtime: Modification time to store in the gzip header
+      name: Name of the log, used to look for failures in known logs
+      compression: Either "gzip" or "zstd"
+      dictionary: Raw zstd dictionary to compress with
+
+    Returns:
+      Index of the compressed log, for use with read_log_lines
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _compression_executor,
+        _compress_file,
+        orig_path,
+        outf,
+        mtime,
+        name,
+        compression,
+        dictionary,
+    )
+
+
+def _zstd_decompress(data: bytes, dictionary: Optional[bytes]) -> bytes:
+    import zstandard
+
+    dctx = zstandard.ZstdDecompressor(
+        dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+    )
+    with dctx.stream_reader(BytesIO(data), read_across_frames=True) as reader:
+        return reader.read()
+
+
+async def read_log_lines(
+    logfile_manager: "LogFileManager",
+    codebase: str,
+    run_id: str,
+    name: str,
+    first_line: int,
+    last_line: int,
+    *,
+    index: Optional[dict[str, Any]] = None,
+) -> Optional[list[bytes]]:
+    """Read a range of lines from a log, without retrieving all of it.
+
+    Args:
+      logfile_manager: Log file manager to read from
+      codebase: Codebase name
+      run_id: Run id
+      name: Log name
+      first_line: First line to read (1-based)
+      last_line: Last line to read (inclusive)
+      index: Log index, if already retrieved
+
+    Returns:
+      List of lines, or None if the log doesn't have an index
+    """
+    if index is None:
+        index = await logfile_manager.get_log_index(codebase, run_id, name)
+    if index is None or index.get("version") != LOG_INDEX_VERSION:
+        return None
+    blocks = index["blocks"]
+    if not blocks or last_line < first_line:
+        return []
+    block_lines = [first for (offset, first) in blocks]
+    start_block = max(bisect_right(block_lines, first_line) - 1, 0)
+    end_block = bisect_right(block_lines, last_line)
+    start = blocks[start_block][0]
+    if end_block < len(blocks):
+        end = blocks[end_block][0]
+    else:
+        end = index["size"]
+    try:
+        data = await logfile_manager.get_log_range(codebase, run_id, name, start, end)
+    except NotImplementedError:
+        return None
+    lines = (await logfile_manager.decompress(data)).splitlines(True)
+    skip = first_line - blocks[start_block][1]
+    return lines[skip : skip + last_line - first_line + 1]
+
+
+def _log_upload_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    try:
+        return _log_upload_semaphores[loop]
+    except KeyError:
+        sem = _log_upload_semaphores[loop] = asyncio.Semaphore(
+            MAX_CONCURRENT_LOG_UPLOADS
+        )
+        return sem
 
 
 class ServiceUnavailable(Exception):
@@ -47,6 +279,11 @@ class ServiceUnavailable(Exception):
 
 
 class LogFileManager(ABC):
+    # Compression to use for newly imported logs; either "gzip" or "zstd"
+    compression = "gzip"
+    # Raw zstd dictionary to compress newly imported logs with, if any
+    compression_dictionary: Optional[bytes] = None
+
     @abstractmethod
     async def has_log(self, codebase: str, run_id: str, name: str, timeout=None):
         raise NotImplementedError(self.has_log)
@@ -67,8 +304,69 @@ class LogFileManager(ABC):
     ):
         raise NotImplementedError(self.import_log)
 
+    async def get_log_index(
+        self, codebase: str, run_id: str, name: str
+    ) -> Optional[dict[str, Any]]:
+        """Retrieve the index stored alongside a log, if any."""
+        return None
+
+    async def get_log_range(
+        self, codebase: str, run_id: str, name: str, start: int, end: int
+    ) -> bytes:
+        """Retrieve a byte range of the compressed log."""
+        raise NotImplementedError(self.get_log_range)
+
+    async def get_dictionary(self, dict_id: Optional[int] = None) -> Optional[bytes]:
+        """Retrieve a compression dictionary.
+
+        Args:
+          dict_id: Id of the dictionary, or None for the most recent one
+
+        Returns:
+          The raw dictionary, or None if it doesn't exist
+        """
+        return None
+
+    async def store_dictionary(self, dict_id: int, data: bytes) -> None:
+        """Store a compression dictionary."""
+        raise NotImplementedError(self.store_dictionary)
+
+    async def decompress(self, data: bytes) -> bytes:
+        """Decompress (a range of blocks of) a stored log."""
+        if not data.startswith(ZSTD_MAGIC):
+            return await asyncio.to_thread(gzip.decompress, data)
+        import zstandard
+
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        dictionary = None
+        if dict_id:
+            try:
+                dictionary = _zstd_dictionaries[dict_id]
+            except KeyError:
+                dictionary = await self.get_dictionary(dict_id)
+                if dictionary is None:
+                    raise LogRetrievalError(
+                        f"Missing compression dictionary {dict_id}"
+                    ) from None
+                _zstd_dictionaries[dict_id] = dictionary
+        return await asyncio.to_thread(_zstd_decompress, data, dictionary)
+
+    async def _compress(self, orig_path: str, outf, mtime, name) -> dict[str, Any]:
+        return await compress_log(
+            orig_path,
+            outf,
+            mtime=mtime,
+            name=name,
+            compression=self.compression,
+            dictionary=self.compression_dictionary,
+        )
+
     @abstractmethod
-    async def iter_logs(self):
+    async def delete_log(self, codebase: str, run_id: str, name: str) -> None:
+        raise NotImplementedError(self.delete_log)
+
+    @abstractmethod
+    def iter_logs(self) -> AsyncIterator[tuple[str, str, list[str]]]:
         raise NotImplementedError(self.iter_logs)
 
     @abstractmethod
@@ -102,6 +400,8 @@ class FileSystemLogFileManager(LogFileManager):
 
     async def iter_logs(self):
         for codebase in os.scandir(self.log_directory):
+            if codebase.name.startswith("."):
+                continue
             for entry in os.scandir(codebase.path):
                 yield (
                     codebase.name,
@@ -109,9 +409,55 @@ class FileSystemLogFileManager(LogFileManager):
                     [
                         n[:-3] if n.endswith(".gz") else n
                         for n in os.listdir(entry.path)
+                        if not n.endswith(".idx")
                     ],
                 )
 
+    async def get_log_index(self, codebase, run_id, name):
+        if "/" in codebase or "/" in run_id or "/" in name:
+            return None
+        path = os.path.join(self.log_directory, codebase, run_id, name + ".idx")
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    async def get_dictionary(self, dict_id=None):
+        directory = os.path.join(self.log_directory, ".dictionaries")
+        if dict_id is None:
+            try:
+                entries = [
+                    e for e in os.scandir(directory) if e.name.endswith(".zdict")
+                ]
+            except FileNotFoundError:
+                return None
+            if not entries:
+                return None
+            path = max(entries, key=lambda e: e.stat().st_mtime).path
+        else:
+            path = os.path.join(directory, f"{dict_id}.zdict")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def store_dictionary(self, dict_id, data):
+        directory = os.path.join(self.log_directory, ".dictionaries")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{dict_id}.zdict"), "wb") as f:
+            f.write(data)
+
+    async def get_log_range(self, codebase, run_id, name, start, end):
+        for path in self._get_paths(codebase, run_id, name):
+            if not path.endswith(".gz") or not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                f.seek(start)
+                return f.read(end - start)
+        raise FileNotFoundError(name)
+
     async def has_log(
         self, codebase: str, run_id: str, name: str, timeout: Optional[timedelta] = None
     ) -> bool:
@@ -130,6 +476,10 @@ class FileSystemLogFileManager(LogFileManager):
             if not os.path.exists(path):
                 continue
             if path.endswith(".gz"):
+                with open(path, "rb") as f:
+                    if f.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC:
+                        f.seek(0)
+                        return BytesIO(await self.decompress(f.read()))
                 return gzip.GzipFile(path, mode="rb")
             else:
                 return open(path, "rb")
@@ -146,12 +496,13 @@ class FileSystemLogFileManager(LogFileManager):
     ):
         dest_dir = os.path.join(self.log_directory, codebase, run_id)
         os.makedirs(dest_dir, exist_ok=True)
-        with open(orig_path, "rb") as inf:
-            if basename is None:
-                basename = os.path.basename(orig_path)
-            dest_path = os.path.join(dest_dir, basename + ".gz")
-            with gzip.GzipFile(dest_path, mode="wb", mtime=mtime) as outf:
-                outf.write(inf.read())
+        if basename is None:
+            basename = os.path.basename(orig_path)
+        dest_path = os.path.join(dest_dir, basename + ".gz")
+        with open(dest_path, "wb") as outf:
+            index = await self._compress(orig_path, outf, mtime, basename)
+        with open(os.path.join(dest_dir, basename + ".idx"), "w") as f:
+            json.dump(index, f)
 
     async def delete_log(self, codebase, run_id, name):
         for path in self._get_paths(codebase, run_id, name):
@@ -163,6 +514,10 @@ class FileSystemLogFileManager(LogFileManager):
                 break
         else:
             raise FileNotFoundError(name)
+        try:
+            os.unlink(os.path.join(self.log_directory, codebase, run_id, name + ".idx"))
+        except FileNotFoundError:
+            pass
 
 
 class LogRetrievalError(Exception):
@@ -179,54 +534,167 @@ class S3LogFileManager(LogFileManager):
         self.endpoint_url = endpoint_url
 
     async def __aenter__(self):
-        import boto3
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+        from botocore import UNSIGNED
 
-        self.session = ClientSession(trace_configs=self.trace_configs)
-        self.s3 = boto3.resource("s3", endpoint_url=self.endpoint_url)
-        self.s3_bucket = self.s3.Bucket(self.bucket_name)
+        session = get_session()
+        config_args = {"max_pool_connections": S3_MAX_POOL_CONNECTIONS}
+        if await session.get_credentials() is None:
+            # Logs are public, so reading them doesn't require credentials.
+            config_args["signature_version"] = UNSIGNED
+        self._exit_stack = AsyncExitStack()
+        self.s3 = await self._exit_stack.enter_async_context(
+            session.create_client(
+                "s3", endpoint_url=self.endpoint_url, config=AioConfig(**config_args)
+            )
+        )
         return self
 
     async def __aexit__(self, exc_typ, exc_val, exc_tb):
+        await self._exit_stack.aclose()
         return False
 
     def _get_key(self, codebase, run_id, name):
         return f"logs/{codebase}/{run_id}/{name}.gz"
 
+    def _get_index_key(self, codebase, run_id, name):
+        return f"logs/{codebase}/{run_id}/{name}.idx"
+
     def _get_url(self, codebase, run_id, name):
         return f"{self.base_url}{self._get_key(codebase, run_id, name)}"
 
+    async def _head(self, codebase, run_id, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            return await self.s3.head_object(
+                Bucket=self.bucket_name, Key=self._get_key(codebase, run_id, name)
+            )
+        except ClientError as e:
+            status = e.response["ResponseMetadata"]["HTTPStatusCode"]
+            if status == 404:
+                raise FileNotFoundError(name) from e
+            if status == 403:
+                raise PermissionError(str(e)) from e
+            raise LogRetrievalError(f"Unexpected response code {status}: {e}") from e
+
     async def has_log(
         self, codebase, run_id, name, timeout: Optional[timedelta] = None
     ) -> bool:
-        url = self._get_url(codebase, run_id, name)
-        async with self.session.head(url) as resp:
-            if resp.status == 404:
-                return False
-            if resp.status == 200:
-                return True
-            if resp.status == 403:
-                return False
-            raise LogRetrievalError(
-                "Unexpected response code {{resp.status}}: ".format()
-            )
+        try:
+            await self._head(codebase, run_id, name)
+        except (FileNotFoundError, PermissionError):
+            return False
+        return True
 
     async def get_log(
         self, codebase, run_id, name, timeout: Optional[timedelta] = None
     ):
         if timeout is None:
             timeout = timedelta(minutes=5)
-        url = self._get_url(codebase, run_id, name)
-        client_timeout = ClientTimeout(int(timeout.total_seconds()))
-        async with self.session.get(url, timeout=client_timeout) as resp:
-            if resp.status == 404:
-                raise FileNotFoundError(name)
-            if resp.status == 200:
-                return BytesIO(gzip.decompress(await resp.read()))
-            if resp.status == 403:
-                raise PermissionError(await resp.text())
-            raise LogRetrievalError(
-                f"Unexpected response code {resp.status}: {await resp.text()}"
+
+        data = await asyncio.wait_for(
+            self._get(self._get_key(codebase, run_id, name), name),
+            timeout.total_seconds(),
+        )
+        return BytesIO(await self.decompress(data))
+
+    async def _get(self, key, name, **kwargs):
+        from botocore.exceptions import ClientError
+
+        try:
+            resp = await self.s3.get_object(Bucket=self.bucket_name, Key=key, **kwargs)
+            async with resp["Body"] as stream:
+                return await stream.read()
+        except ClientError as e:
+            status = e.response["ResponseMetadata"]["HTTPStatusCode"]
+            if status == 404:
+                raise FileNotFoundError(name) from e
+            if status == 403:
+                raise PermissionError(str(e)) from e
+            raise LogRetrievalError(f"Unexpected response code {status}: {e}") from e
+
+    async def get_log_index(self, codebase, run_id, name):
+        try:
+            data = await self._get(self._get_index_key(codebase, run_id, name), name)
+        except (FileNotFoundError, PermissionError):
+            return None
+        return json.loads(data)
+
+    async def get_log_range(self, codebase, run_id, name, start, end):
+        return await self._get(
+            self._get_key(codebase, run_id, name),
+            name,
+            Range=f"bytes={start}-{end - 1}",
+        )
+
+    async def get_dictionary(self, dict_id=None):
+        if dict_id is None:
+            latest = None
+            paginator = self.s3.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(
+                Bucket=self.bucket_name, Prefix="dictionaries/"
+            ):
+                for entry in page.get("Contents", []):
+                    if latest is None or entry["LastModified"] > latest["LastModified"]:
+                        latest = entry
+            if latest is None:
+                return None
+            key = latest["Key"]
+        else:
+            key = f"dictionaries/{dict_id}.zdict"
+        try:
+            return await self._get(key, key)
+        except (FileNotFoundError, PermissionError):
+            return None
+
+    async def store_dictionary(self, dict_id, data):
+        await self.s3.put_object(
+            Bucket=self.bucket_name,
+            Key=f"dictionaries/{dict_id}.zdict",
+            Body=data,
+            ACL="public-read",
+        )
+
+    async def _upload(self, key, f, size):
+        if size <= S3_MULTIPART_THRESHOLD:
+            await self.s3.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=await asyncio.to_thread(f.read),
+                ACL="public-read",
+            )
+            return
+        upload = await self.s3.create_multipart_upload(
+            Bucket=self.bucket_name, Key=key, ACL="public-read"
+        )
+        upload_id = upload["UploadId"]
+        try:
+            parts: list[dict[str, Any]] = []
+            while True:
+                chunk = await asyncio.to_thread(f.read, S3_MULTIPART_CHUNK_SIZE)
+                if not chunk:
+                    break
+                resp = await self.s3.upload_part(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=len(parts) + 1,
+                    Body=chunk,
+                )
+                parts.append({"ETag": resp["ETag"], "PartNumber": len(parts) + 1})
+            await self.s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            await self.s3.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=key, UploadId=upload_id
             )
+            raise
 
     async def import_log(
         self,
@@ -237,27 +705,69 @@ class S3LogFileManager(LogFileManager):
         mtime=None,
         basename: Optional[str] = None,
     ):
+        from botocore.exceptions import ClientError
+
         if timeout is None:
             timeout = timedelta(minutes=5)
-        with open(orig_path, "rb") as f:
-            data = gzip.compress(f.read(), mtime=mtime)
-
         if basename is None:
             basename = os.path.basename(orig_path)
         key = self._get_key(codebase, run_id, basename)
-        self.s3_bucket.put_object(Key=key, Body=data, ACL="public-read")
+        with tempfile.TemporaryFile() as f:
+            index = await self._compress(orig_path, f, mtime, basename)
+            size = f.tell()
+            f.seek(0)
+            try:
+                await asyncio.wait_for(
+                    self._upload(key, f, size), timeout.total_seconds()
+                )
+                await self.s3.put_object(
+                    Bucket=self.bucket_name,
+                    Key=self._get_index_key(codebase, run_id, basename),
+                    Body=json.dumps(index).encode("utf-8"),
+                    ACL="public-read",
+                )
+            except ClientError as e:
+                status = e.response["ResponseMetadata"]["HTTPStatusCode"]
+                if status == 503:
+                    raise ServiceUnavailable() from e
+                if status == 403:
+                    raise PermissionError(str(e)) from e
+                raise
 
     async def delete_log(self, codebase, run_id, name):
-        key = self._get_key(codebase, run_id, name)
-        self.s3_bucket.delete_objects(Delete={"Objects": [{"Key": key}]})
+        for key in [
+            self._get_key(codebase, run_id, name),
+            self._get_index_key(codebase, run_id, name),
+        ]:
+            await self.s3.delete_object(Bucket=self.bucket_name, Key=key)
 
     async def iter_logs(self):
-        # TODO(jelmer)
-        raise NotImplementedError(self.iter_logs)
+        paginator = self.s3.get_paginator("list_objects_v2")
+        current = None
+        names: list[str] = []
+        # Keys are listed in lexicographic order, so all logs for a run are
+        # adjacent.
+        async for page in paginator.paginate(Bucket=self.bucket_name, Prefix="logs/"):
+            for entry in page.get("Contents", []):
+                try:
+                    _, codebase, run_id, name = entry["Key"].split("/")
+                except ValueError:
+                    continue
+                if name.endswith(".idx"):
+                    continue
+                if name.endswith(".gz"):
+                    name = name[:-3]
+                if (codebase, run_id) != current:
+                    if current is not None:
+                        yield current[0], current[1], names
+                    current = (codebase, run_id)
+                    names = []
+                names.append(name)
+        if current is not None:
+            yield current[0], current[1], names
 
     async def get_ctime(self, codebase, run_id, name):
-        # TODO(jelmer)
-        raise NotImplementedError(self.get_ctime)
+        return (await self._head(codebase, run_id, name))["LastModified"]
 
 
 class GCSLogFileManager(LogFileManager):
@@ -285,7 +795,13 @@ class GCSLogFileManager(LogFileManager):
     async def iter_logs(self):
         seen: dict[tuple[str, str], list[str]] = {}
         for name in await self.bucket.list_blobs():
-            codebase, log_id, lfn = name.split("/")
+            try:
+                codebase, log_id, lfn = name.split("/")
+            except ValueError:
+                # e.g. compression dictionaries
+                continue
+            if lfn.endswith(".idx"):
+                continue
             seen.setdefault((codebase, log_id), []).append(lfn)
         for (codebase, log_id), lfns in seen.items():
             yield codebase, log_id, lfns
@@ -293,6 +809,59 @@ class GCSLogFileManager(LogFileManager):
     def _get_object_name(self, codebase, run_id, name):
         return f"{codebase}/{run_id}/{name}.gz"
 
+    def _get_index_object_name(self, codebase, run_id, name):
+        return f"{codebase}/{run_id}/{name}.idx"
+
+    async def _download(self, object_name, name, **kwargs):
+        try:
+            return await self.storage.download(
+                self.bucket_name, object_name, session=self.session, **kwargs
+            )
+        except ClientResponseError as e:
+            if e.status == 404:
+                raise FileNotFoundError(name) from e
+            raise ServiceUnavailable() from e
+        except ServerDisconnectedError as e:
+            raise ServiceUnavailable() from e
+
+    async def get_log_index(self, codebase, run_id, name):
+        object_name = self._get_index_object_name(codebase, run_id, name)
+        try:
+            return json.loads(await self._download(object_name, name))
+        except FileNotFoundError:
+            return None
+
+    async def get_log_range(self, codebase, run_id, name, start, end):
+        return await self._download(
+            self._get_object_name(codebase, run_id, name),
+            name,
+            headers={"Range": f"bytes={start}-{end - 1}"},
+        )
+
+    async def get_dictionary(self, dict_id=None):
+        from iso8601 import parse_date
+
+        if dict_id is None:
+            names = await self.bucket.list_blobs(prefix="dictionaries/")
+            if not names:
+                return None
+            created = {}
+            for name in names:
+                blob = await self.bucket.get_blob(name, session=self.session)
+                created[name] = parse_date(blob.timeCreated)  # type: ignore
+            object_name = max(names, key=created.__getitem__)
+        else:
+            object_name = f"dictionaries/{dict_id}.zdict"
+        try:
+            return await self._download(object_name, object_name)
+        except FileNotFoundError:
+            return None
+
+    async def store_dictionary(self, dict_id, data):
+        await self.storage.upload(
+            self.bucket_name, f"dictionaries/{dict_id}.zdict", data
+        )
+
     async def has_log(
         self, codebase, run_id, name, timeout: Optional[timedelta] = None
     ) -> bool:
@@ -313,26 +882,35 @@ class GCSLogFileManager(LogFileManager):
             raise ServiceUnavailable() from e
         return parse_date(blob.timeCreated)  # type: ignore
 
+    async def delete_log(self, codebase, run_id, name):
+        for object_name, required in [
+            (self._get_object_name(codebase, run_id, name), True),
+            (self._get_index_object_name(codebase, run_id, name), False),
+        ]:
+            try:
+                await self.storage.delete(
+                    self.bucket_name, object_name, session=self.session
+                )
+            except ClientResponseError as e:
+                if e.status == 404:
+                    if required:
+                        raise FileNotFoundError(name) from e
+                    continue
+                raise ServiceUnavailable() from e
+            except ServerDisconnectedError as e:
+                raise ServiceUnavailable() from e
+
     async def get_log(
         self, codebase, run_id, name, timeout: Optional[timedelta] = None
     ):
         if timeout is None:
             timeout = timedelta(minutes=5)
-        object_name = self._get_object_name(codebase, run_id, name)
-        try:
-            data = await self.storage.download(
-                self.bucket_name,
-                object_name,
-                session=self.session,
-                timeout=int(timeout.total_seconds()),
-            )
-            return BytesIO(gzip.decompress(data))
-        except ClientResponseError as e:
-            if e.status == 404:
-                raise FileNotFoundError(name) from e
-            raise ServiceUnavailable() from e
-        except ServerDisconnectedError as e:
-            raise ServiceUnavailable() from e
+        data = await self._download(
+            self._get_object_name(codebase, run_id, name),
+            name,
+            timeout=int(timeout.total_seconds()),
+        )
+        return BytesIO(await self.decompress(data))
 
     async def import_log(
         self,
@@ -348,30 +926,514 @@ class GCSLogFileManager(LogFileManager):
         if timeout is None:
             timeout = timedelta(minutes=5)
         object_name = self._get_object_name(codebase, run_id, basename)
-        with open(orig_path, "rb") as f:
-            plain_data = f.read()
-        compressed_data = gzip.compress(plain_data, mtime=mtime)
-        try:
-            await self.storage.upload(
-                self.bucket_name,
-                object_name,
-                compressed_data,
-                timeout=int(timeout.total_seconds()),
-            )
-        except ClientResponseError as e:
-            if e.status == 503:
-                raise ServiceUnavailable() from e
-            if e.status == 403:
-                data = await self.storage.download(
+        with tempfile.TemporaryFile() as f:
+            index = await self._compress(orig_path, f, mtime, basename)
+            f.seek(0)
+            try:
+                await self.storage.upload(
                     self.bucket_name,
                     object_name,
-                    session=self.session,
+                    f,
                     timeout=int(timeout.total_seconds()),
                 )
-                if data == plain_data:
-                    return
-                raise PermissionError(e.message) from e
-            raise
+                await self.storage.upload(
+                    self.bucket_name,
+                    self._get_index_object_name(codebase, run_id, basename),
+                    json.dumps(index),
+                    content_type="application/json",
+                    timeout=int(timeout.total_seconds()),
+                )
+            except ClientResponseError as e:
+                if e.status == 503:
+                    raise ServiceUnavailable() from e
+                if e.status == 403:
+                    data = await self.storage.download(
+                        self.bucket_name,
+                        object_name,
+                        session=self.session,
+                        timeout=int(timeout.total_seconds()),
+                    )
+                    with open(orig_path, "rb") as inf:
+                        plain_data = await asyncio.to_thread(inf.read)
+                    if data == plain_data:
+                        return
+                    raise PermissionError(e.message) from e
+                raise
+
+
+class PackFileLogFileManager(LogFileManager):
+    """Log file manager that stores logs in a small number of large files.
+
+    Compressed logs are appended to a pack file per day, and their location
+    is recorded in an SQLite index in the same directory. Deleting a log
+    only removes it from the index; the space it used is reclaimed by
+    compact(), which rewrites mostly unused pack files under a new name so
+    that readers never see stale offsets.
+    """
+
+    def __init__(self, log_directory) -> None:
+        self.log_directory = log_directory
+        self._maps: dict[str, mmap.mmap] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        # All access to the index and pack files happens on this thread.
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="log-packs"
+        )
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, fn, *args
+        )
+
+    def _open(self) -> None:
+        os.makedirs(self.log_directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(self.log_directory, "index.sqlite"), check_same_thread=False
+        )
+        # Allow readers in other processes while logs are being imported.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS log ("
+            "codebase TEXT NOT NULL, run_id TEXT NOT NULL, name TEXT NOT NULL, "
+            "pack TEXT NOT NULL, offset INTEGER NOT NULL, "
+            "length INTEGER NOT NULL, ctime REAL NOT NULL, idx TEXT, "
+            "PRIMARY KEY (codebase, run_id, name))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS log_pack ON log (pack)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dictionary ("
+            "id INTEGER PRIMARY KEY, created REAL NOT NULL, data BLOB NOT NULL)"
+        )
+        self._db.commit()
+
+    def _close(self) -> None:
+        for m in self._maps.values():
+            m.close()
+        self._maps.clear()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def __aenter__(self):
+        await self._run(self._open)
+        return self
+
+    async def __aexit__(self, exc_typ, exc_val, exc_tb):
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+        return False
+
+    def _lookup(self, codebase, run_id, name):
+        assert self._db is not None
+        return self._db.execute(
+            "SELECT pack, offset, length, ctime, idx FROM log "
+            "WHERE codebase = ? AND run_id = ? AND name = ?",
+            (codebase, run_id, name),
+        ).fetchone()
+
+    def _read(self, pack: str, offset: int, length: int) -> bytes:
+        m = self._maps.get(pack)
+        if m is None or offset + length > len(m):
+            # The pack has grown since it was mapped.
+            if m is not None:
+                m.close()
+            with open(os.path.join(self.log_directory, pack), "rb") as f:
+                m = self._maps[pack] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return m[offset : offset + length]
+
+    def _read_log(self, codebase, run_id, name, start=0, end=None) -> bytes:
+        # Retry once, in case the pack was compacted away between looking
+        # up the log and reading it.
+        for attempt in range(2):
+            row = self._lookup(codebase, run_id, name)
+            if row is None:
+                raise FileNotFoundError(name)
+            pack, offset, length = row[:3]
+            if end is None or end > length:
+                end = length
+            try:
+                return self._read(pack, offset + start, end - start)
+            except FileNotFoundError:
+                self._maps.pop(pack, None)
+                if attempt:
+                    raise
+        raise AssertionError("unreachable")
+
+    async def has_log(self, codebase, run_id, name, timeout=None):
+        return await self._run(self._lookup, codebase, run_id, name) is not None
+
+    async def get_log(self, codebase, run_id, name, timeout=None):
+        data = await self._run(self._read_log, codebase, run_id, name)
+        return BytesIO(await self.decompress(data))
+
+    async def get_log_index(self, codebase, run_id, name):
+        row = await self._run(self._lookup, codebase, run_id, name)
+        if row is None or row[4] is None:
+            return None
+        return json.loads(row[4])
+
+    async def get_log_range(self, codebase, run_id, name, start, end):
+        return await self._run(self._read_log, codebase, run_id, name, start, end)
+
+    async def get_ctime(self, codebase, run_id, name):
+        row = await self._run(self._lookup, codebase, run_id, name)
+        if row is None:
+            raise FileNotFoundError(name)
+        return datetime.fromtimestamp(row[3])
+
+    def _get_dictionary(self, dict_id):
+        assert self._db is not None
+        if dict_id is None:
+            row = self._db.execute(
+                "SELECT data FROM dictionary ORDER BY created DESC LIMIT 1"
+            ).fetchone()
+        else:
+            row = self._db.execute(
+                "SELECT data FROM dictionary WHERE id = ?", (dict_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    async def get_dictionary(self, dict_id=None):
+        return await self._run(self._get_dictionary, dict_id)
+
+    def _store_dictionary(self, dict_id, data):
+        assert self._db is not None
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO dictionary (id, created, data) VALUES (?, ?, ?)",
+                (dict_id, time.time(), data),
+            )
+
+    async def store_dictionary(self, dict_id, data):
+        await self._run(self._store_dictionary, dict_id, data)
+
+    def _lock_pack(self, f, path) -> bool:
+        """Take an exclusive lock on an open pack file.
+
+        Returns:
+          Whether path still refers to the locked file; if not, the pack
+          was compacted away while waiting for the lock and has been
+          unlocked again.
+        """
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return True
+        except FileNotFoundError:
+            pass
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+    def _append(self, codebase, run_id, name, f, index) -> None:
+        assert self._db is not None
+        pack = datetime.utcnow().strftime("%Y-%m-%d.pack")
+        path = os.path.join(self.log_directory, pack)
+        while True:
+            with open(path, "ab") as outf:
+                if not self._lock_pack(outf, path):
+                    continue
+                # Keep the pack locked until the log has been indexed, so
+                # that compaction never sees it without its index entry.
+                try:
+                    offset = outf.tell()
+                    shutil.copyfileobj(f, outf, COMPRESSION_CHUNK_SIZE)
+                    outf.flush()
+                    length = outf.tell() - offset
+                    with self._db:
+                        self._db.execute(
+                            "INSERT OR REPLACE INTO log "
+                            "(codebase, run_id, name, pack, offset, length, "
+                            "ctime, idx) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (
+                                codebase,
+                                run_id,
+                                name,
+                                pack,
+                                offset,
+                                length,
+                                time.time(),
+                                json.dumps(index),
+                            ),
+                        )
+                finally:
+                    fcntl.flock(outf, fcntl.LOCK_UN)
+                return
+
+    async def import_log(
+        self,
+        codebase,
+        run_id,
+        orig_path,
+        timeout=None,
+        mtime=None,
+        basename: Optional[str] = None,
+    ):
+        if basename is None:
+            basename = os.path.basename(orig_path)
+        with tempfile.TemporaryFile() as f:
+            index = await self._compress(orig_path, f, mtime, basename)
+            f.seek(0)
+            await self._run(self._append, codebase, run_id, basename, f, index)
+
+    def _delete(self, codebase, run_id, name) -> None:
+        assert self._db is not None
+        with self._db:
+            cursor = self._db.execute(
+                "DELETE FROM log WHERE codebase = ? AND run_id = ? AND name = ?",
+                (codebase, run_id, name),
+            )
+        if cursor.rowcount == 0:
+            raise FileNotFoundError(name)
+
+    async def delete_log(self, codebase, run_id, name):
+        await self._run(self._delete, codebase, run_id, name)
+
+    def _list(self, after, limit):
+        assert self._db is not None
+        return self._db.execute(
+            "SELECT codebase, run_id, name FROM log "
+            "WHERE (codebase, run_id, name) > (?, ?, ?) "
+            "ORDER BY codebase, run_id, name LIMIT ?",
+            (*after, limit),
+        ).fetchall()
+
+    async def iter_logs(self):
+        current = None
+        names: list[str] = []
+        after = ("", "", "")
+        while True:
+            rows = await self._run(self._list, after, PACK_LIST_BATCH_SIZE)
+            if not rows:
+                break
+            for codebase, run_id, name in rows:
+                if (codebase, run_id) != current:
+                    if current is not None:
+                        yield current[0], current[1], names
+                    current = (codebase, run_id)
+                    names = []
+                names.append(name)
+            after = rows[-1]
+        if current is not None:
+            yield current[0], current[1], names
+
+    def _compact(self, min_garbage_ratio: float) -> list[str]:
+        assert self._db is not None
+        active = datetime.utcnow().strftime("%Y-%m-%d.pack")
+        rewritten = []
+        for entry in os.scandir(self.log_directory):
+            if not entry.name.endswith(".pack") or entry.name == active:
+                continue
+            try:
+                inf = open(entry.path, "rb")
+            except FileNotFoundError:
+                continue
+            with inf:
+                # Hold the same lock as _append, so that the pack can not
+                # be written to or indexed while it is being compacted.
+                if not self._lock_pack(inf, entry.path):
+                    continue
+                try:
+                    if self._compact_pack(entry, inf, min_garbage_ratio):
+                        rewritten.append(entry.name)
+                finally:
+                    fcntl.flock(inf, fcntl.LOCK_UN)
+        return rewritten
+
+    def _compact_pack(self, entry, inf, min_garbage_ratio: float) -> bool:
+        assert self._db is not None
+        size = os.fstat(inf.fileno()).st_size
+        rows = self._db.execute(
+            "SELECT codebase, run_id, name, offset, length FROM log "
+            "WHERE pack = ? ORDER BY offset",
+            (entry.name,),
+        ).fetchall()
+        live = sum(row[4] for row in rows)
+        if size and 1 - live / size < min_garbage_ratio:
+            return False
+        updates = []
+        if rows:
+            new_pack = "{}.{}.pack".format(
+                entry.name[: -len(".pack")].split(".")[0], int(time.time())
+            )
+            new_path = os.path.join(self.log_directory, new_pack)
+            with open(new_path, "wb") as outf:
+                for codebase, run_id, name, offset, length in rows:
+                    inf.seek(offset)
+                    updates.append(
+                        (new_pack, outf.tell(), codebase, run_id, name, entry.name)
+                    )
+                    remaining = length
+                    while remaining:
+                        chunk = inf.read(min(remaining, COMPRESSION_CHUNK_SIZE))
+                        outf.write(chunk)
+                        remaining -= len(chunk)
+                outf.flush()
+                os.fsync(outf.fileno())
+        if os.fstat(inf.fileno()).st_size != size:
+            # Something wrote to the pack without holding the lock; leave
+            # it alone rather than risk losing a log.
+            if updates:
+                os.unlink(new_path)
+            return False
+        if updates:
+            with self._db:
+                self._db.executemany(
+                    "UPDATE log SET pack = ?, offset = ? "
+                    "WHERE codebase = ? AND run_id = ? AND name = ? "
+                    "AND pack = ?",
+                    updates,
+                )
+        m = self._maps.pop(entry.name, None)
+        if m is not None:
+            m.close()
+        os.unlink(entry.path)
+        return True
+
+    async def compact(self, min_garbage_ratio: float = 0.5) -> list[str]:
+        """Reclaim the space used by deleted logs.
+
+        Args:
+          min_garbage_ratio: Minimum fraction of a pack file that has to be
+            unused for it to be rewritten
+
+        Returns:
+          Names of the pack files that were rewritten or removed
+        """
+        return await self._run(self._compact, min_garbage_ratio)
+
+
+class CachingLogFileManager(LogFileManager):
+    """Log file manager that keeps recently retrieved logs in memory.
+
+    Logs are never changed once they have been imported, so cached entries
+    remain valid until they are evicted to keep the total size of the cache
+    below max_size bytes. Concurrent requests for a log that is not cached
+    share a single retrieval.
+    """
+
+    def __init__(
+        self, inner: LogFileManager, max_size: int = DEFAULT_LOG_CACHE_SIZE
+    ) -> None:
+        self.inner = inner
+        self.max_size = max_size
+        self.size = 0
+        self._cache: OrderedDict[tuple, tuple[Any, int]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Task] = {}
+
+    async def __aenter__(self):
+        await self.inner.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_typ, exc_val, exc_tb):
+        return await self.inner.__aexit__(exc_typ, exc_val, exc_tb)
+
+    def _store(self, key, value, size) -> None:
+        if size > self.max_size:
+            return
+        self._cache[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            _, (_, evicted_size) = self._cache.popitem(last=False)
+            self.size -= evicted_size
+            log_cache_eviction_count.inc()
+        log_cache_size_gauge.set(self.size)
+
+    def _invalidate(self, codebase, run_id, name) -> None:
+        for key in [k for k in self._cache if k[:3] == (codebase, run_id, name)]:
+            self.size -= self._cache.pop(key)[1]
+        log_cache_size_gauge.set(self.size)
+
+    async def _cached(self, key, retrieve, size_of):
+        try:
+            value, _ = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(key)
+            log_cache_hit_count.inc()
+            return value
+        try:
+            task = self._inflight[key]
+        except KeyError:
+            log_cache_miss_count.inc()
+            # The retrieval runs in a task of its own, so that it carries on
+            # for the other waiters if the request that started it is
+            # cancelled.
+            task = self._inflight[key] = asyncio.ensure_future(
+                self._retrieve(key, retrieve, size_of)
+            )
+            # Mark the exception as retrieved, in case nobody is waiting.
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        else:
+            log_cache_hit_count.inc()
+        return await asyncio.shield(task)
+
+    async def _retrieve(self, key, retrieve, size_of):
+        try:
+            value = await retrieve()
+        finally:
+            del self._inflight[key]
+        self._store(key, value, size_of(value))
+        return value
+
+    async def has_log(self, codebase, run_id, name, timeout=None):
+        if (codebase, run_id, name, "log") in self._cache:
+            return True
+        return await self.inner.has_log(codebase, run_id, name, timeout=timeout)
+
+    async def get_log(self, codebase, run_id, name, timeout=None):
+        async def retrieve():
+            f = await self.inner.get_log(codebase, run_id, name, timeout=timeout)
+            return await asyncio.to_thread(f.read)
+
+        return BytesIO(
+            await self._cached((codebase, run_id, name, "log"), retrieve, len)
+        )
+
+    async def get_log_index(self, codebase, run_id, name):
+        return await self._cached(
+            (codebase, run_id, name, "index"),
+            lambda: self.inner.get_log_index(codebase, run_id, name),
+            lambda index: len(json.dumps(index)) if index else 0,
+        )
+
+    async def get_log_range(self, codebase, run_id, name, start, end):
+        return await self._cached(
+            (codebase, run_id, name, "range", start, end),
+            lambda: self.inner.get_log_range(codebase, run_id, name, start, end),
+            len,
+        )
+
+    async def import_log(
+        self,
+        codebase,
+        run_id,
+        orig_path,
+        timeout=None,
+        mtime=None,
+        basename: Optional[str] = None,
+    ):
+        await self.inner.import_log(
+            codebase, run_id, orig_path, timeout=timeout, mtime=mtime, basename=basename
+        )
+        self._invalidate(codebase, run_id, basename or os.path.basename(orig_path))
+
+    async def delete_log(self, codebase, run_id, name):
+        self._invalidate(codebase, run_id, name)
+        await self.inner.delete_log(codebase, run_id, name)
+
+    async def get_dictionary(self, dict_id=None):
+        return await self.inner.get_dictionary(dict_id)
+
+    async def store_dictionary(self, dict_id, data):
+        await self.inner.store_dictionary(dict_id, data)
+
+    async def iter_logs(self):
+        async for entry in self.inner.iter_logs():
+            yield entry
+
+    async def get_ctime(self, codebase, run_id, name):
+        return await self.inner.get_ctime(codebase, run_id, name)
 
 
 def get_log_manager(location, trace_configs=None):
@@ -382,6 +1444,8 @@ def get_log_manager(location, trace_configs=None):
         return GCSLogFileManager(location, trace_configs=trace_configs)
     if location.startswith("http:") or location.startswith("https:"):
         return S3LogFileManager(location, trace_configs=trace_configs)
+    if location.startswith("pack:"):
+        return PackFileLogFileManager(location[len("pack:") :])
     return FileSystemLogFileManager(location)
 
 
@@ -394,6 +1458,28 @@ async def import_log(
     *,
     mtime: Optional[int] = None,
     backup_logfile_manager: Optional[LogFileManager] = None,
+):
+    async with _log_upload_semaphore():
+        await _import_log(
+            logfile_manager,
+            pkg,
+            log_id,
+            name,
+            path,
+            mtime=mtime,
+            backup_logfile_manager=backup_logfile_manager,
+        )
+
+
+async def _import_log(
+    logfile_manager: LogFileManager,
+    pkg: str,
+    log_id: str,
+    name: str,
+    path: str,
+    *,
+    mtime: Optional[int] = None,
+    backup_logfile_manager: Optional[LogFileManager] = None,
 ):
     try:
         await logfile_manager.import_log(pkg, log_id, path, mtime=mtime)
@@ -430,26 +1516,36 @@ async def import_log(
         logfile_uploaded_count.inc()
 
 
-async def import_logs(
-    entries,
-    logfile_manager: LogFileManager,
-    pkg: str,
-    log_id: str,
+async def copy_log(
+    from_manager: LogFileManager,
+    to_manager: LogFileManager,
+    codebase: str,
+    run_id: str,
+    name: str,
     *,
-    backup_logfile_manager: Optional[LogFileManager] = None,
-    mtime: Optional[int] = None,
-):
-    await asyncio.gather(
-        *[
-            import_log(
-                logfile_manager,
-                pkg,
-                log_id,
-                entry.name,
-                entry.path,
-                mtime=mtime,
-                backup_logfile_manager=backup_logfile_manager,
-            )
-            for entry in entries
-        ]
-    )
+    timeout=None,
+) -> int:
+    """Copy a log from one log manager to another.
+
+    The log is decompressed to a temporary file and then imported, so it is
+    (re)compressed using the compression settings of to_manager.
+
+    Returns:
+      size of the uncompressed log, in bytes
+    """
+    src = await from_manager.get_log(codebase, run_id, name, timeout=timeout)
+    ctime = await from_manager.get_ctime(codebase, run_id, name)
+    with tempfile.TemporaryDirectory() as td:
+        path = os.path.join(td, name)
+        with src, open(path, "wb") as f:
+            await asyncio.to_thread(shutil.copyfileobj, src, f, COMPRESSION_CHUNK_SIZE)
+            size = f.tell()
+        await to_manager.import_log(
+            codebase,
+            run_id,
+            path,
+            timeout=timeout,
+            mtime=int(ctime.timestamp()),
+            basename=name,
+        )
+    return size
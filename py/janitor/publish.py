@@ -25,11 +25,12 @@ import asyncio
 import json
 import logging
 import os
+import struct
 import sys
 import time
 import uuid
 import warnings
-from collections.abc import AsyncIterable, Iterator
+from collections.abc import AsyncIterable, Generator, Iterator
 from contextlib import AsyncExitStack
 from dataclasses import dataclass
 from datetime import datetime, timedelta
@@ -100,6 +101,15 @@ override_launchpad_consumer_name()
 
 
 EXISTING_RUN_RETRY_INTERVAL = 30
+# Number of publish requests a pooled worker process handles before it is
+# replaced
+DEFAULT_WORKER_MAX_JOBS = 100
+# Time to wait for a pooled worker process to exit before killing it
+WORKER_SHUTDOWN_TIMEOUT = 10
+# Number of merge proposals on a single forge that are checked at once
+MP_SCAN_CONCURRENCY_PER_FORGE = 4
+# Number of publish ready runs to fetch at once
+PUBLISH_READY_BATCH_SIZE = 100
 
 MODE_SKIP = "skip"
 MODE_BUILD_ONLY = "build-only"
@@ -206,6 +216,7 @@ unexpected_http_response_count = Counter(
 
 
 CLOSED_STATUSES = ["closed", "abandoned", "rejected", "applied"]
+MP_STATUSES = ["open", "closed", "merged", "applied", "abandoned", "rejected"]
 
 
 logger = logging.getLogger("janitor.publish")
@@ -282,6 +293,154 @@ async def run_worker_process(args, request, *, encoding="utf-8"):
     raise WorkerInvalidResponse(stderr.decode(encoding))
 
 
+class PooledWorkerProcess:
+    """A long-lived publish worker process.
+
+    Requests and responses are exchanged over the process' stdin and stdout
+    as JSON documents, each preceded by its length as a 32-bit big-endian
+    integer.
+    """
+
+    def __init__(self, process) -> None:
+        self.process = process
+        self.jobs = 0
+
+    @classmethod
+    async def start(cls, args):
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+        return cls(process)
+
+    async def request(self, request, *, encoding="utf-8"):
+        body = json.dumps(request).encode(encoding)
+        self.process.stdin.write(struct.pack(">I", len(body)) + body)
+        await self.process.stdin.drain()
+        (length,) = struct.unpack(">I", await self.process.stdout.readexactly(4))
+        frame = json.loads(await self.process.stdout.readexactly(length))
+        return frame["returncode"], frame["response"]
+
+    def rss(self) -> Optional[int]:
+        """Return the resident set size of the process, in bytes, if known."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    async def close(self) -> None:
+        if self.process.returncode is None:
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), WORKER_SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.kill()
+        await self.process.wait()
+
+    def kill(self) -> None:
+        if self.process.returncode is None:
+            self.process.kill()
+
+
+class PublishWorkerPool:
+    """Pool of long-lived publish worker processes.
+
+    This avoids the startup cost of a new process for every publish. Every
+    request is handled by a single process, so a crash only affects the
+    request it was handling; the process is then replaced.
+
+    Args:
+      args: Command to run a worker process in serve mode
+      size: Maximum number of worker processes
+      max_jobs: Number of requests after which a process is replaced
+      max_rss: Resident set size in bytes after which a process is replaced
+    """
+
+    def __init__(
+        self,
+        args: list[str],
+        size: int,
+        *,
+        max_jobs: Optional[int] = DEFAULT_WORKER_MAX_JOBS,
+        max_rss: Optional[int] = None,
+    ) -> None:
+        self.args = args
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle: list[PooledWorkerProcess] = []
+
+    def _worn_out(self, worker: PooledWorkerProcess) -> bool:
+        if self.max_jobs is not None and worker.jobs >= self.max_jobs:
+            return True
+        if self.max_rss is not None:
+            rss = worker.rss()
+            if rss is not None and rss > self.max_rss:
+                logger.info(
+                    "Replacing publish worker %d; RSS %d exceeds %d",
+                    worker.process.pid,
+                    rss,
+                    self.max_rss,
+                )
+                return True
+        return False
+
+    async def run(self, request):
+        """Handle a request in one of the worker processes.
+
+        Returns:
+          tuple with return code (0 on success, 1 on failure) and response
+
+        Raises:
+          WorkerInvalidResponse: if the worker crashed or its response
+            could not be parsed
+        """
+        async with self._semaphore:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.returncode is None:
+                    break
+                await worker.close()
+            else:
+                worker = await PooledWorkerProcess.start(self.args)
+            try:
+                returncode, response = await worker.request(request)
+            except (
+                asyncio.IncompleteReadError,
+                BrokenPipeError,
+                ConnectionResetError,
+                ValueError,
+                KeyError,
+                TypeError,
+            ) as e:
+                worker.kill()
+                await worker.close()
+                raise WorkerInvalidResponse(
+                    f"publish worker {worker.process.pid} failed: "
+                    f"{type(e).__name__}: {e}"
+                ) from e
+            except BaseException:
+                # The worker is left in an unknown state, e.g. on cancellation.
+                worker.kill()
+                await worker.close()
+                raise
+            worker.jobs += 1
+            if self._worn_out(worker):
+                await worker.close()
+            else:
+                self._idle.append(worker)
+            return returncode, response
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*[worker.close() for worker in idle])
+
+
 class PublishWorker:
     def __init__(
         self,
@@ -291,12 +450,35 @@ class PublishWorker:
         template_env_path: Optional[str] = None,
         external_url: Optional[str] = None,
         differ_url: Optional[str] = None,
+        pool_size: int = 0,
+        pool_max_jobs: Optional[int] = DEFAULT_WORKER_MAX_JOBS,
+        pool_max_rss: Optional[int] = None,
     ) -> None:
         self.template_env_path = template_env_path
         self.external_url = external_url
         self.differ_url = differ_url
         self.lock_manager = lock_manager
         self.redis = redis
+        if pool_size:
+            self.pool: Optional[PublishWorkerPool] = PublishWorkerPool(
+                self._worker_args() + ["--serve"],
+                pool_size,
+                max_jobs=pool_max_jobs,
+                max_rss=pool_max_rss,
+            )
+        else:
+            self.pool = None
+
+    def _worker_args(self) -> list[str]:
+        args = ["janitor-publish-one"]
+
+        if self.template_env_path:
+            args.append(f"--template-env-path={self.template_env_path}")
+        return args
+
+    async def close(self) -> None:
+        if self.pool is not None:
+            await self.pool.close()
 
     async def publish_one(
         self,
@@ -362,11 +544,6 @@ class PublishWorker:
         else:
             request["tags"] = {}
 
-        args = [sys.executable, "-m", "janitor.publish_one"]
-
-        if self.template_env_path:
-            args.append(f"--template-env-path={self.template_env_path}")
-
         try:
             async with AsyncExitStack() as es:
                 if self.lock_manager:
@@ -374,7 +551,12 @@ class PublishWorker:
                         await self.lock_manager.lock(f"publish:{target_branch_url}")
                     )
                 try:
-                    returncode, response = await run_worker_process(args, request)
+                    if self.pool is not None:
+                        returncode, response = await self.pool.run(request)
+                    else:
+                        returncode, response = await run_worker_process(
+                            self._worker_args(), request
+                        )
                 except WorkerInvalidResponse as e:
                     raise PublishFailure(
                         mode, "publisher-invalid-response", e.output
@@ -579,43 +761,74 @@ async def iter_publish_ready(
         ],
     ]
 ]:
-    args: list[Any] = []
-    query = """
-SELECT * FROM publish_ready
-"""
-    conditions = []
-    if run_id is not None:
-        args.append(run_id)
-        conditions.append(f"id = ${len(args)}")
-    conditions.append("publish_status = 'approved'")
-    conditions.append("change_set_state IN ('ready', 'publishing')")
-
-    any_publishable_branches = (
-        "exists (select from unnest(unpublished_branches) where "
-        "mode in ('propose', 'attempt-push', 'push-derived', 'push'))"
-    )
+    """Iterate over the runs that are ready to be published.
 
-    conditions.append(any_publishable_branches)
+    The runs are taken from the publish_ready_run table a batch at a time,
+    most important first, and only then looked up in publish_ready.
+    """
+    if run_id is not None:
+        for record in await _fetch_publish_ready(conn, [run_id]):
+            yield _publish_ready_entry(record)
+        return
 
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
+    last = None
+    while True:
+        if last is None:
+            keys = await conn.fetch(
+                "SELECT run_id, publishing, value, finish_time "
+                "FROM publish_ready_run "
+                "ORDER BY publishing DESC, value DESC, finish_time DESC, "
+                "run_id DESC LIMIT $1",
+                PUBLISH_READY_BATCH_SIZE,
+            )
+        else:
+            keys = await conn.fetch(
+                "SELECT run_id, publishing, value, finish_time "
+                "FROM publish_ready_run "
+                "WHERE (publishing, value, finish_time, run_id) < ($1, $2, $3, $4) "
+                "ORDER BY publishing DESC, value DESC, finish_time DESC, "
+                "run_id DESC LIMIT $5",
+                *last,
+                PUBLISH_READY_BATCH_SIZE,
+            )
+        if not keys:
+            return
+        last = (
+            keys[-1]["publishing"],
+            keys[-1]["value"],
+            keys[-1]["finish_time"],
+            keys[-1]["run_id"],
+        )
+        position = {key["run_id"]: i for i, key in enumerate(keys)}
+        # This skips runs that stopped being publishable since the keys
+        # were fetched.
+        records = await _fetch_publish_ready(conn, list(position))
+        records.sort(key=lambda record: position[record["id"]])
+        for record in records:
+            yield _publish_ready_entry(record)
+        if len(keys) < PUBLISH_READY_BATCH_SIZE:
+            return
 
-    order_by = ["change_set_state = 'publishing' DESC"]
 
-    order_by.extend(["value DESC NULLS LAST", "finish_time DESC"])
+async def _fetch_publish_ready(conn: asyncpg.Connection, run_ids: list[str]):
+    query = """
+SELECT * FROM publish_ready
+WHERE id = ANY($1::text[])
+AND publish_status = 'approved'
+AND change_set_state IN ('ready', 'publishing')
+AND exists (select from unnest(unpublished_branches) where
+    mode in ('propose', 'attempt-push', 'push-derived', 'push'))
+"""
+    return await conn.fetch(query, run_ids)
 
-    if order_by:
-        query += " ORDER BY " + ", ".join(order_by) + " "
 
-    for record in await conn.fetch(query, *args):
-        yield tuple(  # type: ignore
-            [
-                state.Run.from_row(record),
-                record["rate_limit_bucket"],
-                record["policy_command"],
-                record["unpublished_branches"],
-            ]
-        )
+def _publish_ready_entry(record):
+    return (
+        state.Run.from_row(record),
+        record["rate_limit_bucket"],
+        record["policy_command"],
+        record["unpublished_branches"],
+    )
 
 
 async def publish_pending_ready(
@@ -1839,17 +2052,16 @@ async def get_mp_status(mp):
 @routes.post("/scan", name="scan")
 async def scan_request(request):
     async def scan():
-        async with request.app["db"].acquire() as conn:
-            await check_existing(
-                conn=conn,
-                redis=request.app["redis"],
-                config=request.app["config"],
-                publish_worker=request.app["publish_worker"],
-                bucket_rate_limiter=request.app["bucket_rate_limiter"],
-                forge_rate_limiter=request.app["forge_rate_limiter"],
-                vcs_managers=request.app["vcs_managers"],
-                modify_limit=request.app["modify_mp_limit"],
-            )
+        await check_existing(
+            db=request.app["db"],
+            redis=request.app["redis"],
+            config=request.app["config"],
+            publish_worker=request.app["publish_worker"],
+            bucket_rate_limiter=request.app["bucket_rate_limiter"],
+            forge_rate_limiter=request.app["forge_rate_limiter"],
+            vcs_managers=request.app["vcs_managers"],
+            modify_limit=request.app["modify_mp_limit"],
+        )
 
     await spawn(request, scan())
     return web.Response(status=202, text="Scan started.")
@@ -2135,20 +2347,25 @@ async def process_queue_loop(
     push_limit: Optional[int] = None,
     modify_mp_limit: Optional[int] = None,
     require_binary_diff: bool = False,
+    full_scan_interval: Optional[timedelta] = None,
 ):
+    # Time of the last full scan of each forge
+    full_scans: dict[Forge, datetime] = {}
     while True:
         cycle_start = datetime.utcnow()
+        await check_existing(
+            db=db,
+            redis=redis,
+            config=config,
+            publish_worker=publish_worker,
+            bucket_rate_limiter=bucket_rate_limiter,
+            forge_rate_limiter=forge_rate_limiter,
+            vcs_managers=vcs_managers,
+            modify_limit=modify_mp_limit,
+            full_scans=full_scans,
+            full_scan_interval=full_scan_interval,
+        )
         async with db.acquire() as conn:
-            await check_existing(
-                conn=conn,
-                redis=redis,
-                config=config,
-                publish_worker=publish_worker,
-                bucket_rate_limiter=bucket_rate_limiter,
-                forge_rate_limiter=forge_rate_limiter,
-                vcs_managers=vcs_managers,
-                modify_limit=modify_mp_limit,
-            )
             await check_stragglers(conn, redis)
         if auto_publish:
             await publish_pending_ready(
@@ -2579,6 +2796,7 @@ async def check_existing_mp(
     possible_transports: Optional[list[Transport]] = None,
     check_only: bool = False,
     close_below_threshold: bool = True,
+    publish_lock: Optional[asyncio.Lock] = None,
 ) -> bool:
     proposal_info_manager = ProposalInfoManager(conn, redis)
     old_proposal_info = await proposal_info_manager.get_proposal_info(mp.url)
@@ -3030,38 +3248,64 @@ This merge proposal will be closed, since the branch has moved to {last_run.bran
             last_run.main_branch_revision.decode("utf-8"),
         )
 
+        allow_create_proposal = True
+        reserved = False
+        if rate_limit_bucket:
+            # Reserve a slot in the bucket in case a new proposal gets
+            # created, so that concurrent checks can't together exceed the
+            # bucket limit. The lock only covers the check and the
+            # reservation, not the publishing itself.
+            async with AsyncExitStack() as es:
+                if publish_lock is not None:
+                    await es.enter_async_context(publish_lock)
+                try:
+                    bucket_rate_limiter.check_allowed(rate_limit_bucket)
+                except RateLimited:
+                    allow_create_proposal = False
+                else:
+                    bucket_rate_limiter.inc(rate_limit_bucket)
+                    reserved = True
+
         try:
-            publish_result = await publish_worker.publish_one(
-                campaign=last_run.campaign,
-                codebase=last_run.codebase,
-                extra_context={},
-                command=last_run.command,
-                codemod_result=last_run.result,
-                target_branch_url=target_branch_url,
-                mode=MODE_PROPOSE,
-                role=mp_run["role"],
-                revision=last_run_revision,
-                log_id=last_run.id,
-                unchanged_id=unchanged_run_id,
-                derived_branch_name=source_branch_name,
-                rate_limit_bucket=rate_limit_bucket,
-                vcs_manager=vcs_managers[last_run.vcs_type],
-                require_binary_diff=False,
-                allow_create_proposal=True,
-                bucket_rate_limiter=bucket_rate_limiter,
-                result_tags=last_run.result_tags,
-                commit_message_template=(
-                    campaign_config.merge_proposal.commit_message
-                    if campaign_config.merge_proposal
-                    else None
-                ),
-                title_template=(
-                    campaign_config.merge_proposal.title
-                    if campaign_config.merge_proposal
-                    else None
-                ),
-                existing_mp_url=mp.url,
-            )
+            is_new = False
+            try:
+                publish_result = await publish_worker.publish_one(
+                    campaign=last_run.campaign,
+                    codebase=last_run.codebase,
+                    extra_context={},
+                    command=last_run.command,
+                    codemod_result=last_run.result,
+                    target_branch_url=target_branch_url,
+                    mode=MODE_PROPOSE,
+                    role=mp_run["role"],
+                    revision=last_run_revision,
+                    log_id=last_run.id,
+                    unchanged_id=unchanged_run_id,
+                    derived_branch_name=source_branch_name,
+                    rate_limit_bucket=rate_limit_bucket,
+                    vcs_manager=vcs_managers[last_run.vcs_type],
+                    require_binary_diff=False,
+                    allow_create_proposal=allow_create_proposal,
+                    # A reserved slot has already been counted.
+                    bucket_rate_limiter=None if reserved else bucket_rate_limiter,
+                    result_tags=last_run.result_tags,
+                    commit_message_template=(
+                        campaign_config.merge_proposal.commit_message
+                        if campaign_config.merge_proposal
+                        else None
+                    ),
+                    title_template=(
+                        campaign_config.merge_proposal.title
+                        if campaign_config.merge_proposal
+                        else None
+                    ),
+                    existing_mp_url=mp.url,
+                )
+                is_new = bool(publish_result.is_new)
+            finally:
+                if reserved and not is_new:
+                    # No new proposal was created, so give the slot back.
+                    bucket_rate_limiter.dec(rate_limit_bucket)
         except BranchBusy as e:
             logger.info("%s: Branch %r was busy while publishing", mp.url, e.branch_url)
             return False
@@ -3192,87 +3436,140 @@ applied independently.
         return False
 
 
+def iter_forge_mps(
+    instance: Forge,
+    statuses: Optional[list[str]] = None,
+) -> Generator[tuple[MergeProposal, str], None, bool]:
+    """Iterate over the existing merge proposals on a single forge.
+
+    Returns:
+      whether all merge proposals were listed, i.e. the listing was not cut
+      short by an error
+    """
+    if statuses is None:
+        statuses = ["open", "merged", "closed"]
+    complete = True
+    for status in statuses:
+        try:
+            for mp in instance.iter_my_proposals(status=status):
+                yield mp, status
+        except ForgeLoginRequired:
+            logger.info("Skipping %r, no credentials known.", instance)
+            complete = False
+        except UnexpectedHttpStatus as e:
+            logger.warning("Got unexpected HTTP status %s, skipping %r", e, instance)
+            complete = False
+        except UnsupportedForge as e:
+            logger.warning("Unsupported host instance, skipping %r: %s", instance, e)
+            complete = False
+    return complete
+
+
 def iter_all_mps(
     statuses: Optional[list[str]] = None,
 ) -> Iterator[tuple[Forge, MergeProposal, str]]:
     """Iterate over all existing merge proposals."""
-    if statuses is None:
-        statuses = ["open", "merged", "closed"]
     for instance in iter_forge_instances():
-        for status in statuses:
-            try:
-                for mp in instance.iter_my_proposals(status=status):
-                    yield instance, mp, status
-            except ForgeLoginRequired:
-                logger.info("Skipping %r, no credentials known.", instance)
-            except UnexpectedHttpStatus as e:
-                logger.warning(
-                    "Got unexpected HTTP status %s, skipping %r", e, instance
-                )
-            except UnsupportedForge as e:
-                logger.warning(
-                    "Unsupported host instance, skipping %r: %s", instance, e
-                )
+        for mp, status in iter_forge_mps(instance, statuses):
+            yield instance, mp, status
 
 
-async def check_existing(
-    *,
-    conn,
-    redis,
-    config,
-    publish_worker,
-    bucket_rate_limiter,
-    forge_rate_limiter: dict[Forge, datetime],
-    vcs_managers,
-    modify_limit=None,
-    unexpected_limit: int = 5,
-):
-    mps_per_bucket: dict[str, dict[str, int]] = {
-        "open": {},
-        "closed": {},
-        "merged": {},
-        "applied": {},
-        "abandoned": {},
-        "rejected": {},
-    }
-    possible_transports: list[Transport] = []
-    status_count = {
-        "open": 0,
-        "closed": 0,
-        "merged": 0,
-        "applied": 0,
-        "abandoned": 0,
-        "rejected": 0,
-    }
+class TooManyUnexpectedResponses(Exception):
+    """Too many unexpected HTTP responses were seen during a scan."""
 
-    modified_mps = 0
-    unexpected = 0
-    check_only = False
-    was_forge_ratelimited = False
 
-    for forge, mp, status in iter_all_mps():
-        status_count[status] += 1
-        if forge in forge_rate_limiter:
-            if datetime.utcnow() < forge_rate_limiter[forge]:
-                del forge_rate_limiter[forge]
-            else:
-                forge_rate_limited_count.labels(forge=str(forge)).inc()
-                was_forge_ratelimited = True
-                continue
+class ExistingMergeProposalScan:
+    """State of a scan of the existing merge proposals on all forges.
+
+    Every forge is scanned in its own task, with its own bounded number of
+    merge proposals being checked at once. If a forge rate limits us, only
+    the scan of that forge is stopped.
+
+    Forges that have had a full scan within full_scan_interval are scanned
+    incrementally: only their open merge proposals are listed, and merge
+    proposals that we still consider open but that are no longer listed are
+    looked up individually.
+    """
+
+    def __init__(
+        self,
+        *,
+        db,
+        redis,
+        config,
+        publish_worker,
+        bucket_rate_limiter,
+        forge_rate_limiter: dict[Forge, datetime],
+        vcs_managers,
+        modify_limit=None,
+        unexpected_limit: int = 5,
+        concurrency_per_forge: int = MP_SCAN_CONCURRENCY_PER_FORGE,
+        full_scans: Optional[dict[Forge, datetime]] = None,
+        full_scan_interval: Optional[timedelta] = None,
+    ) -> None:
+        self.db = db
+        self.redis = redis
+        self.config = config
+        self.publish_worker = publish_worker
+        self.bucket_rate_limiter = bucket_rate_limiter
+        self.forge_rate_limiter = forge_rate_limiter
+        self.vcs_managers = vcs_managers
+        self.modify_limit = modify_limit
+        self.unexpected_limit = unexpected_limit
+        self.concurrency_per_forge = concurrency_per_forge
+        self.full_scans = full_scans
+        self.full_scan_interval = full_scan_interval
+        self.mps_per_bucket: dict[str, dict[str, int]] = {
+            status: {} for status in MP_STATUSES
+        }
+        self.status_count = {status: 0 for status in MP_STATUSES}
+        self.modified_mps = 0
+        self.unexpected = 0
+        self.check_only = False
+        self.was_forge_ratelimited = False
+        self.incremental = False
+        # Serializes checking the bucket rate limiter and reserving a slot in
+        # it, so that concurrent checks see each other's reservations.
+        self.publish_lock = asyncio.Lock()
+
+    def needs_full_scan(self, forge: Forge) -> bool:
+        if self.full_scans is None or self.full_scan_interval is None:
+            return True
         try:
-            modified = await check_existing_mp(
-                conn=conn,
-                redis=redis,
-                config=config,
-                publish_worker=publish_worker,
-                mp=mp,
-                status=status,
-                vcs_managers=vcs_managers,
-                bucket_rate_limiter=bucket_rate_limiter,
-                possible_transports=possible_transports,
-                mps_per_bucket=mps_per_bucket,
-                check_only=check_only,
-            )
+            last_full_scan = self.full_scans[forge]
+        except KeyError:
+            return True
+        return datetime.utcnow() - last_full_scan >= self.full_scan_interval
+
+    def is_rate_limited(self, forge: Forge) -> bool:
+        try:
+            until = self.forge_rate_limiter[forge]
+        except KeyError:
+            return False
+        if datetime.utcnow() >= until:
+            del self.forge_rate_limiter[forge]
+            return False
+        forge_rate_limited_count.labels(forge=str(forge)).inc()
+        self.was_forge_ratelimited = True
+        return True
+
+    async def check(self, forge: Forge, mp, status, possible_transports) -> None:
+        try:
+            async with self.db.acquire() as conn:
+                modified = await check_existing_mp(
+                    conn=conn,
+                    redis=self.redis,
+                    config=self.config,
+                    publish_worker=self.publish_worker,
+                    mp=mp,
+                    status=status,
+                    vcs_managers=self.vcs_managers,
+                    bucket_rate_limiter=self.bucket_rate_limiter,
+                    possible_transports=possible_transports,
+                    mps_per_bucket=self.mps_per_bucket,
+                    check_only=self.check_only,
+                    publish_lock=self.publish_lock,
+                )
         except NoRunForMergeProposal as e:
             logger.warning("Unable to find metadata for %s, skipping.", e.mp.url)
             modified = False
@@ -3283,12 +3580,8 @@ async def check_existing(
             logger.warning(
                 "Rate-limited accessing %s. Skipping %r for this cycle.", mp.url, forge
             )
-            if e.retry_after is None:
-                retry_after = timedelta(minutes=30)
-            else:
-                retry_after = timedelta(seconds=e.retry_after)
-            forge_rate_limiter[forge] = datetime.utcnow() + retry_after
-            continue
+            self.rate_limit(forge, e.retry_after)
+            return
         except UnexpectedHttpStatus as e:
             logger.warning(
                 "Got unexpected HTTP status %s, skipping %r",
@@ -3297,37 +3590,231 @@ async def check_existing(
                 extra={"mp_url": mp.url},
             )
             # TODO(jelmer): print traceback?
-            unexpected += 1
+            self.unexpected += 1
+            modified = False
+
+        if self.unexpected > self.unexpected_limit:
+            raise TooManyUnexpectedResponses(self.unexpected)
 
-        if unexpected > unexpected_limit:
+        if modified:
+            self.modified_mps += 1
+            if self.modify_limit and self.modified_mps > self.modify_limit:
+                if not self.check_only:
+                    logger.warning(
+                        "Already modified %d merge proposals, waiting with the rest.",
+                        self.modified_mps,
+                    )
+                self.check_only = True
+
+    def rate_limit(self, forge: Forge, retry_after: Optional[int]) -> None:
+        if retry_after is None:
+            delay = timedelta(minutes=30)
+        else:
+            delay = timedelta(seconds=retry_after)
+        self.forge_rate_limiter[forge] = datetime.utcnow() + delay
+        self.was_forge_ratelimited = True
+
+    async def iter_vanished_mps(self, forge: Forge, seen: set[str]):
+        """Find merge proposals on a forge that are no longer open.
+
+        Args:
+          forge: forge to look on
+          seen: URLs of the merge proposals that the forge listed as open
+        Returns:
+          iterator over (merge proposal, status) tuples
+        """
+        # Merge proposals may live on a subdomain of the forge, e.g.
+        # code.launchpad.net.
+        host = urlutils.parse_url(forge.base_url)[3]
+        async with self.db.acquire() as conn:
+            urls = [
+                row["url"]
+                for row in await conn.fetch(
+                    "SELECT url FROM ("
+                    "SELECT url, substring(url, '.*://(?:[^/@]*@)?([^/:]*)') AS host "
+                    "FROM merge_proposal WHERE status = 'open' "
+                    "AND NOT url = ANY($1::text[])) AS mp "
+                    "WHERE host = $2 OR host LIKE '%.' || $2",
+                    list(seen),
+                    host,
+                )
+            ]
+        for url in urls:
+            if self.is_rate_limited(forge):
+                return
+            try:
+                mp = await asyncio.to_thread(forge.get_proposal_by_url, url)
+                status = await get_mp_status(mp)
+            except UnsupportedForge:
+                # Hosted on a different forge
+                continue
+            except ForgeLoginRequired:
+                logger.info("Skipping %r, no credentials known.", forge)
+                return
+            except BranchRateLimited as e:
+                logger.warning(
+                    "Rate-limited accessing %s. Skipping %r for this cycle.",
+                    url,
+                    forge,
+                )
+                self.rate_limit(forge, e.retry_after)
+                return
+            except UnexpectedHttpStatus as e:
+                logger.warning(
+                    "Got unexpected HTTP status %s, skipping %r",
+                    e,
+                    url,
+                    extra={"mp_url": url},
+                )
+                self.unexpected += 1
+                if self.unexpected > self.unexpected_limit:
+                    raise TooManyUnexpectedResponses(self.unexpected) from e
+                continue
+            yield mp, status
+
+    async def scan_forge(self, forge: Forge) -> None:
+        queue: asyncio.Queue = asyncio.Queue(self.concurrency_per_forge)
+        started = datetime.utcnow()
+        full = self.needs_full_scan(forge)
+        if not full:
+            self.incremental = True
+        listing_complete = False
+
+        def next_mp(mps):
+            nonlocal listing_complete
+            try:
+                return next(mps)
+            except StopIteration as e:
+                listing_complete = e.value
+                return None
+
+        async def feed():
+            seen: set[str] = set()
+            mps = iter_forge_mps(forge, None if full else ["open"])
+            while not self.is_rate_limited(forge):
+                # The forge API is blocking, and fetches proposals a page
+                # at a time.
+                item = await asyncio.to_thread(next_mp, mps)
+                if item is None:
+                    # Merge proposals that were missing from an incomplete
+                    # listing haven't necessarily vanished.
+                    if not full and listing_complete:
+                        async for item in self.iter_vanished_mps(forge, seen):
+                            self.status_count[item[1]] += 1
+                            await queue.put(item)
+                    break
+                seen.add(item[0].url)
+                self.status_count[item[1]] += 1
+                await queue.put(item)
+            for _ in range(self.concurrency_per_forge):
+                await queue.put(None)
+
+        async def work():
+            possible_transports: list[Transport] = []
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if forge in self.forge_rate_limiter:
+                    continue
+                mp, status = item
+                await self.check(forge, mp, status, possible_transports)
+
+        tasks = [asyncio.create_task(feed())] + [
+            asyncio.create_task(work()) for _ in range(self.concurrency_per_forge)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        if (
+            full
+            and listing_complete
+            and self.full_scans is not None
+            and forge not in self.forge_rate_limiter
+        ):
+            self.full_scans[forge] = started
+
+    async def run(self) -> bool:
+        """Scan all forges.
+
+        Returns:
+          whether the scan completed
+        """
+        tasks = [
+            asyncio.create_task(self.scan_forge(forge))
+            for forge in await asyncio.to_thread(list, iter_forge_instances())
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except TooManyUnexpectedResponses:
             unexpected_http_response_count.inc()
             logger.warning(
                 "Saw %d unexpected HTTP responses, over threshold of %d. "
                 "Giving up for now.",
-                unexpected,
-                unexpected_limit,
+                self.unexpected,
+                self.unexpected_limit,
             )
-            return
+            return False
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return True
 
-        if modified:
-            modified_mps += 1
-            if modify_limit and modified_mps > modify_limit:
-                logger.warning(
-                    "Already modified %d merge proposals, waiting with the rest.",
-                    modified_mps,
-                )
-                check_only = True
 
-    logger.info("Successfully scanned existing merge proposals")
+async def check_existing(
+    *,
+    db,
+    redis,
+    config,
+    publish_worker,
+    bucket_rate_limiter,
+    forge_rate_limiter: dict[Forge, datetime],
+    vcs_managers,
+    modify_limit=None,
+    unexpected_limit: int = 5,
+    concurrency_per_forge: int = MP_SCAN_CONCURRENCY_PER_FORGE,
+    full_scans: Optional[dict[Forge, datetime]] = None,
+    full_scan_interval: Optional[timedelta] = None,
+):
+    scan = ExistingMergeProposalScan(
+        db=db,
+        redis=redis,
+        config=config,
+        publish_worker=publish_worker,
+        bucket_rate_limiter=bucket_rate_limiter,
+        forge_rate_limiter=forge_rate_limiter,
+        vcs_managers=vcs_managers,
+        modify_limit=modify_limit,
+        unexpected_limit=unexpected_limit,
+        concurrency_per_forge=concurrency_per_forge,
+        full_scans=full_scans,
+        full_scan_interval=full_scan_interval,
+    )
+    if not await scan.run():
+        return
+
+    logger.info(
+        "Successfully scanned existing merge proposals%s",
+        " (incremental)" if scan.incremental else "",
+    )
     last_scan_existing_success.set_to_current_time()
 
-    if not was_forge_ratelimited:
-        for status, count in status_count.items():
-            merge_proposal_count.labels(status=status).set(count)
+    if not scan.was_forge_ratelimited:
+        if scan.incremental:
+            # Only the open merge proposals were listed; the other counts
+            # come from the database, which has just been brought up to date.
+            merge_proposal_count.labels(status="open").set(scan.status_count["open"])
+            await refresh_bucket_mp_counts(db, bucket_rate_limiter)
+        else:
+            for status, count in scan.status_count.items():
+                merge_proposal_count.labels(status=status).set(count)
 
-        bucket_rate_limiter.set_mps_per_bucket(mps_per_bucket)
+            bucket_rate_limiter.set_mps_per_bucket(scan.mps_per_bucket)
         total = 0
-        for bucket, count in mps_per_bucket["open"].items():
+        for bucket, count in scan.mps_per_bucket["open"].items():
             total += count
             if bucket is not None:
                 bucket_proposal_count.labels(bucket=bucket).set(count)
@@ -3521,6 +4008,16 @@ async def main_async(argv=None):
         help=("Seconds to wait in between publishing pending proposals"),
         default=7200,
     )
+    parser.add_argument(
+        "--full-scan-interval",
+        type=int,
+        help=(
+            "Seconds in between full scans of the merge proposals on a forge; "
+            "other cycles only scan open merge proposals (0 to always do a "
+            "full scan)"
+        ),
+        default=86400,
+    )
     parser.add_argument(
         "--no-auto-publish",
         action="store_true",
@@ -3554,6 +4051,24 @@ async def main_async(argv=None):
     parser.add_argument(
         "--template-env-path", type=str, help="Path to merge proposal templates"
     )
+    parser.add_argument(
+        "--worker-pool-size",
+        type=int,
+        default=0,
+        help="Number of long-lived publish worker processes to keep "
+        "(0 to start a new process for every publish)",
+    )
+    parser.add_argument(
+        "--worker-max-jobs",
+        type=int,
+        default=DEFAULT_WORKER_MAX_JOBS,
+        help="Number of publishes after which a pooled worker is replaced",
+    )
+    parser.add_argument(
+        "--worker-max-rss",
+        type=int,
+        help="Memory use (in MiB) above which a pooled worker is replaced",
+    )
     parser.add_argument(
         "--gcp-logging", action="store_true", help="Use Google cloud logging"
     )
@@ -3615,7 +4130,13 @@ async def main_async(argv=None):
             differ_url=args.differ_url,
             lock_manager=lock_manager,
             redis=redis,
+            pool_size=args.worker_pool_size,
+            pool_max_jobs=args.worker_max_jobs,
+            pool_max_rss=(
+                args.worker_max_rss * 1024 * 1024 if args.worker_max_rss else None
+            ),
         )
+        stack.push_async_callback(publish_worker.close)
 
         if args.once:
             await publish_pending_ready(
@@ -3647,6 +4168,11 @@ async def main_async(argv=None):
                         push_limit=args.push_limit,
                         modify_mp_limit=args.modify_mp_limit,
                         require_binary_diff=args.require_binary_diff,
+                        full_scan_interval=(
+                            timedelta(seconds=args.full_scan_interval)
+                            if args.full_scan_interval
+                            else None
+                        ),
                     )
                 ),
                 loop.create_task(
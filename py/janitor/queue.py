@@ -15,11 +15,42 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+from bisect import bisect_left
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
 from datetime import timedelta
 from typing import Any, Optional
 
 import asyncpg
 
+# Order of the values of the queue_bucket enum in the database
+QUEUE_BUCKETS = [
+    "update-existing-mp",
+    "manual",
+    "control",
+    "hook",
+    "reschedule",
+    "update-new-mp",
+    "missing-deps",
+    "default",
+]
+_BUCKET_INDEX = {bucket: i for (i, bucket) in enumerate(QUEUE_BUCKETS)}
+
+# How long a claim on a queue item lasts before other claimers can pick
+# it up again.
+DEFAULT_CLAIM_LEASE = timedelta(minutes=5)
+
+
+def _vcs_info_from_row(row) -> dict[str, str]:
+    vcs_info = {}
+    if row["branch_url"]:
+        vcs_info["branch_url"] = row["branch_url"]
+    if row["subpath"] is not None:
+        vcs_info["subpath"] = row["subpath"]
+    if row["vcs_type"]:
+        vcs_info["vcs_type"] = row["vcs_type"]
+    return vcs_info
+
 
 class QueueItem:
     __slots__ = [
@@ -83,16 +114,311 @@ class QueueItem:
         return hash((type(self), self.id))
 
 
+def _position_key(bucket: str, priority: int, queue_id: int) -> int:
+    # Pack the (bucket, priority, id) ordering of the queue into a single
+    # integer; this keeps the index small for large queues.
+    return (_BUCKET_INDEX[bucket] << 96) | ((priority + (1 << 63)) << 32) | queue_id
+
+
+class QueuePositionIndex:
+    """In-memory index of queue positions.
+
+    The queue is kept sorted by (bucket, priority, id) in blocks, with
+    Fenwick trees over the number of items and the sum of estimated durations
+    per block. This allows looking up the position and cumulative wait time
+    of an item in O(log n) rather than sorting the whole queue.
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self._build([])
+        # queue id => (key, campaign, codebase)
+        self._entries: dict[int, tuple[int, str, str]] = {}
+        # (campaign, codebase) => queue ids
+        self._by_candidate: dict[tuple[str, str], set[int]] = {}
+        # Changes made while load() is running; these are replayed on top
+        # of the freshly loaded snapshot.
+        self._replay: Optional[list[Callable[[], None]]] = None
+        # Changes waiting for a transaction on a connection to commit
+        self._pending: dict[Any, list[Callable[[QueuePositionIndex], None]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _build(self, entries: list[tuple[int, float]]) -> None:
+        self._blocks: list[list[int]] = []
+        self._durations: list[list[float]] = []
+        for i in range(0, len(entries), self.BLOCK_SIZE):
+            chunk = entries[i : i + self.BLOCK_SIZE]
+            self._blocks.append([key for (key, duration) in chunk])
+            self._durations.append([duration for (key, duration) in chunk])
+        self._rebuild_trees()
+
+    def _rebuild_trees(self) -> None:
+        self._block_max = [block[-1] for block in self._blocks]
+        n = len(self._blocks)
+        counts = [0] * (n + 1)
+        durations = [0.0] * (n + 1)
+        for i in range(1, n + 1):
+            counts[i] += len(self._blocks[i - 1])
+            durations[i] += sum(self._durations[i - 1])
+            j = i + (i & -i)
+            if j <= n:
+                counts[j] += counts[i]
+                durations[j] += durations[i]
+        self._count_tree = counts
+        self._duration_tree = durations
+
+    def _tree_add(self, block: int, count: int, duration: float) -> None:
+        i = block + 1
+        while i < len(self._count_tree):
+            self._count_tree[i] += count
+            self._duration_tree[i] += duration
+            i += i & -i
+
+    def _tree_prefix(self, block: int) -> tuple[int, float]:
+        count = 0
+        duration = 0.0
+        i = block
+        while i > 0:
+            count += self._count_tree[i]
+            duration += self._duration_tree[i]
+            i -= i & -i
+        return count, duration
+
+    def _insert(self, key: int, duration: float) -> None:
+        if not self._blocks:
+            self._build([(key, duration)])
+            return
+        b = min(bisect_left(self._block_max, key), len(self._blocks) - 1)
+        block = self._blocks[b]
+        i = bisect_left(block, key)
+        block.insert(i, key)
+        self._durations[b].insert(i, duration)
+        if len(block) > 2 * self.BLOCK_SIZE:
+            half = len(block) // 2
+            durations = self._durations[b]
+            self._blocks[b : b + 1] = [block[:half], block[half:]]
+            self._durations[b : b + 1] = [durations[:half], durations[half:]]
+            self._rebuild_trees()
+        else:
+            self._block_max[b] = block[-1]
+            self._tree_add(b, 1, duration)
+
+    def _remove(self, key: int) -> None:
+        b = bisect_left(self._block_max, key)
+        block = self._blocks[b]
+        i = bisect_left(block, key)
+        assert block[i] == key, f"key {key} missing from queue position index"
+        del block[i]
+        duration = self._durations[b].pop(i)
+        if not block:
+            del self._blocks[b]
+            del self._durations[b]
+            self._rebuild_trees()
+        else:
+            self._block_max[b] = block[-1]
+            self._tree_add(b, -1, -duration)
+
+    def _rank(self, key: int) -> tuple[int, float]:
+        b = bisect_left(self._block_max, key)
+        count, duration = self._tree_prefix(b)
+        i = bisect_left(self._blocks[b], key)
+        return count + i, duration + sum(self._durations[b][:i])
+
+    def update(
+        self,
+        queue_id: int,
+        *,
+        bucket: str,
+        priority: int,
+        estimated_duration: Optional[timedelta],
+        campaign: str,
+        codebase: str,
+    ) -> None:
+        """Add or update a queue item."""
+        if self._replay is not None:
+            self._replay.append(
+                lambda: self.update(
+                    queue_id,
+                    bucket=bucket,
+                    priority=priority,
+                    estimated_duration=estimated_duration,
+                    campaign=campaign,
+                    codebase=codebase,
+                )
+            )
+        self._discard(queue_id)
+        key = _position_key(bucket, priority, queue_id)
+        self._insert(
+            key,
+            estimated_duration.total_seconds() if estimated_duration else 0.0,
+        )
+        self._entries[queue_id] = (key, campaign, codebase)
+        self._by_candidate.setdefault((campaign, codebase), set()).add(queue_id)
+
+    def remove(self, queue_id: int) -> None:
+        """Remove a queue item, if present."""
+        if self._replay is not None:
+            self._replay.append(lambda: self.remove(queue_id))
+        self._discard(queue_id)
+
+    def _discard(self, queue_id: int) -> None:
+        try:
+            (key, campaign, codebase) = self._entries.pop(queue_id)
+        except KeyError:
+            return
+        self._remove(key)
+        ids = self._by_candidate[(campaign, codebase)]
+        ids.remove(queue_id)
+        if not ids:
+            del self._by_candidate[(campaign, codebase)]
+
+    def remove_candidate(self, campaign: str, codebase: str) -> None:
+        """Remove all queue items for a codebase/campaign."""
+        for queue_id in list(self._by_candidate.get((campaign, codebase), [])):
+            self.remove(queue_id)
+
+    def get_position(
+        self, campaign: str, codebase: str
+    ) -> tuple[Optional[int], Optional[timedelta]]:
+        """Find the position of a codebase/campaign in the queue.
+
+        Returns:
+          tuple with position (1-based) and the sum of the estimated
+          durations of the items ahead of it
+        """
+        ids = self._by_candidate.get((campaign, codebase))
+        if not ids:
+            return (None, None)
+        count, duration = self._rank(min(self._entries[i][0] for i in ids))
+        return (count + 1, timedelta(seconds=duration))
+
+    def after_commit(
+        self,
+        conn: asyncpg.Connection,
+        change: Callable[["QueuePositionIndex"], None],
+    ) -> None:
+        """Apply a change once the current transaction on conn commits.
+
+        Inside a transaction started with transaction(), the change is held
+        back until that transaction commits and dropped if it is rolled back.
+        Otherwise it is applied immediately.
+        """
+        try:
+            pending = self._pending[conn]
+        except KeyError:
+            change(self)
+        else:
+            pending.append(change)
+
+    @asynccontextmanager
+    async def transaction(self, conn: asyncpg.Connection) -> AsyncIterator[None]:
+        """Start a transaction on conn, deferring index changes until commit."""
+        outermost = conn not in self._pending
+        pending = self._pending.setdefault(conn, [])
+        start = len(pending)
+        try:
+            async with conn.transaction():
+                yield
+        except BaseException:
+            del pending[start:]
+            raise
+        finally:
+            if outermost:
+                del self._pending[conn]
+        if outermost:
+            for change in pending:
+                change(self)
+
+    async def load(self, conn: asyncpg.Connection) -> None:
+        """(Re)load the index from the queue table.
+
+        Changes made to the index while the queue table is being read are
+        applied again on top of the new snapshot, since the snapshot may
+        predate them. Applying a change twice is harmless.
+        """
+        entries = []
+        by_candidate: dict[tuple[str, str], set[int]] = {}
+        keys: dict[int, tuple[int, str, str]] = {}
+        replay: list[Callable[[], None]] = []
+        self._replay = replay
+        try:
+            async with conn.transaction():
+                async for row in conn.cursor(
+                    "SELECT id, bucket, priority, estimated_duration, suite, codebase "
+                    "FROM queue",
+                    prefetch=10000,
+                ):
+                    key = _position_key(row["bucket"], row["priority"], row["id"])
+                    entries.append(
+                        (
+                            key,
+                            row["estimated_duration"].total_seconds()
+                            if row["estimated_duration"]
+                            else 0.0,
+                        )
+                    )
+                    keys[row["id"]] = (key, row["suite"], row["codebase"])
+                    by_candidate.setdefault((row["suite"], row["codebase"]), set()).add(
+                        row["id"]
+                    )
+        finally:
+            self._replay = None
+        entries.sort()
+        self._build(entries)
+        self._entries = keys
+        self._by_candidate = by_candidate
+        for change in replay:
+            change()
+        self.loaded = True
+
+
 class Queue:
-    def __init__(self, conn: asyncpg.Connection) -> None:
+    def __init__(
+        self,
+        conn: asyncpg.Connection,
+        position_index: Optional[QueuePositionIndex] = None,
+    ) -> None:
         self.conn = conn
+        self.position_index = position_index
+
+    def _after_commit(self, change: Callable[[QueuePositionIndex], None]) -> None:
+        if self.position_index is not None:
+            self.position_index.after_commit(self.conn, change)
+
+    def transaction(self):
+        """Start a transaction.
+
+        Changes to the position index are applied once it commits.
+        """
+        if self.position_index is None:
+            return self.conn.transaction()
+        return self.position_index.transaction(self.conn)
 
     async def get_position(
         self, campaign: str, codebase: str
     ) -> tuple[Optional[int], Optional[timedelta]]:
+        if self.position_index is not None and self.position_index.loaded:
+            return self.position_index.get_position(campaign, codebase)
+        # Count the items ahead of this one using the (bucket, priority, id)
+        # index, rather than numbering the entire queue.
         row = await self.conn.fetchrow(
-            "SELECT position, wait_time FROM queue_positions "
-            "WHERE codebase = $1 AND suite = $2",
+            """
+SELECT
+    (SELECT count(*) FROM queue AS ahead
+     WHERE (ahead.bucket, ahead.priority, ahead.id) <
+           (queue.bucket, queue.priority, queue.id)) + 1 AS position,
+    (SELECT coalesce(sum(ahead.estimated_duration), interval '0') FROM queue AS ahead
+     WHERE (ahead.bucket, ahead.priority, ahead.id) <
+           (queue.bucket, queue.priority, queue.id)) AS wait_time
+FROM queue
+WHERE codebase = $1 AND suite = $2
+ORDER BY bucket ASC, priority ASC, id ASC
+LIMIT 1
+""",
             codebase,
             campaign,
         )
@@ -156,12 +482,11 @@ LEFT JOIN codebase ON codebase.name = queue.codebase
             conditions.append(f"queue.codebase = ${len(args)}")
         if campaign:
             args.append(campaign)
-            conditions.append("queue.suite = ${len(args)}")
+            conditions.append(f"queue.suite = ${len(args)}")
         if exclude_hosts:
             args.append(exclude_hosts)
-            # TODO(jelmer): Use codebase.hostname when kali upgrades to postgres 12+
             conditions.append(
-                f"NOT (codebase.branch_url IS NOT NULL AND SUBSTRING(codebase.branch_url from '.*://(?:[^/@]*@)?([^/]*)') = ANY(${len(args)}::text[]))"
+                f"NOT (codebase.hostname IS NOT NULL AND codebase.hostname = ANY(${len(args)}::text[]))"
             )
 
         if conditions:
@@ -177,14 +502,100 @@ LIMIT 1
         row = await self.conn.fetchrow(query, *args)
         if row is None:
             return None, {}
-        vcs_info = {}
-        if row["branch_url"]:
-            vcs_info["branch_url"] = row["branch_url"]
-        if row["subpath"] is not None:
-            vcs_info["subpath"] = row["subpath"]
-        if row["vcs_type"]:
-            vcs_info["vcs_type"] = row["vcs_type"]
-        return QueueItem.from_row(row), vcs_info
+        return QueueItem.from_row(row), _vcs_info_from_row(row)
+
+    async def claim_items(
+        self,
+        limit: int,
+        *,
+        codebase: Optional[str] = None,
+        campaign: Optional[str] = None,
+        exclude_hosts: Optional[set[str]] = None,
+        exclude_ids: Optional[set[int]] = None,
+        lease: timedelta = DEFAULT_CLAIM_LEASE,
+    ) -> list[tuple[QueueItem, dict[str, str], Optional[str]]]:
+        """Claim the next items from the queue.
+
+        Claimed items are skipped by other claimers until their lease expires
+        or they are released with release_items. Rows that are locked by a
+        concurrent claim are skipped rather than waited for.
+
+        Args:
+          limit: Maximum number of items to claim
+          codebase: Only claim items for this codebase
+          campaign: Only claim items for this campaign
+          exclude_hosts: Skip items for codebases hosted on these hosts
+          exclude_ids: Skip items with these queue ids
+          lease: How long the claim is valid for
+        Returns:
+          list of (queue item, vcs info, hostname) tuples, in queue order
+        """
+        conditions = ["(queue.claimed_until IS NULL OR queue.claimed_until < NOW())"]
+        args: list[Any] = [limit, lease]
+        if exclude_ids:
+            args.append(exclude_ids)
+            conditions.append(f"NOT (queue.id = ANY(${len(args)}::int[]))")
+        if codebase:
+            args.append(codebase)
+            conditions.append(f"queue.codebase = ${len(args)}")
+        if campaign:
+            args.append(campaign)
+            conditions.append(f"queue.suite = ${len(args)}")
+        if exclude_hosts:
+            args.append(exclude_hosts)
+            conditions.append(
+                f"NOT (codebase.hostname IS NOT NULL AND codebase.hostname = ANY(${len(args)}::text[]))"
+            )
+
+        query = f"""
+WITH candidates AS (
+    SELECT queue.id
+    FROM queue
+    LEFT JOIN codebase ON codebase.name = queue.codebase
+    WHERE {" AND ".join(conditions)}
+    ORDER BY queue.bucket ASC, queue.priority ASC, queue.id ASC
+    LIMIT $1
+    FOR UPDATE OF queue SKIP LOCKED
+), claimed AS (
+    UPDATE queue SET claimed_until = NOW() + $2::interval
+    FROM candidates WHERE queue.id = candidates.id
+    RETURNING queue.*
+)
+SELECT
+    claimed.command AS command,
+    claimed.context AS context,
+    claimed.id AS id,
+    claimed.estimated_duration AS estimated_duration,
+    claimed.suite AS campaign,
+    claimed.refresh AS refresh,
+    claimed.requester AS requester,
+    claimed.change_set AS change_set,
+    codebase.vcs_type AS vcs_type,
+    codebase.branch_url AS branch_url,
+    codebase.subpath AS subpath,
+    codebase.hostname AS hostname,
+    claimed.codebase AS codebase
+FROM
+    claimed
+LEFT JOIN codebase ON codebase.name = claimed.codebase
+ORDER BY
+claimed.bucket ASC,
+claimed.priority ASC,
+claimed.id ASC
+"""
+        return [
+            (QueueItem.from_row(row), _vcs_info_from_row(row), row["hostname"])
+            for row in await self.conn.fetch(query, *args)
+        ]
+
+    async def release_items(self, queue_ids: list[int]) -> None:
+        """Release claims on queue items, making them available again."""
+        if not queue_ids:
+            return
+        await self.conn.execute(
+            "UPDATE queue SET claimed_until = NULL WHERE id = ANY($1::int[])",
+            queue_ids,
+        )
 
     async def iter_queue(
         self, limit: Optional[int] = None, campaign: Optional[str] = None
@@ -253,7 +664,8 @@ queue.id ASC
             "command = EXCLUDED.command, codebase = EXCLUDED.codebase "
             "WHERE queue.bucket >= EXCLUDED.bucket OR "
             "(queue.bucket = EXCLUDED.bucket AND "
-            "queue.priority >= EXCLUDED.priority) RETURNING id, bucket",
+            "queue.priority >= EXCLUDED.priority) "
+            "RETURNING id, bucket, priority, estimated_duration",
             command,
             offset,
             bucket,
@@ -280,9 +692,148 @@ queue.id ASC
                 f"Unable to add or retrieve queue entry for {campaign}/{codebase}/{change_set}"
             )
             return row
-        return row
+        self._after_commit(
+            lambda index: index.update(
+                row["id"],
+                bucket=row["bucket"],
+                priority=row["priority"],
+                estimated_duration=row["estimated_duration"],
+                campaign=campaign,
+                codebase=codebase,
+            )
+        )
+        return (row["id"], row["bucket"])
+
+    async def delete(self, queue_id: int) -> None:
+        """Remove an item from the queue."""
+        await self.conn.execute("DELETE FROM queue WHERE id = $1", queue_id)
+        self._after_commit(lambda index: index.remove(queue_id))
+
+    async def delete_candidate(self, campaign: str, codebase: str) -> None:
+        """Remove all queue items for a codebase/campaign."""
+        await self.conn.execute(
+            "DELETE FROM queue WHERE suite = $1 AND codebase = $2", campaign, codebase
+        )
+        self._after_commit(lambda index: index.remove_candidate(campaign, codebase))
 
     async def get_buckets(self):
         return await self.conn.fetch(
             "SELECT bucket, count(*) FROM queue GROUP BY bucket ORDER BY bucket ASC"
         )
+
+    async def add_many(self, items: list[dict[str, Any]]) -> list[tuple[int, str]]:
+        """Add a batch of items to the queue.
+
+        The items are copied into a temporary staging table and merged into
+        the queue with a single statement, using the same conflict rules as
+        add().
+
+        Args:
+          items: list of dictionaries with the same keys as the keyword
+            arguments to add()
+
+        Returns:
+          list of (queue id, bucket) tuples, in the same order as items
+        """
+        if not items:
+            return []
+        async with self.transaction():
+            await self.conn.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS queue_staging ("
+                "seq integer, command text, priority_offset double precision, "
+                "bucket text, context text, estimated_duration interval, "
+                "suite text, refresh boolean, requester text, change_set text, "
+                "codebase text) ON COMMIT DELETE ROWS"
+            )
+            await self.conn.execute("TRUNCATE queue_staging")
+            await self.conn.copy_records_to_table(
+                "queue_staging",
+                records=[
+                    (
+                        i,
+                        item["command"],
+                        item.get("offset", 0.0),
+                        item.get("bucket", "default"),
+                        item.get("context"),
+                        item.get("estimated_duration"),
+                        item["campaign"],
+                        item.get("refresh", False),
+                        item.get("requester"),
+                        item.get("change_set"),
+                        item["codebase"],
+                    )
+                    for (i, item) in enumerate(items)
+                ],
+            )
+            # Within a batch, only the entry that a sequence of add() calls
+            # would have ended up with is merged; PostgreSQL refuses to
+            # update the same row twice in one statement.
+            rows = await self.conn.fetch(
+                """
+WITH upserted AS (
+    INSERT INTO queue
+    (command, priority, bucket, context, estimated_duration, suite, refresh,
+     requester, change_set, codebase)
+    SELECT command, min_priority + priority_offset, bucket, context,
+           estimated_duration, suite, refresh, requester, change_set, codebase
+    FROM (
+        SELECT DISTINCT ON (codebase, suite, coalesce(change_set, ''))
+            s.*, s.bucket::queue_bucket AS queue_bucket
+        FROM queue_staging AS s
+        ORDER BY codebase, suite, coalesce(change_set, ''),
+                 s.bucket::queue_bucket, priority_offset, seq DESC
+    ) AS s (seq, command, priority_offset, staged_bucket, context,
+            estimated_duration, suite, refresh, requester, change_set,
+            codebase, bucket),
+    (SELECT COALESCE(MIN(priority), 0) AS min_priority FROM queue) AS m
+    ON CONFLICT (codebase, suite, coalesce(change_set, ''::text))
+    DO UPDATE SET
+    context = EXCLUDED.context, priority = EXCLUDED.priority,
+    bucket = EXCLUDED.bucket,
+    estimated_duration = EXCLUDED.estimated_duration,
+    refresh = EXCLUDED.refresh, requester = EXCLUDED.requester,
+    command = EXCLUDED.command, codebase = EXCLUDED.codebase
+    WHERE queue.bucket >= EXCLUDED.bucket OR
+    (queue.bucket = EXCLUDED.bucket AND queue.priority >= EXCLUDED.priority)
+    RETURNING id, bucket, priority, estimated_duration, codebase, suite,
+              change_set
+)
+SELECT
+    s.seq, u.id IS NOT NULL AS changed,
+    coalesce(u.id, q.id) AS id, coalesce(u.bucket, q.bucket) AS bucket,
+    u.priority, u.estimated_duration
+FROM queue_staging AS s
+LEFT JOIN upserted AS u ON
+    u.codebase = s.codebase AND u.suite = s.suite
+    AND coalesce(u.change_set, '') = coalesce(s.change_set, '')
+LEFT JOIN queue AS q ON
+    q.codebase = s.codebase AND q.suite = s.suite
+    AND coalesce(q.change_set, '') = coalesce(s.change_set, '')
+ORDER BY s.seq
+"""
+            )
+            ret = []
+            changed = []
+            for row in rows:
+                item = items[row["seq"]]
+                assert row["id"] is not None, (
+                    "Unable to add or retrieve queue entry for "
+                    f"{item['campaign']}/{item['codebase']}/{item.get('change_set')}"
+                )
+                if row["changed"]:
+                    changed.append((row, item))
+                ret.append((row["id"], row["bucket"]))
+
+            def update_index(index: QueuePositionIndex) -> None:
+                for row, item in changed:
+                    index.update(
+                        row["id"],
+                        bucket=row["bucket"],
+                        priority=row["priority"],
+                        estimated_duration=row["estimated_duration"],
+                        campaign=item["campaign"],
+                        codebase=item["codebase"],
+                    )
+
+            self._after_commit(update_index)
+        return ret
@@ -21,18 +21,22 @@ __all__ = [
 ]
 
 import asyncio
+import codecs
 import json
 import logging
 import os
+import re
 import ssl
 import sys
 import tempfile
+import time
 import uuid
 import warnings
+from collections import deque
 from collections.abc import Iterator
 from contextlib import AsyncExitStack
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
 from typing import Any, Optional, TypedDict, cast
 
@@ -70,6 +74,7 @@ from breezy.forge import (
     get_forge,
 )
 from breezy.transport import Transport, UnsupportedProtocol, UnusableRedirect
+from debian.changelog import Version
 from redis.asyncio import Redis
 from silver_platter import (
     BranchRateLimited,
@@ -94,13 +99,16 @@ from .artifacts import (
 )
 from .config import Campaign, get_campaign_config, get_distribution, read_config
 from .debian import dpkg_vendor
-from .logs import FileSystemLogFileManager, LogFileManager, get_log_manager, import_logs
-from .queue import Queue, QueueItem
+from .logs import FileSystemLogFileManager, LogFileManager, get_log_manager, import_log
+from .queue import Queue, QueueItem, QueuePositionIndex
 from .schedule import (
     CandidateUnavailable,
+    DebianVersionIndex,
     do_schedule,
     do_schedule_control,
+    do_schedule_many,
     do_schedule_regular,
+    do_schedule_regular_many,
 )
 from .vcs import (
     BranchOpenFailure,
@@ -117,6 +125,30 @@ override_launchpad_consumer_name()
 
 
 DEFAULT_RETRY_AFTER = 120
+# Number of queue items to claim from the database at once
+DEFAULT_QUEUE_BUFFER_SIZE = 20
+# Maximum time to hand out claimed queue items for before re-reading the
+# queue, so that newly scheduled high priority items are picked up.
+QUEUE_BUFFER_MAX_AGE = timedelta(seconds=30)
+# Interval at which to reload the queue position index, to pick up changes
+# made by other processes (e.g. janitor.schedule)
+QUEUE_POSITIONS_REFRESH_INTERVAL = 15 * 60
+# Window over which changes to the set of active runs are collected before
+# they are published on the "queue" channel
+QUEUE_STATUS_COALESCE_WINDOW = 0.5
+# Interval at which a full snapshot of the active runs is published, so that
+# subscribers that missed events can resynchronise
+QUEUE_STATUS_SNAPSHOT_INTERVAL = 60
+# Size of the chunks in which uploaded files are written to disk
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Interval at which the log of an active run is polled when it is followed
+LOG_FOLLOW_POLL_INTERVAL = 2.0
+# Maximum size of an incomplete line to hold back when following a log
+LOG_FOLLOW_MAX_PARTIAL_LINE = 64 * 1024
+# Number of rows fetched from the database at once when exporting a table
+EXPORT_BATCH_SIZE = 1000
+# Amount of serialized output buffered before it is written to the client
+EXPORT_BUFFER_SIZE = 64 * 1024
 REMOTE_BRANCH_OPEN_TIMEOUT = 10.0
 VCS_STORE_BRANCH_OPEN_TIMEOUT = 5.0
 # Maybe this should be configurable somewhere?
@@ -748,7 +780,12 @@ class Backchannel:
     async def list_log_files(self):
         raise NotImplementedError(self.list_log_files)
 
-    async def get_log_file(self, name):
+    async def get_log_file(self, name, offset=0):
+        """Retrieve the contents of a log file, starting at offset.
+
+        Returns a file-like object with the bytes from offset onwards; this is
+        empty if no data has been appended since.
+        """
         raise NotImplementedError(self.get_log_file)
 
     async def ping(self, log_id: str) -> None:
@@ -953,13 +990,15 @@ class JenkinsBackchannel(Backchannel):
     async def list_log_files(self):
         return ["worker.log"]
 
-    async def get_log_file(self, name):
+    async def get_log_file(self, name, offset=0):
         if name != "worker.log":
             raise FileNotFoundError(name)
         async with (
             ClientSession() as session,
             session.get(
-                self.my_url / "logText/progressiveText", raise_for_status=True
+                self.my_url / "logText/progressiveText",
+                params={"start": str(offset)},
+                raise_for_status=True,
             ) as resp,
         ):
             return BytesIO(await resp.read())
@@ -1045,12 +1084,25 @@ class PollingBackchannel(Backchannel):
         ):
             return await resp.json()
 
-    async def get_log_file(self, name):
+    async def get_log_file(self, name, offset=0):
+        headers = {}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
         async with (
             ClientSession() as session,
-            session.get(self.my_url / "logs" / name, raise_for_status=True) as resp,
+            session.get(self.my_url / "logs" / name, headers=headers) as resp,
         ):
-            return BytesIO(await resp.read())
+            if resp.status == 404:
+                raise FileNotFoundError(name)
+            if resp.status == 416:
+                # Nothing has been appended since offset.
+                return BytesIO()
+            resp.raise_for_status()
+            data = await resp.read()
+            if offset and resp.status != 206:
+                # Older workers ignore Range and send the whole file.
+                data = data[offset:]
+            return BytesIO(data)
 
     async def ping(self, expected_log_id):
         health_url = self.my_url / "log-id"
@@ -1360,6 +1412,110 @@ class QueueItemAlreadyClaimed(Exception):
         self.run_id = run_id
 
 
+class QueueStatusPublisher:
+    """Publish changes to the set of active runs on the "queue" channel.
+
+    Rather than sending the full status after every change, run-added,
+    run-removed and keepalive events are collected for a short window and
+    published as a single delta. Every message carries a sequence number;
+    a full snapshot is published periodically so that subscribers that
+    notice a gap can resynchronise.
+    """
+
+    def __init__(
+        self,
+        redis,
+        snapshot,
+        coalesce_window: float = QUEUE_STATUS_COALESCE_WINDOW,
+        snapshot_interval: float = QUEUE_STATUS_SNAPSHOT_INTERVAL,
+    ) -> None:
+        self.redis = redis
+        self._snapshot = snapshot
+        self.coalesce_window = coalesce_window
+        self.snapshot_interval = snapshot_interval
+        self.seq = 0
+        self._pending: list[dict[str, Any]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._snapshotter: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def emit(self, event: dict[str, Any]) -> None:
+        """Queue an event, to be published at the end of the window."""
+        run_id = event["id"]
+        if event["type"] == "run-removed":
+            pending = [e for e in self._pending if e["id"] != run_id]
+            added = any(
+                e["type"] == "run-added" and e["id"] == run_id for e in self._pending
+            )
+            self._pending = pending
+            if added:
+                # Subscribers never heard about this run.
+                return
+        elif event["type"] == "keepalive":
+            self._pending = [
+                e
+                for e in self._pending
+                if not (e["type"] == "keepalive" and e["id"] == run_id)
+            ]
+        self._pending.append(event)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                self.coalesce_window, self._start_flush
+            )
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def _publish(self, message: dict[str, Any]) -> None:
+        self.seq += 1
+        message["seq"] = self.seq
+        await self.redis.publish("queue", json.dumps(message))
+
+    async def flush(self) -> None:
+        """Publish any pending events."""
+        async with self._lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            events, self._pending = self._pending, []
+            if not events:
+                return
+            try:
+                await self._publish({"type": "delta", "events": events})
+            except Exception:
+                logging.exception("Failed to publish queue status events")
+
+    async def publish_snapshot(self) -> None:
+        """Publish the full status, superseding any pending events."""
+        async with self._lock:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._pending = []
+            await self._publish({"type": "snapshot", **(await self._snapshot())})
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            try:
+                await self.publish_snapshot()
+            except Exception:
+                logging.exception("Failed to publish queue status snapshot")
+            await asyncio.sleep(self.snapshot_interval)
+
+    def start(self) -> None:
+        if self._snapshotter is not None:
+            raise Exception("Queue status publisher already started")
+        self._snapshotter = asyncio.get_event_loop().create_task(self._snapshot_loop())
+
+    async def stop(self) -> None:
+        if self._snapshotter is not None:
+            self._snapshotter.cancel()
+            self._snapshotter = None
+        await self.flush()
+
+
 class QueueProcessor:
     avoid_hosts: set[str]
 
@@ -1378,6 +1534,7 @@ class QueueProcessor:
         avoid_hosts: Optional[set[str]] = None,
         dep_server_url: Optional[str] = None,
         apt_archive_url: Optional[str] = None,
+        queue_buffer_size: int = DEFAULT_QUEUE_BUFFER_SIZE,
     ) -> None:
         """Create a queue processor."""
         self.database = database
@@ -1395,6 +1552,17 @@ class QueueProcessor:
         self.apt_archive_url = apt_archive_url
         self._jobs_scheduler = aiojobs.Scheduler(limit=2)
         self._watch_dog: Optional[asyncio.Task] = None
+        self.queue_buffer_size = queue_buffer_size
+        # Queue items claimed in the database but not yet handed out
+        self._queue_buffer: deque[tuple[QueueItem, dict[str, str], Optional[str]]] = (
+            deque()
+        )
+        self._queue_buffer_filled: Optional[datetime] = None
+        self._queue_buffer_lock = asyncio.Lock()
+        self.queue_positions = QueuePositionIndex()
+        self._queue_positions_refresher: Optional[asyncio.Task] = None
+        self.debian_versions = DebianVersionIndex()
+        self.queue_status = QueueStatusPublisher(redis, self.status_json)
 
     def start_watchdog(self):
         if self._watch_dog is not None:
@@ -1421,11 +1589,40 @@ class QueueProcessor:
             pass
         self._watch_dog = None
 
+    async def refresh_queue_positions(self) -> None:
+        async with self.database.acquire() as conn:
+            await self.queue_positions.load(conn)
+        logging.info("Loaded %d queue positions", len(self.queue_positions))
+
+    async def _refresh_queue_positions_loop(self):
+        while True:
+            try:
+                await self.refresh_queue_positions()
+            except Exception:
+                logging.exception("Failed to refresh queue positions")
+            await asyncio.sleep(QUEUE_POSITIONS_REFRESH_INTERVAL)
+
+    def start_queue_positions_refresher(self):
+        if self._queue_positions_refresher is not None:
+            raise Exception("Queue position refresher already started")
+        self._queue_positions_refresher = asyncio.get_event_loop().create_task(
+            self._refresh_queue_positions_loop()
+        )
+
     async def stop(self):
         self.stop_watchdog()
+        await self.queue_status.stop()
+        if self._queue_positions_refresher is not None:
+            self._queue_positions_refresher.cancel()
+            self._queue_positions_refresher = None
         await self._jobs_scheduler.close()
+        if self._queue_buffer and self.database is not None:
+            async with self.database.acquire() as conn:
+                await self._drain_queue_buffer(Queue(conn))
 
     KEEPALIVE_INTERVAL = 10
+    # Maximum number of workers to ping at the same time
+    HEALTHCHECK_CONCURRENCY = 50
 
     async def _healthcheck_active_run(self, active_run, keepalive_age):
         try:
@@ -1463,9 +1660,21 @@ class QueueProcessor:
                 extra={"run_id": active_run.log_id},
             )
         else:
-            await self.redis.hset(
-                "last-keepalive", active_run.log_id, datetime.utcnow().isoformat()
-            )
+            # Only update runs that are still active; the run may have
+            # finished while it was being pinged.
+            now = time.time()
+            if await self.redis.zadd(
+                "keepalives", {active_run.log_id: now}, xx=True, ch=True
+            ):
+                self.queue_status.emit(
+                    {
+                        "type": "keepalive",
+                        "id": active_run.log_id,
+                        "last-keepalive": datetime.utcfromtimestamp(now).isoformat(
+                            timespec="seconds"
+                        ),
+                    }
+                )
             keepalive_age = timedelta(seconds=0)
 
         if keepalive_age > timedelta(minutes=self.run_timeout):
@@ -1490,35 +1699,71 @@ class QueueProcessor:
                 )
             return
 
+    async def _sync_keepalives(self) -> None:
+        """Make sure every active run has an entry in the keepalives index."""
+        for serialized in (await self.redis.hgetall("active-runs")).values():
+            active_run = ActiveRun.from_json(json.loads(serialized))
+            await self.redis.zadd(
+                "keepalives",
+                {
+                    active_run.log_id: active_run.start_time.replace(
+                        tzinfo=timezone.utc
+                    ).timestamp()
+                },
+                nx=True,
+            )
+
+    async def _expired_runs(self) -> list[tuple[ActiveRun, timedelta]]:
+        """Find the active runs that haven't sent a keepalive recently."""
+        now = time.time()
+        expired = await self.redis.zrangebyscore(
+            "keepalives",
+            "-inf",
+            now - (self.run_timeout // 3) * 60,
+            withscores=True,
+        )
+        if not expired:
+            return []
+        ret = []
+        for (log_id, last_keepalive), serialized in zip(
+            expired,
+            await self.redis.hmget("active-runs", [log_id for (log_id, _) in expired]),
+        ):
+            if serialized is None:
+                # The run finished in the meantime.
+                await self.redis.zrem("keepalives", log_id)
+                continue
+            ret.append(
+                (
+                    ActiveRun.from_json(json.loads(serialized)),
+                    timedelta(seconds=now - last_keepalive),
+                )
+            )
+        return ret
+
     async def _watchdog(self):
-        while True:
-            # TODO(jelmer): Use asyncio.TaskGroup when python >= 3.11
-            tasks = []
-            for serialized in (await self.redis.hgetall("active-runs")).values():
-                js = json.loads(serialized)
-                active_run = ActiveRun.from_json(js)
-                lk = await self.redis.hget("last-keepalive", active_run.log_id)
-                if lk:
-                    last_keepalive = datetime.fromisoformat(lk.decode("utf-8"))
-                else:
-                    last_keepalive = active_run.start_time
-                keepalive_age = datetime.utcnow() - last_keepalive
-                if keepalive_age < timedelta(minutes=(self.run_timeout // 3)):
-                    continue
-                tasks.append(
-                    asyncio.create_task(
-                        self._healthcheck_active_run(active_run, keepalive_age)
+        await self._sync_keepalives()
+        semaphore = asyncio.Semaphore(self.HEALTHCHECK_CONCURRENCY)
+
+        async def healthcheck(active_run, keepalive_age):
+            async with semaphore:
+                try:
+                    await self._healthcheck_active_run(active_run, keepalive_age)
+                except Exception as e:
+                    logging.exception(
+                        "Failed to healthcheck %s: %r",
+                        active_run.log_id,
+                        e,
+                        extra={"run_id": active_run.log_id},
                     )
-                )
-            if tasks:
-                done, _ = await asyncio.wait(tasks)
-                for task in done:
-                    try:
-                        await task
-                    except Exception as e:
-                        logging.exception(
-                            "Failed to healthcheck %s: %r", active_run.log_id, e
-                        )
+
+        while True:
+            await asyncio.gather(
+                *[
+                    healthcheck(active_run, keepalive_age)
+                    for (active_run, keepalive_age) in await self._expired_runs()
+                ]
+            )
             await asyncio.sleep(self.KEEPALIVE_INTERVAL)
 
     async def rate_limited_hosts(self):
@@ -1534,7 +1779,7 @@ class QueueProcessor:
         self, codebase: str, campaign: str
     ) -> tuple[Optional[int], Optional[timedelta], Optional[timedelta]]:
         async with self.database.acquire() as conn:
-            queue = Queue(conn)
+            queue = Queue(conn, self.queue_positions)
             (position, wait_time) = await queue.get_position(campaign, codebase)
         active_run_count = await self.active_run_count()
         return (
@@ -1543,26 +1788,30 @@ class QueueProcessor:
             wait_time,
         )
 
+    def _processing_entry(
+        self, js: dict[str, Any], last_keepalive: Optional[datetime]
+    ) -> dict[str, Any]:
+        if last_keepalive:
+            js["last-keepalive"] = last_keepalive.isoformat(timespec="seconds")
+            js["keepalive_age"] = (datetime.utcnow() - last_keepalive).total_seconds()
+            js["mia"] = js["keepalive_age"] > self.run_timeout * 60
+        else:
+            js["keepalive_age"] = None
+            js["last-keepalive"] = None
+            js["mia"] = None
+        return js
+
     async def status_json(self) -> Any:
         last_keepalives = {
-            r.decode("utf-8"): datetime.fromisoformat(v.decode("utf-8"))
-            for (r, v) in (await self.redis.hgetall("last-keepalive")).items()
+            r.decode("utf-8"): datetime.utcfromtimestamp(v)
+            for (r, v) in await self.redis.zrange("keepalives", 0, -1, withscores=True)
         }
-        processing = []
-        for e in (await self.redis.hgetall("active-runs")).values():
-            js = json.loads(e)
-            last_keepalive = last_keepalives.get(js["id"])
-            if last_keepalive:
-                js["last-keepalive"] = last_keepalive.isoformat(timespec="seconds")
-                js["keepalive_age"] = (
-                    datetime.utcnow() - last_keepalive
-                ).total_seconds()
-                js["mia"] = js["keepalive_age"] > self.run_timeout * 60
-            else:
-                js["keepalive_age"] = None
-                js["last-keepalive"] = None
-                js["mia"] = None
-            processing.append(js)
+        processing = [
+            self._processing_entry(js, last_keepalives.get(js["id"]))
+            for js in map(
+                json.loads, (await self.redis.hgetall("active-runs")).values()
+            )
+        ]
         return {
             "processing": processing,
             "avoid_hosts": list(self.avoid_hosts),
@@ -1578,12 +1827,21 @@ class QueueProcessor:
         run_id = await self.redis.hget("assigned-queue-items", str(active_run.queue_id))
         if run_id:
             raise QueueItemAlreadyClaimed(active_run.queue_id, run_id)
+        now = time.time()
         async with self.redis.pipeline() as tr:
             tr.hset("active-runs", active_run.log_id, json.dumps(active_run.json()))
             tr.hset("assigned-queue-items", str(active_run.queue_id), active_run.log_id)
-            tr.hset("last-keepalive", active_run.log_id, datetime.utcnow().isoformat())
+            tr.zadd("keepalives", {active_run.log_id: now})
             await tr.execute()
-        await self.redis.publish("queue", json.dumps(await self.status_json()))
+        self.queue_status.emit(
+            {
+                "type": "run-added",
+                "id": active_run.log_id,
+                "run": self._processing_entry(
+                    active_run.json(), datetime.utcfromtimestamp(now)
+                ),
+            }
+        )
         active_run_count.labels(worker=active_run.worker_name).inc()
         run_count.inc()
 
@@ -1609,8 +1867,9 @@ class QueueProcessor:
         async with self.redis.pipeline() as tr:
             tr.hdel("assigned-queue-items", str(active_run.queue_id))
             tr.hdel("active-runs", log_id)
-            tr.hdel("last-keepalive", log_id)
+            tr.zrem("keepalives", log_id)
             await tr.execute()
+        self.queue_status.emit({"type": "run-removed", "id": log_id})
 
     async def abort_run(
         self, run: ActiveRun, code: str, description: str, transient=None
@@ -1633,7 +1892,7 @@ class QueueProcessor:
             result.duration.total_seconds()
         )
         async with self.database.acquire() as conn:
-            async with conn.transaction():
+            async with self.queue_positions.transaction(conn):
                 if not result.change_set:
                     result.change_set = result.log_id
                     await store_change_set(
@@ -1682,13 +1941,20 @@ class QueueProcessor:
                     raise
                 if result.builder_result:
                     await result.builder_result.store(conn, result.log_id)
-                await conn.execute(
-                    "DELETE FROM queue WHERE id = $1", active_run.queue_id
+                await Queue(conn, self.queue_positions).delete(active_run.queue_id)
+
+            # Only make the new version available once it has been committed.
+            if (
+                isinstance(result.builder_result, DebianResult)
+                and result.builder_result.build_version
+            ):
+                self.debian_versions.add(
+                    result.builder_result.source,
+                    Version(str(result.builder_result.build_version)),
                 )
 
             await self.redis.publish("result", json.dumps(result.json()))
             await self.unclaim_run(result.log_id)
-            await self.redis.publish("queue", json.dumps(await self.status_json()))
             last_success_gauge.set_to_current_time()
 
             async def reschedule():
@@ -1701,6 +1967,8 @@ class QueueProcessor:
                             context=result.context,
                             requester="after run schedule",
                             codebase=result.codebase,
+                            position_index=self.queue_positions,
+                            debian_versions=self.debian_versions,
                         )
                     except CandidateUnavailable:
                         # Maybe this was a one-off schedule without candidate, or
@@ -1719,6 +1987,29 @@ class QueueProcessor:
             retry_after = datetime.utcnow() + timedelta(seconds=DEFAULT_RETRY_AFTER)
         await self.redis.hset("rate-limit-hosts", host, retry_after.isoformat())
 
+    async def _assigned_queue_items(self) -> set[int]:
+        return {
+            int(i.decode("utf-8"))
+            for i in await self.redis.hkeys("assigned-queue-items")
+        }
+
+    async def _drain_queue_buffer(self, queue: Queue) -> None:
+        queue_ids = [item.id for (item, vcs_info, host) in self._queue_buffer]
+        self._queue_buffer.clear()
+        self._queue_buffer_filled = None
+        await queue.release_items(queue_ids)
+
+    async def _refill_queue_buffer(self, queue: Queue, exclude_hosts: set[str]):
+        await self._drain_queue_buffer(queue)
+        self._queue_buffer.extend(
+            await queue.claim_items(
+                self.queue_buffer_size,
+                exclude_hosts=exclude_hosts,
+                exclude_ids=await self._assigned_queue_items(),
+            )
+        )
+        self._queue_buffer_filled = datetime.utcnow()
+
     async def next_queue_item(
         self, conn, codebase: Optional[str] = None, campaign: Optional[str] = None
     ) -> tuple[Optional[QueueItem], dict[str, str]]:
@@ -1726,16 +2017,37 @@ class QueueProcessor:
         exclude_hosts = set(self.avoid_hosts)
         async for host, _retry_after in self.rate_limited_hosts():
             exclude_hosts.add(host)
-        assigned_queue_items = {
-            int(i.decode("utf-8"))
-            for i in await self.redis.hkeys("assigned-queue-items")
-        }
-        return await queue.next_item(
-            campaign=campaign,
-            codebase=codebase,
-            assigned_queue_items=assigned_queue_items,
-            exclude_hosts=exclude_hosts,
-        )
+        if codebase is not None or campaign is not None:
+            # Filtered requests are rare; claim directly rather than going
+            # through the buffer.
+            claimed = await queue.claim_items(
+                1,
+                campaign=campaign,
+                codebase=codebase,
+                exclude_ids=await self._assigned_queue_items(),
+                exclude_hosts=exclude_hosts,
+            )
+            if not claimed:
+                return None, {}
+            item, vcs_info, unused_host = claimed[0]
+            return item, vcs_info
+        async with self._queue_buffer_lock:
+            while True:
+                if (
+                    not self._queue_buffer
+                    or self._queue_buffer_filled is None
+                    or datetime.utcnow() - self._queue_buffer_filled
+                    > QUEUE_BUFFER_MAX_AGE
+                ):
+                    await self._refill_queue_buffer(queue, exclude_hosts)
+                    if not self._queue_buffer:
+                        return None, {}
+                item, vcs_info, host = self._queue_buffer.popleft()
+                if host is not None and host in exclude_hosts:
+                    # The host was rate limited since we claimed this item
+                    await queue.release_items([item.id])
+                    continue
+                return item, vcs_info
 
 
 @routes.get("/queue/position", name="queue-position")
@@ -1801,6 +2113,7 @@ async def handle_schedule_control(request):
                 requester=requester,
                 codebase=codebase,
                 estimated_duration=estimated_duration,
+                position_index=request.app["queue_processor"].queue_positions,
             )
 
     response_obj = {
@@ -1816,10 +2129,96 @@ async def handle_schedule_control(request):
     return web.json_response(response_obj)
 
 
+async def _handle_schedule_many(request, entries):
+    span = aiozipkin.request_span(request)
+    todo = []
+    for entry in entries:
+        try:
+            campaign = entry["campaign"]
+            codebase = entry["codebase"]
+        except KeyError as e:
+            raise web.HTTPBadRequest(text=f"missing field {e} in {entry!r}") from e
+        todo.append(
+            {
+                "campaign": campaign,
+                "codebase": codebase,
+                "change_set": entry.get("change_set"),
+                "refresh": entry.get("refresh", False),
+                "requester": entry.get("requester"),
+                "bucket": entry.get("bucket"),
+                "offset": entry.get("offset"),
+                "estimated_duration": (
+                    timedelta(seconds=entry["estimated_duration"])
+                    if entry.get("estimated_duration")
+                    else None
+                ),
+            }
+        )
+    async with request.app["database"].acquire() as conn:
+        commands = {
+            (row["codebase"], row["campaign"]): row["command"]
+            for row in await conn.fetch(
+                "SELECT candidate.codebase, candidate.suite AS campaign, "
+                "candidate.command FROM candidate, "
+                "unnest($1::text[], $2::text[]) AS t(codebase, campaign) "
+                "WHERE candidate.codebase = t.codebase "
+                "AND candidate.suite = t.campaign",
+                [entry["codebase"] for entry in todo],
+                [entry["campaign"] for entry in todo],
+            )
+        }
+        for entry in todo:
+            command = commands.get((entry["codebase"], entry["campaign"]))
+            if command is None:
+                try:
+                    command = get_campaign_config(
+                        request.app["config"], entry["campaign"]
+                    ).command
+                except KeyError:
+                    command = None
+            entry["command"] = command
+        with span.new_child("do-schedule-many"):
+            scheduled = await do_schedule_many(
+                conn,
+                [entry for entry in todo if entry["command"]],
+                position_index=request.app["queue_processor"].queue_positions,
+            )
+    scheduled_iter = iter(scheduled)
+    ret = []
+    for entry in todo:
+        result = next(scheduled_iter) if entry["command"] else None
+        if result is None:
+            ret.append(
+                {
+                    "campaign": entry["campaign"],
+                    "codebase": entry["codebase"],
+                    "error": "Candidate not available",
+                }
+            )
+            continue
+        offset, estimated_duration, queue_id, bucket = result
+        ret.append(
+            {
+                "campaign": entry["campaign"],
+                "offset": offset,
+                "bucket": bucket,
+                "codebase": entry["codebase"],
+                "queue_id": queue_id,
+                "estimated_duration_seconds": estimated_duration.total_seconds()
+                if estimated_duration
+                else None,
+            }
+        )
+    return web.json_response(ret)
+
+
 @routes.post("/schedule", name="schedule")
 async def handle_schedule(request):
     span = aiozipkin.request_span(request)
     json = await request.json()
+    if isinstance(json, list):
+        # A batch of schedule requests; these are added to the queue in one go.
+        return await _handle_schedule_many(request, json)
     async with request.app["database"].acquire() as conn:
         try:
             run_id = json["run_id"]
@@ -1871,6 +2270,7 @@ async def handle_schedule(request):
                     codebase=codebase,
                     command=command,
                     bucket=bucket,
+                    position_index=request.app["queue_processor"].queue_positions,
                 )
         except CandidateUnavailable as e:
             raise web.HTTPBadRequest(text="Candidate not available") from e
@@ -1926,6 +2326,33 @@ async def handle_kill(request):
         return web.json_response(ret)
 
 
+def _parse_log_offset(request, *, header=None) -> int:
+    """Determine the offset from which a log file was requested.
+
+    The offset can be specified either as an ``offset`` query parameter or
+    as an open-ended ``Range: bytes=N-`` header. Alternatively, header names
+    a request header that carries a plain offset (e.g. Last-Event-ID).
+    """
+    value = request.query.get("offset")
+    if value is None and header is not None:
+        value = request.headers.get(header)
+    if value is None:
+        range_header = request.headers.get("Range")
+        if range_header is not None:
+            start, sep, end = range_header.removeprefix("bytes=").partition("-")
+            if range_header.startswith("bytes=") and sep and not end:
+                value = start
+    if value is None:
+        return 0
+    try:
+        offset = int(value)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=f"Invalid offset {value!r}") from e
+    if offset < 0:
+        raise web.HTTPBadRequest(text=f"Invalid offset {value!r}")
+    return offset
+
+
 @routes.get("/log/{run_id}/{filename}", name="log")
 async def handle_log(request):
     queue_processor = request.app["queue_processor"]
@@ -1934,80 +2361,241 @@ async def handle_log(request):
 
     if "/" in filename:
         return web.Response(text=f"Invalid filename {filename}", status=400)
+    offset = _parse_log_offset(request)
     active_run = await queue_processor.get_run(run_id)
     if not active_run:
         return web.Response(text=f"No such current run: {run_id}", status=404)
     try:
-        f = await active_run.backchannel.get_log_file(filename)
+        f = await active_run.backchannel.get_log_file(filename, offset)
     except FileNotFoundError:
         return web.Response(text=f"No such log file: {filename}", status=404)
 
-    try:
+    with f:
+        data = f.read()
+
+    headers = {"X-Next-Offset": str(offset + len(data))}
+    if not offset:
+        status = 200
+    elif data:
+        status = 206
+        headers["Content-Range"] = f"bytes {offset}-{offset + len(data) - 1}/*"
+    else:
+        # Nothing has been appended since offset
+        status = 204
+    return web.Response(
+        body=data, status=status, content_type="text/plain", headers=headers
+    )
+
+
+def _log_follow_event(event: str, data: bytes, offset: int) -> bytes:
+    lines = [f"event: {event}", f"id: {offset}"]
+    # Any of these ends a line in an event stream, so a bare CR in the data
+    # would otherwise end up outside of a data field.
+    lines.extend(
+        "data: " + line
+        for line in re.split(r"\r\n|\r|\n", data.decode("utf-8", "replace"))
+    )
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+@routes.get("/log/{run_id}/{filename}/follow", name="log-follow")
+async def handle_log_follow(request):
+    """Follow a log file of an active run as a stream of server-sent events.
+
+    Every "append" event carries the newly appended (complete) lines, and has
+    the offset just past them as its id, so that clients that reconnect
+    resume where they left off. An "end" event is sent once the run is no
+    longer active; the rest of the log is then available from the log store.
+    """
+    queue_processor = request.app["queue_processor"]
+    run_id = request.match_info["run_id"]
+    filename = request.match_info["filename"]
+
+    if "/" in filename:
+        return web.Response(text=f"Invalid filename {filename}", status=400)
+    offset = _parse_log_offset(request, header="Last-Event-ID")
+    active_run = await queue_processor.get_run(run_id)
+    if not active_run:
+        return web.Response(text=f"No such current run: {run_id}", status=404)
+
+    response = web.StreamResponse(
+        status=200,
+        reason="OK",
+        headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"},
+    )
+    await response.prepare(request)
+
+    # Bytes of an incomplete trailing line, held back until the line is done
+    pending = b""
+    while active_run is not None:
+        try:
+            f = await active_run.backchannel.get_log_file(
+                filename, offset + len(pending)
+            )
+        except FileNotFoundError:
+            # The worker may not have created the log file yet.
+            data = b""
+        except NotImplementedError:
+            await response.write(
+                _log_follow_event("error", b"log not available", offset)
+            )
+            break
+        except (
+            ClientConnectorError,
+            ClientResponseError,
+            asyncio.TimeoutError,
+            ClientOSError,
+            ServerDisconnectedError,
+        ) as e:
+            logging.debug("Error retrieving log %s for %s: %s", filename, run_id, e)
+            data = b""
+        else:
+            with f:
+                data = f.read()
+        pending += data
+        cut = pending.rfind(b"\n") + 1
+        if not cut and len(pending) >= LOG_FOLLOW_MAX_PARTIAL_LINE:
+            cut = len(pending)
+        if cut:
+            offset += cut
+            await response.write(_log_follow_event("append", pending[:cut], offset))
+            pending = pending[cut:]
+        else:
+            # Keep intermediate proxies from timing out the connection.
+            await response.write(b": keepalive\n\n")
+        await asyncio.sleep(LOG_FOLLOW_POLL_INTERVAL)
+        active_run = await queue_processor.get_run(run_id)
+
+    if pending:
+        offset += len(pending)
+        await response.write(_log_follow_event("append", pending, offset))
+    await response.write(_log_follow_event("end", b"", offset))
+    await response.write_eof()
+    return response
+
+
+async def _export_rows(request, conn, query, serialize):
+    """Stream the results of a query as JSON.
+
+    Rows are read from a server-side cursor and written out as they come in,
+    either as a JSON array or, if the client asks for it (with
+    ?format=ndjson or an Accept header), as newline-delimited JSON. The
+    response is compressed if the client accepts that.
+
+    With ?since=TIMESTAMP, only rows that were added or modified after
+    TIMESTAMP are included. The X-Export-Timestamp header carries the
+    timestamp to use as since for the next export: the start of the export,
+    or the start of the oldest transaction that was still writing at the
+    time, since that may yet commit changes from before the export. Removed
+    rows are not reported, and rows may be reported more than once.
+
+    Args:
+      query: query with a WHERE clause to which a condition on updated_at
+        can be appended
+    """
+    ndjson = request.query.get("format") == "ndjson" or (
+        "application/x-ndjson" in request.headers.get("Accept", "")
+    )
+    args = []
+    if "since" in request.query:
+        try:
+            since = datetime.fromisoformat(request.query["since"])
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=f"invalid since: {e}") from e
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        query += " AND updated_at > $1"
+        args.append(since)
+
+    async with conn.transaction():
+        export_time = await conn.fetchval(
+            "SELECT least(now(), (SELECT min(xact_start) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND pid != pg_backend_pid() "
+            "AND backend_xid IS NOT NULL))::timestamp"
+        )
         response = web.StreamResponse(
-            status=200, reason="OK", headers={"Content-Type": "text/plain"}
+            headers={
+                "Content-Type": "application/x-ndjson"
+                if ndjson
+                else "application/json",
+                "X-Export-Timestamp": export_time.isoformat(),
+            }
         )
+        response.enable_compression()
         await response.prepare(request)
-        for chunk in f:
-            await response.write(chunk)
-        await response.write_eof()
-    finally:
-        f.close()
+        buf = []
+        size = 0
+        if not ndjson:
+            buf.append(b"[")
+        separator = b""
+        async for row in conn.cursor(query, *args, prefetch=EXPORT_BATCH_SIZE):
+            line = json.dumps(serialize(row)).encode("utf-8")
+            if ndjson:
+                line += b"\n"
+            else:
+                line = separator + line
+                separator = b","
+            buf.append(line)
+            size += len(line)
+            if size >= EXPORT_BUFFER_SIZE:
+                await response.write(b"".join(buf))
+                buf = []
+                size = 0
+        if not ndjson:
+            buf.append(b"]")
+        await response.write(b"".join(buf))
+    await response.write_eof()
     return response
 
 
 @routes.get("/codebases", name="download-codebases")
 async def handle_codebases_download(request):
     queue_processor = request.app["queue_processor"]
-    codebases = []
 
     async with queue_processor.database.acquire() as conn:
-        for row in await conn.fetch(
+        return await _export_rows(
+            request,
+            conn,
             "SELECT name, branch_url, url, branch, subpath, vcs_type, "
-            "web_url, vcs_last_revision, value FROM codebase"
-        ):
-            codebases.append(dict(row))
-
-    return web.json_response(codebases)
+            "web_url, vcs_last_revision, value FROM codebase WHERE true",
+            dict,
+        )
 
 
 @routes.post("/codebases", name="upload-codebases")
 async def handle_codebases_upload(request):
-    queue_processor = request.app["queue_processor"]
+    """Add or update a batch of codebases.
 
-    async with queue_processor.database.acquire() as conn:
-        # TODO(jelmer): When a codebase with a certain name already exists,
-        # steal its name
-        insert_codebase_stmt = await conn.prepare(
-            "INSERT INTO codebase "
-            "(name, branch_url, url, branch, subpath, vcs_type, "
-            "vcs_last_revision, value, web_url) "
-            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)"
-            "ON CONFLICT (name) DO UPDATE SET "
-            "branch_url = EXCLUDED.branch_url, subpath = EXCLUDED.subpath, "
-            "vcs_type = EXCLUDED.vcs_type, "
-            "vcs_last_revision = EXCLUDED.vcs_last_revision, "
-            "value = EXCLUDED.value, url = EXCLUDED.url, "
-            "branch = EXCLUDED.branch, web_url = EXCLUDED.web_url"
-        )
+    The uploaded codebases are compared against the codebase table in a
+    single pass, and only those that are new or differ are written. With
+    ?sync=true, the upload is taken to be the complete set of codebases and
+    any other codebases are marked as inactive.
 
-        async with conn.transaction():
-            for entry in await request.json():
-                if "branch_url" in entry:
-                    entry["url"], params = urlutils.split_segment_parameters(
-                        entry["branch_url"]
-                    )
-                    if "branch" in params:
-                        entry["branch"] = urlutils.unescape(params["branch"])
-                elif "branch" in entry:
-                    entry["branch_url"] = urlutils.join_segment_parameters(
-                        entry["url"], {"branch": urlutils.escape(entry["branch"])}
-                    )
-                elif "url" in entry:
-                    entry["branch_url"] = entry["url"]
-                else:
-                    entry["branch_url"] = entry["url"] = None
+    Candidates for codebases whose VCS location changed are rescheduled, so
+    that they are processed from the new location.
+    """
+    queue_processor = request.app["queue_processor"]
+    sync = request.query.get("sync", "false").lower() in ("true", "1")
 
-            await insert_codebase_stmt.fetchrow(
+    records: list[tuple] = []
+    for entry in await request.json():
+        if "branch_url" in entry:
+            entry["url"], params = urlutils.split_segment_parameters(
+                entry["branch_url"]
+            )
+            if "branch" in params:
+                entry["branch"] = urlutils.unescape(params["branch"])
+        elif "branch" in entry:
+            entry["branch_url"] = urlutils.join_segment_parameters(
+                entry["url"], {"branch": urlutils.escape(entry["branch"])}
+            )
+        elif "url" in entry:
+            entry["branch_url"] = entry["url"]
+        else:
+            entry["branch_url"] = entry["url"] = None
+        records.append(
+            (
+                len(records),
                 entry.get("name"),
                 entry["branch_url"],
                 entry["url"],
@@ -2018,54 +2606,257 @@ async def handle_codebases_upload(request):
                 entry.get("value"),
                 entry.get("web_url"),
             )
+        )
+
+    async with queue_processor.database.acquire() as conn:
+        async with queue_processor.queue_positions.transaction(conn):
+            await conn.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS codebase_staging ("
+                "seq integer, name text, branch_url text, url text, branch text, "
+                "subpath text, vcs_type text, vcs_last_revision text, value integer, "
+                "web_url text) ON COMMIT DELETE ROWS"
+            )
+            await conn.execute("TRUNCATE codebase_staging")
+            await conn.copy_records_to_table("codebase_staging", records=records)
+
+            # TODO(jelmer): When a codebase with a certain name already exists,
+            # steal its name
+            # If a codebase appears more than once, the last entry wins.
+            diff = await conn.fetch(
+                "SELECT s.seq, s.name, codebase.name IS NULL AS added, "
+                "(codebase.branch_url, codebase.url, codebase.branch, "
+                "codebase.subpath, codebase.vcs_type::text) IS DISTINCT FROM "
+                "(s.branch_url, s.url, s.branch, s.subpath, s.vcs_type) "
+                "AS location_changed "
+                "FROM ("
+                "SELECT DISTINCT ON (coalesce(name, seq::text)) * "
+                "FROM codebase_staging ORDER BY coalesce(name, seq::text), seq DESC"
+                ") AS s LEFT JOIN codebase ON codebase.name = s.name "
+                "WHERE codebase.name IS NULL OR "
+                "(codebase.branch_url, codebase.url, codebase.branch, "
+                "codebase.subpath, codebase.vcs_type::text, "
+                "codebase.vcs_last_revision, codebase.value, codebase.web_url) "
+                "IS DISTINCT FROM "
+                "(s.branch_url, s.url, s.branch, s.subpath, s.vcs_type, "
+                "s.vcs_last_revision, s.value, s.web_url) "
+                "OR ($1 AND codebase.inactive)",
+                sync,
+            )
+
+            if diff:
+                await conn.execute(
+                    "INSERT INTO codebase "
+                    "(name, branch_url, url, branch, subpath, vcs_type, "
+                    "vcs_last_revision, value, web_url) "
+                    "SELECT name, branch_url, url, branch, subpath, "
+                    "vcs_type::vcs_type, vcs_last_revision, value, web_url "
+                    "FROM codebase_staging WHERE seq = ANY($1::integer[]) "
+                    "ON CONFLICT (name) DO UPDATE SET "
+                    "branch_url = EXCLUDED.branch_url, subpath = EXCLUDED.subpath, "
+                    "vcs_type = EXCLUDED.vcs_type, "
+                    "vcs_last_revision = EXCLUDED.vcs_last_revision, "
+                    "value = EXCLUDED.value, url = EXCLUDED.url, "
+                    "branch = EXCLUDED.branch, web_url = EXCLUDED.web_url, "
+                    "inactive = codebase.inactive AND NOT $2",
+                    [row["seq"] for row in diff],
+                    sync,
+                )
+
+            removed = []
+            if sync:
+                removed = await conn.fetch(
+                    "UPDATE codebase SET inactive = true "
+                    "WHERE NOT inactive AND name IS NOT NULL AND NOT EXISTS "
+                    "(SELECT FROM codebase_staging WHERE name = codebase.name) "
+                    "RETURNING name"
+                )
 
-            # TODO(jelmer): if anything meaningful has changed (name,
-            # branch_url, subpath), reschedule all runs for this codebase:
-            # https://github.com/jelmer/janitor/issues/107
+            # Reschedule all candidates for codebases that have moved
+            # (https://github.com/jelmer/janitor/issues/107)
+            moved = [
+                row["name"]
+                for row in diff
+                if not row["added"] and row["location_changed"]
+            ]
+            todo = []
+            if moved:
+                # Keep entries that are already queued in their current
+                # bucket; the queue would otherwise ignore the refresh for
+                # those in a more urgent bucket than the default one.
+                for row in await conn.fetch(
+                    "SELECT candidate.codebase, candidate.suite, candidate.command, "
+                    "candidate.change_set, candidate.context, candidate.value, "
+                    "candidate.success_chance, queue.bucket FROM candidate "
+                    "LEFT JOIN queue ON queue.codebase = candidate.codebase "
+                    "AND queue.suite = candidate.suite "
+                    "AND coalesce(queue.change_set, '') = "
+                    "coalesce(candidate.change_set, '') "
+                    "WHERE candidate.codebase = ANY($1::text[])",
+                    moved,
+                ):
+                    todo.append(
+                        {
+                            "codebase": row["codebase"],
+                            "campaign": row["suite"],
+                            "command": row["command"],
+                            "change_set": row["change_set"],
+                            "context": row["context"],
+                            "candidate_value": row["value"],
+                            "success_chance": row["success_chance"],
+                            "bucket": row["bucket"],
+                            "refresh": True,
+                            "requester": "codebase location changed",
+                        }
+                    )
+                await do_schedule_regular_many(
+                    conn,
+                    todo,
+                    position_index=queue_processor.queue_positions,
+                    debian_versions=queue_processor.debian_versions,
+                )
 
-    return web.json_response({})
+    added = sum(1 for row in diff if row["added"])
+    return web.json_response(
+        {
+            "added": added,
+            "changed": len(diff) - added,
+            "removed": len(removed),
+            "rescheduled": len(todo),
+        }
+    )
 
 
 @routes.delete("/candidates/{id}", name="delete-candidate")
 async def handle_candidate_delete(request):
     queue_processor = request.app["queue_processor"]
     candidate_id = int(request.match_info["id"])
-    async with queue_processor.database.acquire() as conn, conn.transaction():
-        await conn.fetchrow("DELETE FROM followup WHERE candidate = $1", candidate_id)
-        (suite, codebase) = await conn.fetchrow(
-            "DELETE FROM candidate WHERE id = $1 RETURNING suite, codebase",
-            candidate_id,
-        )
-        await conn.execute(
-            "DELETE FROM queue WHERE suite = $1 AND codebase = $2", suite, codebase
-        )
-        return web.json_response({})
+    async with queue_processor.database.acquire() as conn:
+        async with queue_processor.queue_positions.transaction(conn):
+            await conn.fetchrow(
+                "DELETE FROM followup WHERE candidate = $1", candidate_id
+            )
+            (suite, codebase) = await conn.fetchrow(
+                "DELETE FROM candidate WHERE id = $1 RETURNING suite, codebase",
+                candidate_id,
+            )
+            await Queue(conn, queue_processor.queue_positions).delete_candidate(
+                suite, codebase
+            )
+            return web.json_response({})
+
+
+def _candidate_json(row):
+    return {
+        "id": row["id"],
+        "codebase": row["codebase"],
+        "campaign": row["suite"],
+        "command": row["command"],
+        "publish-policy": row["publish_policy"],
+        "change_set": row["change_set"],
+        "context": row["context"],
+        "value": row["value"],
+        "success_chance": row["success_chance"],
+    }
 
 
 @routes.get("/candidates", name="download-candidates")
 async def handle_candidate_download(request):
     queue_processor = request.app["queue_processor"]
-    ret = []
     async with queue_processor.database.acquire() as conn:
-        for row in await conn.fetch("SELECT * FROM candidate"):
-            ret.append(
-                {
-                    "id": row["id"],
-                    "codebase": row["codebase"],
-                    "campaign": row["suite"],
-                    "command": row["command"],
-                    "publish-policy": row["publish_policy"],
-                    "change_set": row["change_set"],
-                    "context": row["context"],
-                    "value": row["value"],
-                    "success_chance": row["success_chance"],
-                }
-            )
-    return web.json_response(ret)
+        return await _export_rows(
+            request,
+            conn,
+            "SELECT id, codebase, suite, command, publish_policy, change_set, "
+            "context, value, success_chance FROM candidate WHERE true",
+            _candidate_json,
+        )
+
+
+async def _iter_json_array(chunks):
+    """Iterate over the items of a JSON array, decoding it incrementally.
+
+    Args:
+      chunks: async iterator over the encoded JSON text, in chunks
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = chunks.__aiter__()
+    buf = ""
+    eof = False
+    # One of "start", "first", "value" (after a comma), "next" (after a
+    # value) and "end"
+    state = "start"
+    while True:
+        buf = buf.lstrip(" \t\r\n")
+        need_more = not buf
+        if buf and state == "start":
+            if buf[0] != "[":
+                raise ValueError("expected a JSON array")
+            buf = buf[1:]
+            state = "first"
+        elif buf and state in ("first", "next") and buf[0] == "]":
+            buf = buf[1:]
+            state = "end"
+        elif buf and state == "end":
+            raise ValueError("unexpected data after JSON array")
+        elif buf and state == "next":
+            if buf[0] != ",":
+                raise ValueError("expected ',' or ']'")
+            buf = buf[1:]
+            state = "value"
+        elif buf:
+            try:
+                item, end = decoder.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                need_more = True
+            else:
+                # A value at the very end of the buffer (e.g. a number) may
+                # continue in the next chunk.
+                if end < len(buf) or eof:
+                    yield item
+                    buf = buf[end:]
+                    state = "next"
+                else:
+                    need_more = True
+        if need_more:
+            if eof:
+                if state == "end":
+                    return
+                raise ValueError("unexpected end of JSON array")
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                eof = True
+                chunk = b""
+            buf += utf8.decode(chunk, final=eof)
+
+
+async def _iter_uploaded_candidates(request):
+    try:
+        if request.content_type == "application/x-ndjson":
+            async for line in request.content:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            async for candidate in _iter_json_array(
+                request.content.iter_chunked(UPLOAD_CHUNK_SIZE)
+            ):
+                yield candidate
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=f"invalid candidate list: {e}") from e
 
 
 @routes.post("/candidates", name="upload-candidates")
 async def handle_candidates_upload(request):
+    """Add or update a batch of candidates, and schedule them.
+
+    The body is either a JSON array or newline-delimited JSON. Candidates
+    are validated as they are read, then staged in a temporary table, so that
+    unknown codebases and publish policies can be resolved and the
+    candidates upserted with a handful of set-based statements.
+    """
     span = aiozipkin.request_span(request)
     unknown_codebases = set()
     unknown_campaigns = set()
@@ -2073,201 +2864,254 @@ async def handle_candidates_upload(request):
     invalid_value = set()
     unknown_publish_policies = set()
     queue_processor = request.app["queue_processor"]
-    async with queue_processor.database.acquire() as conn:
-        existing_runs_stmt = await conn.prepare(
-            "SELECT merge_proposal.url AS mp_url, "
-            "last_effective_runs.command AS command "
-            "FROM last_effective_runs "
-            "LEFT JOIN merge_proposal "
-            "ON last_effective_runs.revision = merge_proposal.revision "
-            "WHERE merge_proposal.status = 'open' "
-            "AND last_effective_runs.codebase = $1 "
-            "AND last_effective_runs.suite = $2 "
-            "AND last_effective_runs.command != $3"
-        )
-        insert_candidate_stmt = await conn.prepare(
-            "INSERT INTO candidate "
-            "(suite, command, change_set, context, value, "
-            "success_chance, publish_policy, codebase) "
-            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8) "
-            "ON CONFLICT (codebase, suite, coalesce(change_set, ''::text)) "
-            "DO UPDATE SET context = EXCLUDED.context, value = EXCLUDED.value, "
-            "success_chance = EXCLUDED.success_chance, "
-            "command = EXCLUDED.command, "
-            "publish_policy = EXCLUDED.publish_policy, "
-            "codebase = EXCLUDED.codebase RETURNING id"
-        )
-        insert_followup_stmt = await conn.prepare(
-            "INSERT INTO followup (origin, candidate) VALUES ($1, $2) "
-            "ON CONFLICT DO NOTHING"
-        )
-        async with conn.transaction():
-            known_campaign_names = [
-                campaign.name for campaign in request.app["config"].campaign
-            ]
+    known_campaign_names = [
+        campaign.name for campaign in request.app["config"].campaign
+    ]
 
-            ret = []
-            with span.new_child("process-candidates"):
-                for candidate in await request.json():
-                    tr = conn.transaction()
-                    await tr.start()
-                    try:
-                        try:
-                            codebase = candidate["codebase"]
-                        except KeyError as e:
-                            raise web.HTTPBadRequest(
-                                text=f"no codebase field for candidate {candidate}"
-                            ) from e
-                        if codebase is None:
-                            raise web.HTTPBadRequest(
-                                text=f"codebase field is None for candidate {candidate}"
-                            )
-                        try:
-                            campaign = candidate["campaign"]
-                        except KeyError as e:
-                            raise web.HTTPBadRequest(
-                                text=f"no campaign field for candidate {candidate}"
-                            ) from e
-
-                        if campaign not in known_campaign_names:
-                            logging.warning("unknown campaign %r", campaign)
-                            unknown_campaigns.add(campaign)
-                            await tr.rollback()
-                            continue
-
-                        command = candidate.get("command")
-                        if not command:
-                            try:
-                                campaign_config = get_campaign_config(
-                                    request.app["config"], campaign
-                                )
-                            except KeyError:
-                                logging.warning("unknown campaign %r", campaign)
-                                unknown_campaigns.add(campaign)
-                                await tr.rollback()
-                                continue
-                            command = campaign_config.command
-                            if not command:
-                                logging.warning(
-                                    "No command in candidate or campaign config"
-                                )
-                                invalid_command.add(command)
-                                await tr.rollback()
-                                continue
+    candidates: list[tuple] = []
+    with span.new_child("read-candidates"):
+        async for candidate in _iter_uploaded_candidates(request):
+            try:
+                codebase = candidate["codebase"]
+            except KeyError as e:
+                raise web.HTTPBadRequest(
+                    text=f"no codebase field for candidate {candidate}"
+                ) from e
+            if codebase is None:
+                raise web.HTTPBadRequest(
+                    text=f"codebase field is None for candidate {candidate}"
+                )
+            try:
+                campaign = candidate["campaign"]
+            except KeyError as e:
+                raise web.HTTPBadRequest(
+                    text=f"no campaign field for candidate {candidate}"
+                ) from e
+
+            if campaign not in known_campaign_names:
+                logging.warning("unknown campaign %r", campaign)
+                unknown_campaigns.add(campaign)
+                continue
 
-                        publish_policy = candidate.get("publish-policy")
+            command = candidate.get("command")
+            if not command:
+                try:
+                    campaign_config = get_campaign_config(
+                        request.app["config"], campaign
+                    )
+                except KeyError:
+                    logging.warning("unknown campaign %r", campaign)
+                    unknown_campaigns.add(campaign)
+                    continue
+                command = campaign_config.command
+                if not command:
+                    logging.warning("No command in candidate or campaign config")
+                    invalid_command.add(command)
+                    continue
 
-                        if candidate.get("value") == 0:
-                            logging.warning(
-                                "invalid value for candidate: %r",
-                                candidate.get("value"),
-                            )
-                            invalid_value.add(candidate.get("value"))
-                            await tr.rollback()
-                            continue
+            if candidate.get("value") == 0:
+                logging.warning(
+                    "invalid value for candidate: %r", candidate.get("value")
+                )
+                invalid_value.add(candidate.get("value"))
+                continue
 
-                        with span.new_child("sql:insert-candidates"):
-                            try:
-                                candidate_id = await insert_candidate_stmt.fetchval(
-                                    campaign,
-                                    command,
-                                    candidate.get("change_set"),
-                                    candidate.get("context"),
-                                    candidate.get("value"),
-                                    candidate.get("success_chance"),
-                                    publish_policy,
-                                    candidate["codebase"],
-                                )
-                            except asyncpg.ForeignKeyViolationError as e:
-                                if e.constraint_name == "candidate_codebase_fkey":
-                                    logging.warning(
-                                        "ignoring candidate %s/%s; codebase unknown",
-                                        codebase,
-                                        candidate["campaign"],
-                                    )
-                                    unknown_codebases.add(codebase)
-                                    await tr.rollback()
-                                    continue
-                                elif (
-                                    e.constraint_name == "candidate_publish_policy_fkey"
-                                ):
-                                    logging.warning(
-                                        "unknown publish policy %s", publish_policy
-                                    )
-                                    unknown_publish_policies.add(publish_policy)
-                                    await tr.rollback()
-                                    continue
-                                else:
-                                    raise
-
-                        # Adjust bucket if there are any open merge proposals with a
-                        # different command
-
-                        with span.new_child("sql:existing-runs"):
-                            existing_runs = await existing_runs_stmt.fetch(
-                                candidate["codebase"], campaign, command
-                            )
+            candidates.append(
+                (
+                    len(candidates),
+                    codebase,
+                    campaign,
+                    command,
+                    candidate.get("change_set"),
+                    candidate.get("context"),
+                    candidate.get("value"),
+                    candidate.get("success_chance"),
+                    candidate.get("publish-policy"),
+                    candidate.get("bucket"),
+                    candidate.get("requester"),
+                    candidate.get("followup_for", []),
+                )
+            )
 
-                        if any(existing_runs):
-                            refresh = True
-                            if existing_runs[0]["mp_url"]:
-                                bucket = "update-existing-mp"
-                                requester = "command changed for existing mp: {!r} ⇒ {!r}".format(
-                                    existing_runs[0]["command"], command
-                                )
-                            else:
-                                bucket = None
-                                requester = "command changed: {!r} ⇒ {!r}".format(
-                                    existing_runs[0]["command"], command
+    ret = []
+    if candidates:
+        async with queue_processor.database.acquire() as conn:
+            async with queue_processor.queue_positions.transaction(conn):
+                with span.new_child("sql:stage-candidates"):
+                    await conn.execute(
+                        "CREATE TEMPORARY TABLE IF NOT EXISTS candidate_staging ("
+                        "seq integer, codebase text, suite text, command text, "
+                        "change_set text, context text, value integer, "
+                        "success_chance double precision, publish_policy text, "
+                        "bucket text, requester text, followup_for text[]) "
+                        "ON COMMIT DELETE ROWS"
+                    )
+                    await conn.execute("TRUNCATE candidate_staging")
+                    await conn.copy_records_to_table(
+                        "candidate_staging", records=candidates
+                    )
+
+                with span.new_child("sql:resolve-references"):
+                    rejected = set()
+                    for row in await conn.fetch(
+                        "DELETE FROM candidate_staging AS s WHERE NOT EXISTS "
+                        "(SELECT FROM codebase WHERE name = s.codebase) "
+                        "RETURNING seq, codebase, suite"
+                    ):
+                        logging.warning(
+                            "ignoring candidate %s/%s; codebase unknown",
+                            row["codebase"],
+                            row["suite"],
+                        )
+                        unknown_codebases.add(row["codebase"])
+                        rejected.add(row["seq"])
+                    for row in await conn.fetch(
+                        "DELETE FROM candidate_staging AS s "
+                        "WHERE publish_policy IS NOT NULL AND NOT EXISTS "
+                        "(SELECT FROM named_publish_policy "
+                        "WHERE name = s.publish_policy) "
+                        "RETURNING seq, publish_policy"
+                    ):
+                        logging.warning(
+                            "unknown publish policy %s", row["publish_policy"]
+                        )
+                        unknown_publish_policies.add(row["publish_policy"])
+                        rejected.add(row["seq"])
+
+                with span.new_child("sql:insert-candidates"):
+                    # If a candidate appears more than once, the last entry wins;
+                    # PostgreSQL refuses to update the same row twice in one
+                    # statement.
+                    await conn.execute(
+                        "INSERT INTO candidate "
+                        "(suite, command, change_set, context, value, "
+                        "success_chance, publish_policy, codebase) "
+                        "SELECT DISTINCT ON (codebase, suite, coalesce(change_set, '')) "
+                        "suite, command, change_set, context, value, "
+                        "success_chance, publish_policy, codebase "
+                        "FROM candidate_staging "
+                        "ORDER BY codebase, suite, coalesce(change_set, ''), seq DESC "
+                        "ON CONFLICT (codebase, suite, coalesce(change_set, ''::text)) "
+                        "DO UPDATE SET context = EXCLUDED.context, "
+                        "value = EXCLUDED.value, "
+                        "success_chance = EXCLUDED.success_chance, "
+                        "command = EXCLUDED.command, "
+                        "publish_policy = EXCLUDED.publish_policy, "
+                        "codebase = EXCLUDED.codebase"
+                    )
+
+                with span.new_child("sql:insert-followups"):
+                    await conn.execute(
+                        "INSERT INTO followup (origin, candidate) "
+                        "SELECT DISTINCT run.id, candidate.id "
+                        "FROM candidate_staging AS s "
+                        "CROSS JOIN unnest(s.followup_for) AS f(origin) "
+                        "JOIN run ON run.id = f.origin "
+                        "JOIN candidate ON candidate.codebase = s.codebase "
+                        "AND candidate.suite = s.suite "
+                        "AND coalesce(candidate.change_set, '') = "
+                        "coalesce(s.change_set, '') "
+                        "ON CONFLICT DO NOTHING"
+                    )
+
+                # Adjust bucket if there are any open merge proposals with a
+                # different command
+                with span.new_child("sql:existing-runs"):
+                    existing_runs = {
+                        row["seq"]: row
+                        for row in await conn.fetch(
+                            "SELECT DISTINCT ON (s.seq) s.seq, "
+                            "merge_proposal.url AS mp_url, "
+                            "last_effective_runs.command AS command "
+                            "FROM candidate_staging AS s "
+                            "JOIN last_effective_runs "
+                            "ON last_effective_runs.codebase = s.codebase "
+                            "AND last_effective_runs.suite = s.suite "
+                            "AND last_effective_runs.command != s.command "
+                            "LEFT JOIN merge_proposal "
+                            "ON last_effective_runs.revision = merge_proposal.revision "
+                            "WHERE merge_proposal.status = 'open' "
+                            "ORDER BY s.seq"
+                        )
+                    }
+
+                todo = []
+                for (
+                    seq,
+                    codebase,
+                    campaign,
+                    command,
+                    change_set,
+                    context,
+                    value,
+                    success_chance,
+                    publish_policy,
+                    bucket,
+                    candidate_requester,
+                    followup_for,
+                ) in candidates:
+                    if seq in rejected:
+                        continue
+                    existing_run = existing_runs.get(seq)
+                    if existing_run is not None:
+                        refresh = True
+                        if existing_run["mp_url"]:
+                            bucket = "update-existing-mp"
+                            requester = (
+                                "command changed for existing mp: {!r} ⇒ {!r}".format(
+                                    existing_run["command"], command
                                 )
+                            )
                         else:
-                            bucket = candidate.get("bucket")
-                            refresh = False
-                            requester = "candidate update"
-
-                        if candidate.get("requester"):
-                            requester += f" {candidate['requester']}"
-
-                        with span.new_child("sql:insert-followups"):
-                            for origin in candidate.get("followup_for", []):
-                                await insert_followup_stmt.execute(candidate_id, origin)
-
-                        with span.new_child("schedule"):
-                            # This shouldn't raise CandidateUnavailable, since
-                            # we just added the candidate
-                            (
-                                offset,
-                                estimated_duration,
-                                queue_id,
-                                bucket,
-                            ) = await do_schedule_regular(
-                                conn,
-                                campaign=campaign,
-                                change_set=candidate.get("change_set"),
-                                bucket=bucket,
-                                requester=requester,
-                                command=command,
-                                codebase=candidate["codebase"],
-                                refresh=refresh,
+                            bucket = None
+                            requester = "command changed: {!r} ⇒ {!r}".format(
+                                existing_run["command"], command
                             )
-                    except BaseException:
-                        await tr.rollback()
-                        raise
                     else:
-                        await tr.commit()
+                        refresh = False
+                        requester = "candidate update"
 
-                    ret.append(
+                    if candidate_requester:
+                        requester += f" {candidate_requester}"
+
+                    todo.append(
                         {
+                            "codebase": codebase,
                             "campaign": campaign,
-                            "codebase": candidate["codebase"],
+                            "change_set": change_set,
+                            "command": command,
+                            "context": context,
+                            "candidate_value": value,
+                            "success_chance": success_chance,
+                            "bucket": bucket,
+                            "refresh": refresh,
+                            "requester": requester,
+                        }
+                    )
+
+                with span.new_child("schedule"):
+                    scheduled = await do_schedule_regular_many(
+                        conn,
+                        todo,
+                        position_index=queue_processor.queue_positions,
+                        debian_versions=queue_processor.debian_versions,
+                    )
+
+                for entry, (offset, estimated_duration, queue_id, bucket) in zip(
+                    todo, scheduled
+                ):
+                    ret.append(
+                        {
+                            "campaign": entry["campaign"],
+                            "codebase": entry["codebase"],
                             "bucket": bucket,
-                            "change_set": candidate.get("change_set"),
+                            "change_set": entry["change_set"],
                             "offset": offset,
                             "estimated_duration": estimated_duration.total_seconds()
                             if estimated_duration is not None
                             else None,
                             "queue-id": queue_id,
-                            "refresh": refresh,
+                            "refresh": entry["refresh"],
                         }
                     )
 
@@ -2768,6 +3612,8 @@ async def next_item(
         pass
     else:
         await queue_processor.unclaim_run(active_run.log_id)
+        async with queue_processor.database.acquire() as conn:
+            await Queue(conn).release_items([item.id])
     return assignment
 
 
@@ -2792,86 +3638,138 @@ async def finish(
     worker_result = None
 
     filenames = []
-    with tempfile.TemporaryDirectory(prefix="janitor-run") as output_directory:
-        with span.new_child("read-files"):
-            while True:
-                part = await reader.next()
-                if part is None:
-                    break
-                if isinstance(part, MultipartReader):
-                    raise web.HTTPBadRequest(text="nested multi-part")
-                if part.filename == "result.json":
-                    worker_result = WorkerResult.from_json(await part.json())
-                elif part.filename is None:
-                    raise web.HTTPBadRequest(text="Part without filename")
-                else:
-                    filenames.append(part.filename)
-                    output_path = os.path.join(output_directory, part.filename)
-                    with open(output_path, "wb") as f:
-                        try:
-                            f.write(await part.read())
-                        except ConnectionResetError as e:
-                            raise web.HTTPBadRequest(text=str(e)) from e
+    # Log files that have been received, but can't be imported until the
+    # result (and thus the finish time) is known.
+    pending_logs: list[tuple[str, str]] = []
+    log_imports: list[asyncio.Task] = []
+    artifact_upload: Optional[asyncio.Task] = None
+
+    def start_log_import(name: str, path: str, worker_result: WorkerResult) -> None:
+        if worker_result.finish_time is not None:
+            mtime = int(worker_result.finish_time.timestamp())
+        else:
+            mtime = None
+        log_imports.append(
+            asyncio.create_task(
+                import_log(
+                    queue_processor.logfile_manager,
+                    active_run.codebase,
+                    active_run.log_id,
+                    name,
+                    path,
+                    mtime=mtime,
+                    backup_logfile_manager=queue_processor.backup_logfile_manager,
+                )
+            )
+        )
 
-        if worker_result is None:
-            raise web.HTTPBadRequest(text="Missing result JSON")
+    with tempfile.TemporaryDirectory(prefix="janitor-run") as output_directory:
+        try:
+            with span.new_child("read-files"):
+                while True:
+                    part = await reader.next()
+                    if part is None:
+                        break
+                    if isinstance(part, MultipartReader):
+                        raise web.HTTPBadRequest(text="nested multi-part")
+                    if part.filename == "result.json":
+                        worker_result = WorkerResult.from_json(await part.json())
+                        for name, path in pending_logs:
+                            start_log_import(name, path, worker_result)
+                        pending_logs = []
+                    elif part.filename is None:
+                        raise web.HTTPBadRequest(text="Part without filename")
+                    else:
+                        filenames.append(part.filename)
+                        output_path = os.path.join(output_directory, part.filename)
+                        with open(output_path, "wb") as f:
+                            try:
+                                while True:
+                                    chunk = await part.read_chunk(UPLOAD_CHUNK_SIZE)
+                                    if not chunk:
+                                        break
+                                    f.write(chunk)
+                            except ConnectionResetError as e:
+                                raise web.HTTPBadRequest(text=str(e)) from e
+                        if is_log_filename(part.filename):
+                            if worker_result is None:
+                                pending_logs.append((part.filename, output_path))
+                            else:
+                                start_log_import(
+                                    part.filename, output_path, worker_result
+                                )
 
-        logging.debug("worker result: %r", worker_result)
+            if worker_result is None:
+                raise web.HTTPBadRequest(text="Missing result JSON")
 
-        if worker_name is None:
-            worker_name = worker_result.worker_name
+            logging.debug("worker result: %r", worker_result)
 
-        with span.new_child("gather-logs"):
-            logfiles = list(gather_logs(output_directory))
+            if worker_name is None:
+                worker_name = worker_result.worker_name
 
-        logfilenames = [entry.name for entry in logfiles]
+            with span.new_child("gather-logs"):
+                logfiles = list(gather_logs(output_directory))
 
-        result = JanitorResult(
-            codebase=active_run.codebase,
-            campaign=active_run.campaign,
-            log_id=active_run.log_id,
-            code="success",
-            worker_name=worker_name,
-            branch_url=worker_result.branch_url,
-            vcs_type=worker_result.vcs_type,
-            subpath=worker_result.subpath,
-            worker_result=worker_result,
-            logfilenames=logfilenames,
-            resume_from=resume_from,
-            change_set=active_run.change_set,
-        )
+            logfilenames = [entry.name for entry in logfiles]
 
-        with span.new_child("import-logs"):
-            await import_logs(
-                logfiles,
-                queue_processor.logfile_manager,
-                active_run.codebase,
-                active_run.log_id,
-                mtime=result.finish_time.timestamp(),
-                backup_logfile_manager=queue_processor.backup_logfile_manager,
+            result = JanitorResult(
+                codebase=active_run.codebase,
+                campaign=active_run.campaign,
+                log_id=active_run.log_id,
+                code="success",
+                worker_name=worker_name,
+                branch_url=worker_result.branch_url,
+                vcs_type=worker_result.vcs_type,
+                subpath=worker_result.subpath,
+                worker_result=worker_result,
+                logfilenames=logfilenames,
+                resume_from=resume_from,
+                change_set=active_run.change_set,
             )
 
-        if result.builder_result is not None:
-            result.builder_result.from_directory(output_directory)
-
-            artifact_names = result.builder_result.artifact_filenames()
-            with span.new_child("upload-artifacts-with-backup"):
-                try:
-                    await store_artifacts_with_backup(
-                        queue_processor.artifact_manager,
-                        queue_processor.backup_artifact_manager,
-                        output_directory,
-                        active_run.log_id,
-                        artifact_names,
-                    )
-                except BaseException as e:
-                    result.code = "artifact-upload-failed"
-                    result.description = str(e)
-                    artifact_upload_failed_count.inc()
-                    # TODO(jelmer): Mark ourselves as unhealthy?
-                    artifact_names = None
-        else:
-            artifact_names = None
+            async def upload_artifacts():
+                artifact_names = result.builder_result.artifact_filenames()
+                with span.new_child("upload-artifacts-with-backup"):
+                    try:
+                        await store_artifacts_with_backup(
+                            queue_processor.artifact_manager,
+                            queue_processor.backup_artifact_manager,
+                            output_directory,
+                            active_run.log_id,
+                            artifact_names,
+                        )
+                    except BaseException as e:
+                        result.code = "artifact-upload-failed"
+                        result.description = str(e)
+                        artifact_upload_failed_count.inc()
+                        # TODO(jelmer): Mark ourselves as unhealthy?
+                        return None
+                return artifact_names
+
+            # Artifacts are uploaded while any remaining logs are still being
+            # imported.
+            if result.builder_result is not None:
+                result.builder_result.from_directory(output_directory)
+                artifact_upload = asyncio.create_task(upload_artifacts())
+
+            with span.new_child("import-logs"):
+                await asyncio.gather(*log_imports)
+
+            if artifact_upload is not None:
+                artifact_names = await artifact_upload
+            else:
+                artifact_names = None
+        finally:
+            # Don't leave anything reading from the output directory once it
+            # is removed.
+            unfinished = [
+                task
+                for task in [*log_imports, artifact_upload]
+                if task is not None and not task.done()
+            ]
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
 
     with span.new_child("finish-run"):
         await queue_processor.finish_run(active_run, result)
@@ -3047,6 +3945,22 @@ async def main_async(argv=None):
         help="Time before marking a run as having timed out (minutes)",
         default=60,
     )
+    parser.add_argument(
+        "--queue-buffer-size",
+        type=int,
+        help="Number of queue items to claim from the database at once",
+        default=DEFAULT_QUEUE_BUFFER_SIZE,
+    )
+    parser.add_argument(
+        "--log-compression",
+        choices=["gzip", "zstd"],
+        default="gzip",
+        help=(
+            "Compression to use for newly imported logs. zstd uses the most "
+            "recently trained dictionary, if any "
+            "(see helpers/train-log-dictionary.py)."
+        ),
+    )
     parser.add_argument(
         "--avoid-host",
         type=str,
@@ -3111,6 +4025,13 @@ async def main_async(argv=None):
     async with AsyncExitStack() as stack:
         await stack.enter_async_context(artifact_manager)
         await stack.enter_async_context(logfile_manager)
+        if args.log_compression == "zstd":
+            logfile_manager.compression = "zstd"
+            logfile_manager.compression_dictionary = (
+                await logfile_manager.get_dictionary()
+            )
+            if logfile_manager.compression_dictionary is None:
+                logging.warning("No compression dictionary found; using plain zstd")
         if args.backup_directory:
             backup_logfile_directory = os.path.join(args.backup_directory, "logs")
             backup_artifact_directory = os.path.join(args.backup_directory, "artifacts")
@@ -3147,9 +4068,12 @@ async def main_async(argv=None):
             avoid_hosts=set(args.avoid_host),
             dep_server_url=args.public_dep_server_url,
             apt_archive_url=args.public_apt_archive_location,
+            queue_buffer_size=args.queue_buffer_size,
         )
 
         queue_processor.start_watchdog()
+        queue_processor.start_queue_positions_refresher()
+        queue_processor.queue_status.start()
 
         if args.public_port:
             public_app = await create_public_app(
@@ -21,15 +21,16 @@ __all__ = [
 
 import logging
 import shlex
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Optional
 
 import asyncpg
 from debian.changelog import Version
 
 from . import set_user_agent
 from .config import read_config
-from .queue import Queue
+from .queue import Queue, QueuePositionIndex
 
 FIRST_RUN_BONUS = 100.0
 
@@ -38,6 +39,15 @@ FIRST_RUN_BONUS = 100.0
 DEFAULT_ESTIMATED_DURATION = 15
 DEFAULT_SCHEDULE_OFFSET = -1.0
 
+# Weight of each new run in the recency-weighted mean durations
+# (recent_duration) kept in the run statistics. This has to match the
+# run_trigger_refresh_run_statistics trigger.
+RECENT_DURATION_WEIGHT = 0.25
+
+# How long the versions loaded into a DebianVersionIndex are used for
+# before they are reloaded from the database.
+DEFAULT_DEBIAN_VERSIONS_MAX_AGE = timedelta(hours=1)
+
 
 # In some cases, we want to ignore certain results when guessing
 # whether a future run is going to be successful.
@@ -113,17 +123,56 @@ async def _estimate_duration(
     codebase: Optional[str] = None,
     campaign: Optional[str] = None,
 ) -> Optional[timedelta]:
-    query = """
-SELECT AVG(finish_time - start_time) FROM run
-WHERE failure_transient is not True """
-    args: list[str] = []
-    if codebase is not None:
-        query += f" AND codebase = ${len(args) + 1}"
-        args.append(codebase)
-    if campaign is not None:
-        query += f" AND suite = ${len(args) + 1}"
-        args.append(campaign)
-    return await conn.fetchval(query, *args)
+    if codebase is not None and campaign is not None:
+        return await conn.fetchval(
+            "SELECT recent_duration FROM run_statistics "
+            "WHERE codebase = $1 AND campaign = $2",
+            codebase,
+            campaign,
+        )
+    elif codebase is not None:
+        return await conn.fetchval(
+            "SELECT sum(duration_sum) / sum(duration_count) FROM run_statistics "
+            "WHERE codebase = $1 HAVING sum(duration_count) > 0",
+            codebase,
+        )
+    elif campaign is not None:
+        return await conn.fetchval(
+            "SELECT sum(duration_sum) / sum(duration_count) "
+            "FROM campaign_run_statistics "
+            "WHERE campaign = $1 HAVING sum(duration_count) > 0",
+            campaign,
+        )
+    else:
+        return await conn.fetchval(
+            "SELECT sum(duration_sum) / sum(duration_count) "
+            "FROM campaign_run_statistics HAVING sum(duration_count) > 0"
+        )
+
+
+async def _bulk_estimate_fallback_durations(
+    conn: asyncpg.Connection, codebases: list[str], campaigns: list[str]
+) -> tuple[dict[str, timedelta], dict[str, timedelta]]:
+    """Find the mean run durations for codebases and campaigns."""
+    codebase_durations = {
+        row["codebase"]: row["duration"]
+        for row in await conn.fetch(
+            "SELECT codebase, sum(duration_sum) / sum(duration_count) AS duration "
+            "FROM run_statistics WHERE codebase = ANY($1::text[]) "
+            "GROUP BY codebase HAVING sum(duration_count) > 0",
+            codebases,
+        )
+    }
+    campaign_durations = {
+        row["campaign"]: row["duration"]
+        for row in await conn.fetch(
+            "SELECT campaign, sum(duration_sum) / sum(duration_count) AS duration "
+            "FROM campaign_run_statistics WHERE campaign = ANY($1::text[]) "
+            "GROUP BY campaign HAVING sum(duration_count) > 0",
+            campaigns,
+        )
+    }
+    return codebase_durations, campaign_durations
 
 
 async def estimate_duration(
@@ -147,20 +196,70 @@ async def estimate_duration(
     return timedelta(seconds=DEFAULT_ESTIMATED_DURATION)
 
 
+async def bulk_estimate_duration(
+    conn: asyncpg.Connection, todo: list[tuple[str, str]]
+) -> list[timedelta]:
+    """Estimate durations for many (codebase, campaign) pairs at once.
+
+    This gives the same results as calling estimate_duration for each pair.
+    """
+    if not todo:
+        return []
+    pairs = sorted(set(todo))
+    pair_durations = {
+        (row["codebase"], row["campaign"]): row["duration"]
+        for row in await conn.fetch(
+            "SELECT s.codebase, s.campaign, s.recent_duration AS duration "
+            "FROM run_statistics AS s, "
+            "unnest($1::text[], $2::text[]) AS t(codebase, campaign) "
+            "WHERE s.codebase = t.codebase AND s.campaign = t.campaign "
+            "AND s.recent_duration IS NOT NULL",
+            [codebase for (codebase, campaign) in pairs],
+            [campaign for (codebase, campaign) in pairs],
+        )
+    }
+    codebase_durations, campaign_durations = await _bulk_estimate_fallback_durations(
+        conn,
+        sorted({codebase for (codebase, campaign) in pairs}),
+        sorted({campaign for (codebase, campaign) in pairs}),
+    )
+    ret = []
+    for codebase, campaign in todo:
+        for estimated_duration in [
+            pair_durations.get((codebase, campaign)),
+            codebase_durations.get(codebase),
+            campaign_durations.get(campaign),
+        ]:
+            if estimated_duration is not None:
+                break
+        else:
+            estimated_duration = timedelta(seconds=DEFAULT_ESTIMATED_DURATION)
+        ret.append(estimated_duration)
+    return ret
+
+
 async def estimate_success_probability_and_duration(
     conn: asyncpg.Connection,
     codebase: str,
     campaign: str,
     context: Optional[str] = None,
+    debian_versions: Optional["DebianVersionIndex"] = None,
 ) -> tuple[float, timedelta, int]:
-    # TODO(jelmer): Bias this towards recent runs?
+    """Estimate success probability and duration for a single candidate.
+
+    Unlike bulk_estimate_success_probability_and_duration, this looks at
+    all the previous runs rather than at the run statistics. It should give
+    the same results, and serves as a reference for the bulk version.
+    """
     total = 0
     success = 0
     if context is None:
         same_context_multiplier = 0.5
     else:
         same_context_multiplier = 1.0
-    durations = []
+    estimated_duration: Optional[timedelta] = None
+    if debian_versions is None:
+        debian_versions = _default_debian_versions
     for run in await conn.fetch(
         """
 SELECT
@@ -169,22 +268,29 @@ SELECT
   start_time
 FROM run
 WHERE codebase = $1 AND suite = $2 AND failure_transient IS NOT True
-ORDER BY start_time DESC
+ORDER BY finish_time, id
 """,
         codebase,
         campaign,
     ):
+        # Worker failures don't say much about how long a run takes.
+        if run["result_code"] != "worker-failure" and run["duration"] is not None:
+            if estimated_duration is None:
+                estimated_duration = run["duration"]
+            else:
+                estimated_duration = (
+                    estimated_duration * (1 - RECENT_DURATION_WEIGHT)
+                    + run["duration"] * RECENT_DURATION_WEIGHT
+                )
+
         try:
             ignore_checker = IGNORE_RESULT_CODE[run["result_code"]]
         except KeyError:
+            pass
+        else:
+            if ignore_checker(run):
+                continue
 
-            def ignore_checker(run):
-                return False
-
-        if ignore_checker(run):
-            continue
-
-        durations.append(run["duration"])
         total += 1
         if run["result_code"] == "success":
             success += 1
@@ -196,9 +302,11 @@ ORDER BY start_time DESC
             and run["failure_details"]
             and run["failure_details"].get("relations")
         ):
-            if await deps_satisfied(
-                conn, campaign, run["failure_details"]["relations"]
-            ):
+            if (
+                await debian_versions.deps_satisfied_many(
+                    conn, [run["failure_details"]["relations"]]
+                )
+            )[0]:
                 success += 1
                 same_context = False
         if same_context:
@@ -209,17 +317,14 @@ ORDER BY start_time DESC
         # we don't know the context.
         same_context_multiplier = 1.0
 
+    if estimated_duration is None:
         # It's going to be hard to estimate the duration, but other codemods
         # might be a good candidate
         estimated_duration = await _estimate_duration(conn, codebase=codebase)
-        if estimated_duration is None:
-            estimated_duration = await _estimate_duration(conn, campaign=campaign)
-        if estimated_duration is None:
-            estimated_duration = timedelta(seconds=DEFAULT_ESTIMATED_DURATION)
-    else:
-        estimated_duration = timedelta(
-            seconds=(sum([d.total_seconds() for d in durations]) / len(durations))
-        )
+    if estimated_duration is None:
+        estimated_duration = await _estimate_duration(conn, campaign=campaign)
+    if estimated_duration is None:
+        estimated_duration = timedelta(seconds=DEFAULT_ESTIMATED_DURATION)
 
     return (
         ((success * 10 + 1) / (total * 10 + 1) * same_context_multiplier),
@@ -228,6 +333,187 @@ ORDER BY start_time DESC
     )
 
 
+async def bulk_estimate_success_probability_and_duration(
+    conn: asyncpg.Connection,
+    todo: list[tuple[str, str, Optional[str]]],
+    debian_versions: Optional["DebianVersionIndex"] = None,
+) -> list[tuple[float, timedelta, int]]:
+    """Estimate success probability and duration for many candidates at once.
+
+    The totals and the recency-weighted mean durations come from the
+    run_statistics table; only runs with result codes that need to be looked
+    at individually are read from the run table. The results match those of
+    estimate_success_probability_and_duration.
+
+    Args:
+      todo: list of (codebase, campaign, context) tuples
+      debian_versions: Index to use for checking unsatisfied dependencies
+
+    Returns:
+      list of (probability, estimated duration, total previous runs) tuples,
+      in the same order as todo
+    """
+    if not todo:
+        return []
+    pairs = sorted({(codebase, campaign) for (codebase, campaign, context) in todo})
+    # Runs with these result codes need to be looked at individually.
+    special_codes = sorted(
+        set(IGNORE_RESULT_CODE) | {"install-deps-unsatisfied-dependencies"}
+    )
+
+    totals: dict[tuple[str, str], int] = {}
+    successes: dict[tuple[str, str], int] = {}
+    recent_durations: dict[tuple[str, str], timedelta] = {}
+    for row in await conn.fetch(
+        """
+SELECT
+  s.codebase, s.campaign, s.run_count, s.success_count, s.recent_duration
+FROM run_statistics AS s, unnest($1::text[], $2::text[]) AS t(codebase, campaign)
+WHERE s.codebase = t.codebase AND s.campaign = t.campaign
+""",
+        [codebase for (codebase, campaign) in pairs],
+        [campaign for (codebase, campaign) in pairs],
+    ):
+        key = (row["codebase"], row["campaign"])
+        totals[key] = row["run_count"]
+        successes[key] = row["success_count"]
+        if row["recent_duration"] is not None:
+            recent_durations[key] = row["recent_duration"]
+
+    # (codebase, campaign, context) entries with a previous run in the same
+    # context.
+    same_context: set[tuple[str, str, str]] = {
+        (row["codebase"], row["campaign"], row["context"])
+        for row in await conn.fetch(
+            """
+SELECT DISTINCT t.codebase, t.campaign, t.context
+FROM unnest($1::text[], $2::text[], $3::text[]) AS t(codebase, campaign, context)
+WHERE t.context IS NOT NULL AND t.context != '' AND EXISTS (
+  SELECT FROM run
+  WHERE run.codebase = t.codebase AND run.suite = t.campaign
+    AND run.failure_transient IS NOT True
+    AND run.result_code != ALL($4::text[])
+    AND t.context IN (run.instigated_context, run.context))
+""",
+            [codebase for (codebase, campaign, context) in todo],
+            [campaign for (codebase, campaign, context) in todo],
+            [context for (codebase, campaign, context) in todo],
+            special_codes,
+        )
+    }
+
+    contexts: dict[tuple[str, str], set[str]] = {}
+    for codebase, campaign, context in todo:
+        if context:
+            contexts.setdefault((codebase, campaign), set()).add(context)
+
+    runs = []
+    for run in await conn.fetch(
+        """
+SELECT
+  run.codebase, run.suite AS campaign, result_code, instigated_context,
+  run.context, failure_details, start_time
+FROM run, unnest($1::text[], $2::text[]) AS t(codebase, campaign)
+WHERE run.codebase = t.codebase AND run.suite = t.campaign
+  AND failure_transient IS NOT True AND result_code = ANY($3::text[])
+""",
+        [codebase for (codebase, campaign) in pairs],
+        [campaign for (codebase, campaign) in pairs],
+        special_codes,
+    ):
+        key = (run["codebase"], run["campaign"])
+        try:
+            ignore_checker = IGNORE_RESULT_CODE[run["result_code"]]
+        except KeyError:
+            pass
+        else:
+            if ignore_checker(run):
+                # Already included in the statistics; take it out again.
+                # Worker failures don't count towards the durations.
+                totals[key] = totals.get(key, 0) - 1
+                continue
+        runs.append(run)
+
+    unsatisfied = [
+        run
+        for run in runs
+        if run["result_code"] == "install-deps-unsatisfied-dependencies"
+        and run["failure_details"]
+        and run["failure_details"].get("relations")
+    ]
+    if debian_versions is None:
+        debian_versions = _default_debian_versions
+    satisfied = dict(
+        zip(
+            map(id, unsatisfied),
+            await debian_versions.deps_satisfied_many(
+                conn, [run["failure_details"]["relations"] for run in unsatisfied]
+            ),
+        )
+    )
+
+    for run in runs:
+        key = (run["codebase"], run["campaign"])
+        matching_contexts = contexts.get(key, set()) & {
+            run["instigated_context"],
+            run["context"],
+        }
+        if satisfied.get(id(run)):
+            successes[key] = successes.get(key, 0) + 1
+            matching_contexts = set()
+        same_context.update((*key, context) for context in matching_contexts)
+
+    # Fallback durations for candidates without any previous runs with a
+    # known duration.
+    unrun = [pair for pair in pairs if pair not in recent_durations]
+    codebase_durations: dict[str, timedelta] = {}
+    campaign_durations: dict[str, timedelta] = {}
+    if unrun:
+        (
+            codebase_durations,
+            campaign_durations,
+        ) = await _bulk_estimate_fallback_durations(
+            conn,
+            sorted({codebase for (codebase, campaign) in unrun}),
+            sorted({campaign for (codebase, campaign) in unrun}),
+        )
+
+    ret = []
+    for codebase, campaign, context in todo:
+        key = (codebase, campaign)
+        total = totals.get(key, 0)
+        if total == 0:
+            # If there were no previous runs, then it doesn't really matter
+            # that we don't know the context.
+            same_context_multiplier = 1.0
+        else:
+            if context is None:
+                same_context_multiplier = 0.5
+            else:
+                same_context_multiplier = 1.0
+            if context and (codebase, campaign, context) in same_context:
+                same_context_multiplier = 0.1
+        estimated_duration = recent_durations.get(key)
+        if estimated_duration is None:
+            # It's going to be hard to estimate the duration, but other
+            # codemods might be a good candidate
+            estimated_duration = codebase_durations.get(codebase)
+            if estimated_duration is None:
+                estimated_duration = campaign_durations.get(campaign)
+            if estimated_duration is None:
+                estimated_duration = timedelta(seconds=DEFAULT_ESTIMATED_DURATION)
+        ret.append(
+            (
+                (successes.get(key, 0) * 10 + 1)
+                / (total * 10 + 1)
+                * same_context_multiplier,
+                estimated_duration,
+                total,
+            )
+        )
+    return ret
+
+
 # Overhead of doing a run; estimated to be roughly 20s
 MINIMUM_COST = 20000.0
 MINIMUM_NORMALIZED_CODEBASE_VALUE = 0.1
@@ -313,6 +599,8 @@ async def do_schedule_regular(
     dry_run: bool = False,
     refresh: bool = False,
     bucket: Optional[str] = None,
+    position_index: Optional[QueuePositionIndex] = None,
+    debian_versions: Optional["DebianVersionIndex"] = None,
 ) -> tuple[float, Optional[timedelta], int, str]:
     assert codebase is not None
     assert campaign is not None
@@ -338,9 +626,11 @@ async def do_schedule_regular(
         estimated_probability_of_success,
         estimated_duration,
         total_previous_runs,
-    ) = await estimate_success_probability_and_duration(
-        conn, codebase, campaign, context
-    )
+    ) = (
+        await bulk_estimate_success_probability_and_duration(
+            conn, [(codebase, campaign, context)], debian_versions
+        )
+    )[0]
 
     assert estimated_duration >= timedelta(0), (
         f"{codebase}: estimated duration < 0.0: {estimated_duration!r}"
@@ -372,7 +662,7 @@ async def do_schedule_regular(
 
     assert command
     if not dry_run:
-        queue = Queue(conn)
+        queue = Queue(conn, position_index)
         queue_id, bucket = await queue.add(
             codebase=codebase,
             campaign=campaign,
@@ -391,13 +681,122 @@ async def do_schedule_regular(
     return offset, estimated_duration, queue_id, bucket
 
 
+async def do_schedule_regular_many(
+    conn: asyncpg.Connection,
+    todo: list[dict],
+    *,
+    dry_run: bool = False,
+    default_offset: float = 0.0,
+    position_index: Optional[QueuePositionIndex] = None,
+    debian_versions: Optional["DebianVersionIndex"] = None,
+    normalized_codebase_values: Optional[dict[str, float]] = None,
+) -> list[tuple[float, timedelta, int, str]]:
+    """Schedule a batch of candidates.
+
+    This gives the same results as calling do_schedule_regular for each entry
+    in todo, but estimates are loaded for all entries at once and the queue
+    is updated with a single statement.
+
+    Args:
+      todo: list of dictionaries with the same keys as the keyword
+        arguments to do_schedule_regular; command, candidate_value and
+        success_chance are taken as given rather than read from the
+        candidate table
+      normalized_codebase_values: normalized value per codebase; read from
+        the codebase table if not specified
+    Returns:
+      list of (offset, estimated duration, queue id, bucket) tuples, in the
+      same order as todo
+    """
+    if not todo:
+        return []
+    estimates = await bulk_estimate_success_probability_and_duration(
+        conn,
+        [
+            (entry["codebase"], entry["campaign"], entry.get("context"))
+            for entry in todo
+        ],
+        debian_versions,
+    )
+    if normalized_codebase_values is None:
+        normalized_codebase_values = {
+            row["name"]: float(row["value"])
+            for row in await conn.fetch(
+                "SELECT name, coalesce(least(1.0 * value / "
+                "(select max(value) from codebase), 1.0), 1.0) AS value "
+                "FROM codebase WHERE name = ANY($1::text[])",
+                sorted({entry["codebase"] for entry in todo}),
+            )
+        }
+    items = []
+    for entry, (
+        estimated_probability_of_success,
+        estimated_duration,
+        total_previous_runs,
+    ) in zip(todo, estimates):
+        codebase = entry["codebase"]
+        campaign = entry["campaign"]
+        assert estimated_duration >= timedelta(0), (
+            f"{codebase}: estimated duration < 0.0: {estimated_duration!r}"
+        )
+        try:
+            offset = calculate_offset(
+                estimated_duration=estimated_duration,
+                normalized_codebase_value=normalized_codebase_values.get(codebase),
+                estimated_probability_of_success=estimated_probability_of_success,
+                candidate_value=entry.get("candidate_value"),
+                total_previous_runs=total_previous_runs,
+                success_chance=entry.get("success_chance"),
+            )
+        except AssertionError as e:
+            raise AssertionError(f"During {campaign}/{codebase}: {e}") from e
+        assert offset > 0.0
+        assert entry["command"]
+        items.append(
+            {
+                "codebase": codebase,
+                "campaign": campaign,
+                "change_set": entry.get("change_set"),
+                "command": entry["command"],
+                "offset": default_offset + offset,
+                "bucket": entry.get("bucket") or "default",
+                "estimated_duration": estimated_duration,
+                "context": entry.get("context"),
+                "refresh": entry.get("refresh", False),
+                "requester": entry.get("requester") or "scheduler",
+            }
+        )
+    if dry_run:
+        ids = [(-1, item["bucket"]) for item in items]
+    else:
+        ids = await Queue(conn, position_index).add_many(items)
+    return [
+        (item["offset"], item["estimated_duration"], queue_id, queue_bucket)
+        for (item, (queue_id, queue_bucket)) in zip(items, ids)
+    ]
+
+
 async def bulk_add_to_queue(
     conn: asyncpg.Connection,
     todo,
     dry_run: bool = False,
     default_offset: float = 0.0,
     bucket: str = "default",
-) -> None:
+    position_index: Optional[QueuePositionIndex] = None,
+) -> list[tuple[float, timedelta, int, str]]:
+    """Schedule a batch of candidates.
+
+    This is equivalent to calling do_schedule_regular for each entry in
+    todo, but loads the run history for all candidates up front and adds
+    them to the queue in a single statement.
+
+    Args:
+      todo: list of (codebase, context, command, campaign, value,
+        success_chance) tuples
+    Returns:
+      list of (offset, estimated duration, queue id, bucket) tuples, in the
+      same order as todo
+    """
     codebase_values = {
         k: (v or 0)
         for (k, v) in await conn.fetch(
@@ -410,26 +809,141 @@ async def bulk_add_to_queue(
             logging.info("Maximum value: %d", max_codebase_value)
     else:
         max_codebase_value = None
+    normalized_codebase_values = {}
     for codebase, context, command, campaign, value, success_chance in todo:
-        if max_codebase_value is not None:
-            normalized_codebase_value = min(
+        if max_codebase_value:
+            normalized_codebase_values[codebase] = min(
                 codebase_values.get(codebase, 0.0) / max_codebase_value, 1.0
             )
         else:
-            normalized_codebase_value = 1.0
-        await do_schedule_regular(
+            normalized_codebase_values[codebase] = 1.0
+    return await do_schedule_regular_many(
+        conn,
+        [
+            {
+                "codebase": codebase,
+                "campaign": campaign,
+                "command": command,
+                "candidate_value": value,
+                "success_chance": success_chance,
+                "context": context,
+                "bucket": bucket,
+            }
+            for (codebase, context, command, campaign, value, success_chance) in todo
+        ],
+        dry_run=dry_run,
+        default_offset=default_offset,
+        position_index=position_index,
+        normalized_codebase_values=normalized_codebase_values,
+    )
+
+
+class DebianVersionIndex:
+    """In-memory index of the available versions of Debian source packages.
+
+    Versions are loaded from the database on demand, per source package, and
+    are reloaded once they are older than max_age.
+    """
+
+    def __init__(self, max_age: timedelta = DEFAULT_DEBIAN_VERSIONS_MAX_AGE) -> None:
+        self.max_age = max_age
+        self._versions: dict[str, list[Version]] = {}
+        self._loaded: dict[str, datetime] = {}
+
+    async def load(self, conn: asyncpg.Connection, sources) -> None:
+        """Make sure the versions for the specified sources are loaded."""
+        now = datetime.utcnow()
+        missing = sorted(
+            {
+                source
+                for source in sources
+                if source not in self._loaded
+                or now - self._loaded[source] > self.max_age
+            }
+        )
+        if not missing:
+            return
+        versions: dict[str, list[Version]] = {source: [] for source in missing}
+        for row in await conn.fetch(
+            "SELECT source, version FROM all_debian_versions "
+            "WHERE source = ANY($1::text[])",
+            missing,
+        ):
+            versions[row["source"]].append(Version(str(row["version"])))
+        for source, source_versions in versions.items():
+            source_versions.sort()
+            self._versions[source] = source_versions
+            self._loaded[source] = now
+
+    def add(self, source: str, version: Version) -> None:
+        """Record a newly available version, e.g. after a new debian_build."""
+        try:
+            versions = self._versions[source]
+        except KeyError:
+            # Not loaded yet; this version will be picked up when it is.
+            return
+        i = bisect_left(versions, version)
+        if i == len(versions) or versions[i] != version:
+            versions.insert(i, version)
+
+    def dep_available(
+        self,
+        name: str,
+        archqual: Optional[str] = None,
+        arch: Optional[str] = None,
+        distribution: Optional[str] = None,
+        version: Optional[tuple[str, Version]] = None,
+        restrictions=None,
+    ) -> bool:
+        versions = self._versions.get(name, [])
+        if not version:
+            return bool(versions)
+        operator, wanted = version[0], Version(str(version[1]))
+        if operator == ">=":
+            return bisect_left(versions, wanted) < len(versions)
+        elif operator in (">>", ">"):
+            return bisect_right(versions, wanted) < len(versions)
+        elif operator == "<=":
+            return bisect_right(versions, wanted) > 0
+        elif operator in ("<<", "<"):
+            return bisect_left(versions, wanted) > 0
+        elif operator == "=":
+            i = bisect_left(versions, wanted)
+            return i < len(versions) and versions[i] == wanted
+        else:
+            raise ValueError(f"unknown version operator {operator!r}")
+
+    def deps_satisfied(self, dependencies) -> bool:
+        for dep in dependencies:
+            for subdep in dep:
+                if self.dep_available(**subdep):
+                    break
+            else:
+                return False
+        return True
+
+    async def deps_satisfied_many(
+        self, conn: asyncpg.Connection, relations: list
+    ) -> list[bool]:
+        """Check whether each of a list of dependency relations is satisfied.
+
+        The versions for all source packages involved are loaded in one go.
+        """
+        await self.load(
             conn,
-            codebase=codebase,
-            context=context,
-            command=command,
-            campaign=campaign,
-            candidate_value=value,
-            success_chance=success_chance,
-            default_offset=default_offset,
-            normalized_codebase_value=normalized_codebase_value,
-            dry_run=dry_run,
-            bucket=bucket,
+            {
+                subdep["name"]
+                for dependencies in relations
+                for dep in dependencies
+                for subdep in dep
+            },
         )
+        return [self.deps_satisfied(dependencies) for dependencies in relations]
+
+
+# Used by callers that don't keep an index of their own, so that versions
+# loaded once are reused until they expire.
+_default_debian_versions = DebianVersionIndex()
 
 
 async def dep_available(
@@ -440,33 +954,30 @@ async def dep_available(
     distribution: Optional[str] = None,
     version: Optional[tuple[str, Version]] = None,
     restrictions=None,
+    debian_versions: Optional[DebianVersionIndex] = None,
 ) -> bool:
-    query = """\
-SELECT
-  1
-FROM
-  all_debian_versions
-WHERE
-  source = $1 AND %(version_match)s
-"""
-    args = [name]
-    if version:
-        version_match = f"version {version[0]} $2"
-        args.append(str(version[1]))
-    else:
-        version_match = "True"
-
-    return bool(await conn.fetchval(query % {"version_match": version_match}, *args))
+    if debian_versions is None:
+        debian_versions = _default_debian_versions
+    await debian_versions.load(conn, [name])
+    return debian_versions.dep_available(
+        name,
+        archqual=archqual,
+        arch=arch,
+        distribution=distribution,
+        version=version,
+        restrictions=restrictions,
+    )
 
 
-async def deps_satisfied(conn: asyncpg.Connection, campaign: str, dependencies) -> bool:
-    for dep in dependencies:
-        for subdep in dep:
-            if await dep_available(conn, **subdep):
-                break
-        else:
-            return False
-    return True
+async def deps_satisfied(
+    conn: asyncpg.Connection,
+    campaign: str,
+    dependencies,
+    debian_versions: Optional[DebianVersionIndex] = None,
+) -> bool:
+    if debian_versions is None:
+        debian_versions = _default_debian_versions
+    return (await debian_versions.deps_satisfied_many(conn, [dependencies]))[0]
 
 
 async def main_async():
@@ -555,6 +1066,7 @@ async def do_schedule_control(
     bucket: Optional[str] = None,
     requester: Optional[str] = None,
     estimated_duration: Optional[timedelta] = None,
+    position_index: Optional[QueuePositionIndex] = None,
 ) -> tuple[float, Optional[timedelta], int, str]:
     command = ["brz", "up"]
     if main_branch_revision is not None:
@@ -571,6 +1083,7 @@ async def do_schedule_control(
         requester=requester,
         command=shlex.join(command),
         codebase=codebase,
+        position_index=position_index,
     )
 
 
@@ -592,6 +1105,7 @@ async def do_schedule(
     requester: Optional[str] = None,
     estimated_duration=None,
     command: Optional[str] = None,
+    position_index: Optional[QueuePositionIndex] = None,
 ) -> tuple[float, Optional[timedelta], int, str]:
     if offset is None:
         offset = DEFAULT_SCHEDULE_OFFSET
@@ -609,7 +1123,7 @@ async def do_schedule(
         command = candidate["command"]
     if estimated_duration is None:
         estimated_duration = await estimate_duration(conn, codebase, campaign)
-    queue = Queue(conn)
+    queue = Queue(conn, position_index)
     queue_id, bucket = await queue.add(
         command=command,
         campaign=campaign,
@@ -624,6 +1138,87 @@ async def do_schedule(
     return offset, estimated_duration, queue_id, bucket
 
 
+async def do_schedule_many(
+    conn: asyncpg.Connection,
+    todo: list[dict],
+    *,
+    position_index: Optional[QueuePositionIndex] = None,
+) -> list[Optional[tuple[float, Optional[timedelta], int, str]]]:
+    """Schedule a batch of candidates.
+
+    Args:
+      todo: list of dictionaries with the same keys as the keyword
+        arguments to do_schedule
+
+    Returns:
+      list of (offset, estimated duration, queue id, bucket) tuples, in the
+      same order as todo; None for entries without a candidate
+    """
+    missing_commands = [
+        (entry["codebase"], entry["campaign"])
+        for entry in todo
+        if entry.get("command") is None
+    ]
+    commands = {}
+    if missing_commands:
+        commands = {
+            (row["codebase"], row["campaign"]): row["command"]
+            for row in await conn.fetch(
+                "SELECT candidate.codebase, candidate.suite AS campaign, "
+                "candidate.command FROM candidate, "
+                "unnest($1::text[], $2::text[]) AS t(codebase, campaign) "
+                "WHERE candidate.codebase = t.codebase "
+                "AND candidate.suite = t.campaign",
+                [codebase for (codebase, campaign) in missing_commands],
+                [campaign for (codebase, campaign) in missing_commands],
+            )
+        }
+    unknown_durations = [
+        (entry["codebase"], entry["campaign"])
+        for entry in todo
+        if entry.get("estimated_duration") is None
+    ]
+    durations = dict(
+        zip(
+            unknown_durations,
+            await bulk_estimate_duration(conn, unknown_durations),
+        )
+    )
+    items: list[Optional[dict[str, Any]]] = []
+    for entry in todo:
+        key = (entry["codebase"], entry["campaign"])
+        command = entry.get("command") or commands.get(key)
+        if command is None:
+            items.append(None)
+            continue
+        offset = entry.get("offset")
+        if offset is None:
+            offset = DEFAULT_SCHEDULE_OFFSET
+        items.append(
+            {
+                "codebase": entry["codebase"],
+                "campaign": entry["campaign"],
+                "command": command,
+                "change_set": entry.get("change_set"),
+                "offset": offset,
+                "bucket": entry.get("bucket") or "default",
+                "estimated_duration": entry.get("estimated_duration") or durations[key],
+                "refresh": entry.get("refresh", False),
+                "requester": entry.get("requester"),
+            }
+        )
+    queue = Queue(conn, position_index)
+    ids = iter(await queue.add_many([item for item in items if item is not None]))
+    ret: list[Optional[tuple[float, Optional[timedelta], int, str]]] = []
+    for item in items:
+        if item is None:
+            ret.append(None)
+        else:
+            queue_id, bucket = next(ids)
+            ret.append((item["offset"], item["estimated_duration"], queue_id, bucket))
+    return ret
+
+
 def main():
     import asyncio
 
@@ -0,0 +1,531 @@
+#!/usr/bin/python
+# Copyright (C) 2026 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Offline replay of the scheduler.
+
+This loads or synthesises candidates, codebases and run history into a
+scratch database, schedules them and then replays a number of worker slots
+pulling items from the queue, so that changes to the scheduler can be
+compared before they are deployed.
+"""
+
+__all__ = [
+    "SimulationReport",
+    "load_history",
+    "synthesise_history",
+    "simulate",
+]
+
+import heapq
+import logging
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import asyncpg
+
+from .queue import Queue
+from .schedule import (
+    CandidateUnavailable,
+    bulk_add_to_queue,
+    do_schedule_regular,
+    estimate_success_probability_and_duration,
+    iter_candidates_with_publish_policy,
+    queue_item_from_candidate_and_publish_policy,
+)
+
+# Location of the database schema, when running from a source checkout.
+SCHEMA_DIR = Path(__file__).resolve().parent.parent.parent / "schema"
+
+# Publish policies used for synthesised candidates; each publishes the main
+# branch in the mode it is named after.
+SYNTHETIC_PUBLISH_POLICIES = ["propose", "push", "build-only"]
+
+SYNTHETIC_FAILURE_CODES = [
+    "nothing-to-do",
+    "build-failed",
+    "install-deps-unsatisfied-dependencies",
+    "worker-failure",
+]
+
+
+@dataclass
+class SimulationReport:
+    """Results of a simulation run."""
+
+    # Number of workers slots that were simulated
+    workers: int
+    # Simulated time covered
+    duration: timedelta
+    # Number of items initially scheduled, and the wall time that took
+    scheduled: int = 0
+    schedule_seconds: float = 0.0
+    runs: int = 0
+    successes: int = 0
+    value: float = 0.0
+    # Time between an item being queued and a worker picking it up, in
+    # simulated seconds
+    latencies: list[float] = field(default_factory=list)
+
+    @property
+    def hours(self) -> float:
+        return self.duration.total_seconds() / 3600
+
+    @property
+    def runs_per_hour(self) -> float:
+        return self.runs / self.hours if self.hours else 0.0
+
+    @property
+    def value_per_hour(self) -> float:
+        return self.value / self.hours if self.hours else 0.0
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[
+            min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        ]
+
+    def json(self):
+        return {
+            "workers": self.workers,
+            "hours": self.hours,
+            "scheduled": self.scheduled,
+            "schedule_seconds": self.schedule_seconds,
+            "runs": self.runs,
+            "successes": self.successes,
+            "runs_per_hour": self.runs_per_hour,
+            "value_per_hour": self.value_per_hour,
+            "latency": {f"p{p}": self.latency_percentile(p) for p in (50, 90, 99)},
+        }
+
+
+async def synthesise_history(
+    conn: asyncpg.Connection,
+    *,
+    codebases: int = 100,
+    campaigns: tuple[str, ...] = ("lintian-fixes", "fresh-releases"),
+    runs_per_candidate: int = 3,
+    rng: Optional[random.Random] = None,
+) -> None:
+    """Fill a database with synthetic codebases, candidates and runs."""
+    if rng is None:
+        rng = random.Random()
+    for name in SYNTHETIC_PUBLISH_POLICIES:
+        await conn.execute(
+            "INSERT INTO named_publish_policy (name, per_branch_policy) "
+            "VALUES ($1, ARRAY[ROW('main', $1::publish_mode, NULL)"
+            "::branch_publish_policy]) ON CONFLICT DO NOTHING",
+            name,
+        )
+    hosts = [f"host{i}.example.com" for i in range(max(1, codebases // 20))]
+    codebase_rows = []
+    for i in range(codebases):
+        url = f"https://{rng.choice(hosts)}/codebase-{i}"
+        codebase_rows.append((f"codebase-{i}", url, url, "", rng.randint(1, 1000)))
+    await conn.copy_records_to_table(
+        "codebase",
+        records=codebase_rows,
+        columns=["name", "branch_url", "url", "subpath", "value"],
+    )
+
+    candidate_rows = []
+    change_set_rows = []
+    run_rows: list[tuple] = []
+    now = datetime.utcnow()
+    for codebase, *_ in codebase_rows:
+        for campaign in campaigns:
+            if rng.random() < 0.2:
+                continue
+            candidate_rows.append(
+                (
+                    campaign,
+                    "true",
+                    rng.randint(1, 100),
+                    rng.random(),
+                    rng.choice(SYNTHETIC_PUBLISH_POLICIES),
+                    codebase,
+                )
+            )
+            success_rate = rng.random()
+            mean_duration = rng.lognormvariate(6, 1)
+            start_time = now - timedelta(days=rng.randint(30, 365))
+            for _ in range(rng.randint(0, 2 * runs_per_candidate)):
+                run_id = str(uuid.uuid4())
+                duration = timedelta(seconds=rng.expovariate(1 / mean_duration) + 1)
+                if rng.random() < success_rate:
+                    result_code = "success"
+                else:
+                    result_code = rng.choice(SYNTHETIC_FAILURE_CODES)
+                change_set_rows.append((run_id, campaign))
+                run_rows.append(
+                    (
+                        run_id,
+                        "true",
+                        start_time,
+                        start_time + duration,
+                        result_code,
+                        campaign,
+                        [],
+                        run_id,
+                        codebase,
+                    )
+                )
+                start_time += timedelta(days=rng.randint(1, 30))
+    await conn.copy_records_to_table(
+        "candidate",
+        records=candidate_rows,
+        columns=[
+            "suite",
+            "command",
+            "value",
+            "success_chance",
+            "publish_policy",
+            "codebase",
+        ],
+    )
+    await conn.copy_records_to_table(
+        "change_set", records=change_set_rows, columns=["id", "campaign"]
+    )
+    await conn.copy_records_to_table(
+        "run",
+        records=run_rows,
+        columns=[
+            "id",
+            "command",
+            "start_time",
+            "finish_time",
+            "result_code",
+            "suite",
+            "logfilenames",
+            "change_set",
+            "codebase",
+        ],
+    )
+
+
+# Tables copied by load_history, in dependency order, with their columns.
+HISTORY_TABLES = [
+    ("branch_publish_policy", ["role", "mode", "frequency_days"]),
+    ("named_publish_policy", ["name", "per_branch_policy", "rate_limit_bucket"]),
+    (
+        "codebase",
+        ["name", "branch_url", "url", "branch", "subpath", "vcs_type", "value"],
+    ),
+    ("change_set", ["id", "campaign", "state"]),
+    (
+        "candidate",
+        [
+            "suite",
+            "context",
+            "value",
+            "success_chance",
+            "command",
+            "publish_policy",
+            "change_set",
+            "codebase",
+        ],
+    ),
+    (
+        "run",
+        [
+            "id",
+            "command",
+            "start_time",
+            "finish_time",
+            "result_code",
+            "instigated_context",
+            "context",
+            "suite",
+            "logfilenames",
+            "failure_details",
+            "failure_transient",
+            "resume_from",
+            "change_set",
+            "codebase",
+        ],
+    ),
+]
+
+
+async def load_history(
+    source: asyncpg.Connection,
+    target: asyncpg.Connection,
+    campaigns: Optional[list[str]] = None,
+) -> None:
+    """Copy candidates, codebases and run history from another database."""
+    for table, columns in HISTORY_TABLES:
+        query = f"SELECT {', '.join(columns)} FROM {table}"
+        args = []
+        if campaigns and table in ("run", "candidate"):
+            query += " WHERE suite = ANY($1::text[])"
+            args.append(campaigns)
+        elif campaigns and table == "change_set":
+            query += " WHERE campaign = ANY($1::text[])"
+            args.append(campaigns)
+        if table == "run":
+            # Runs refer to the runs they resumed from.
+            query += " ORDER BY start_time"
+        logging.info("Copying %s", table)
+        await target.copy_records_to_table(
+            table,
+            records=[tuple(row) for row in await source.fetch(query, *args)],
+            columns=columns,
+        )
+
+
+async def _pick_run(
+    conn: asyncpg.Connection, codebase: str, campaign: str, rng: random.Random
+) -> Optional[tuple[timedelta, str]]:
+    """Pick a historical run to replay for a codebase/campaign."""
+    rows = await conn.fetch(
+        "SELECT finish_time - start_time AS duration, result_code FROM run "
+        "WHERE codebase = $1 AND suite = $2 AND failure_transient IS NOT True "
+        "AND finish_time IS NOT NULL AND start_time IS NOT NULL",
+        codebase,
+        campaign,
+    )
+    if not rows:
+        return None
+    row = rng.choice(rows)
+    return row["duration"], row["result_code"]
+
+
+async def simulate(
+    conn: asyncpg.Connection,
+    *,
+    workers: int = 10,
+    duration: timedelta = timedelta(hours=24),
+    rng: Optional[random.Random] = None,
+) -> SimulationReport:
+    """Schedule all candidates and replay workers processing the queue.
+
+    Each of the worker slots takes the next item from the queue, and
+    finishes it after a duration drawn from the run history of the same
+    codebase and campaign. Finished runs are recorded and rescheduled the
+    same way the runner does, so the run history evolves during the
+    simulation.
+    """
+    if rng is None:
+        rng = random.Random()
+    report = SimulationReport(workers=workers, duration=duration)
+    todo = [
+        queue_item_from_candidate_and_publish_policy(row)
+        for row in await iter_candidates_with_publish_policy(conn)
+    ]
+    values = {
+        (codebase, campaign): value
+        for (codebase, context, command, campaign, value, success_chance) in todo
+    }
+    start = time.monotonic()
+    scheduled = await bulk_add_to_queue(conn, todo)
+    report.schedule_seconds = time.monotonic() - start
+    report.scheduled = len(scheduled)
+    logging.info(
+        "Scheduled %d items in %.2fs", report.scheduled, report.schedule_seconds
+    )
+
+    queue = Queue(conn)
+    # Simulated time at which each queue item was added
+    queued_at: dict[int, float] = {
+        queue_id: 0.0 for (_offset, _duration, queue_id, _bucket) in scheduled
+    }
+    assigned: set[int] = set()
+    # Heap of (finish time, slot, start time, queue item, result code)
+    running: list = []
+    epoch = datetime.utcnow()
+    now = 0.0
+    end = duration.total_seconds()
+    idle = list(range(workers))
+
+    while True:
+        while idle:
+            item, _vcs_info = await queue.next_item(assigned_queue_items=assigned)
+            if item is None:
+                break
+            slot = idle.pop()
+            assigned.add(item.id)
+            report.latencies.append(now - queued_at.pop(item.id, 0.0))
+            picked = await _pick_run(conn, item.codebase, item.campaign, rng)
+            if picked is None:
+                (
+                    probability,
+                    run_duration,
+                    _total,
+                ) = await estimate_success_probability_and_duration(
+                    conn, item.codebase, item.campaign, item.context
+                )
+                result_code = (
+                    "success" if rng.random() < probability else "build-failed"
+                )
+            else:
+                run_duration, result_code = picked
+            heapq.heappush(
+                running,
+                (now + run_duration.total_seconds(), slot, now, item, result_code),
+            )
+        if not running:
+            break
+        finish, slot, started, item, result_code = heapq.heappop(running)
+        if finish > end:
+            break
+        now = finish
+        idle.append(slot)
+        assigned.discard(item.id)
+        report.runs += 1
+        if result_code == "success":
+            report.successes += 1
+            report.value += values.get((item.codebase, item.campaign)) or 0
+        await _record_run(conn, item, result_code, epoch, started, finish)
+        await queue.delete(item.id)
+        try:
+            (_offset, _duration, queue_id, _bucket) = await do_schedule_regular(
+                conn,
+                campaign=item.campaign,
+                change_set=item.change_set,
+                context=item.context,
+                requester="after run schedule",
+                codebase=item.codebase,
+            )
+        except CandidateUnavailable:
+            pass
+        else:
+            queued_at[queue_id] = now
+    return report
+
+
+async def _record_run(
+    conn: asyncpg.Connection,
+    item,
+    result_code: str,
+    epoch: datetime,
+    started: float,
+    finished: float,
+) -> None:
+    run_id = str(uuid.uuid4())
+    change_set = item.change_set
+    if change_set is None:
+        change_set = run_id
+        await conn.execute(
+            "INSERT INTO change_set (id, campaign) VALUES ($1, $2)",
+            change_set,
+            item.campaign,
+        )
+    await conn.execute(
+        "INSERT INTO run (id, command, start_time, finish_time, result_code, "
+        "suite, logfilenames, change_set, codebase, context) "
+        "VALUES ($1, $2, $3, $4, $5, $6, '{}', $7, $8, $9)",
+        run_id,
+        item.command,
+        epoch + timedelta(seconds=started),
+        epoch + timedelta(seconds=finished),
+        result_code,
+        item.campaign,
+        change_set,
+        item.codebase,
+        item.context,
+    )
+
+
+async def main_async(argv=None):
+    import argparse
+    import json
+
+    from . import state
+
+    parser = argparse.ArgumentParser(prog="janitor.simulate")
+    parser.add_argument(
+        "--database",
+        type=str,
+        help="Scratch database to use; a temporary one is created if unset",
+    )
+    parser.add_argument("--load-from", type=str, help="Database to copy history from")
+    parser.add_argument(
+        "--campaign",
+        type=str,
+        action="append",
+        help="Only load history for these campaigns",
+    )
+    parser.add_argument(
+        "--synthesise",
+        type=int,
+        metavar="CODEBASES",
+        default=100,
+        help="Number of codebases to synthesise, if not loading history",
+    )
+    parser.add_argument("--workers", type=int, default=10, help="Worker slots")
+    parser.add_argument(
+        "--hours", type=float, default=24.0, help="Simulated hours to replay"
+    )
+    parser.add_argument("--seed", type=int, help="Random seed")
+    parser.add_argument("--debug", action="store_true", help="Show debug output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=(logging.DEBUG if args.debug else logging.INFO), format="%(message)s"
+    )
+
+    rng = random.Random(args.seed)
+
+    async def run(url):
+        async with state.create_pool(url) as pool:
+            async with pool.acquire() as conn:
+                if args.load_from:
+                    source = await asyncpg.connect(args.load_from)
+                    try:
+                        await load_history(source, conn, args.campaign)
+                    finally:
+                        await source.close()
+                else:
+                    await synthesise_history(conn, codebases=args.synthesise, rng=rng)
+                return await simulate(
+                    conn,
+                    workers=args.workers,
+                    duration=timedelta(hours=args.hours),
+                    rng=rng,
+                )
+
+    if args.database:
+        report = await run(args.database)
+    else:
+        import testing.postgresql
+
+        with testing.postgresql.Postgresql() as postgresql:
+            conn = await asyncpg.connect(postgresql.url())
+            try:
+                await conn.execute((SCHEMA_DIR / "state.sql").read_text())
+                await conn.execute((SCHEMA_DIR / "debian" / "debian.sql").read_text())
+            finally:
+                await conn.close()
+            report = await run(postgresql.url())
+
+    print(json.dumps(report.json(), indent=2))
+
+
+def main():
+    import asyncio
+
+    asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,7 @@ from aiohttp import (
     ClientOSError,
     ClientResponseError,
     ClientSession,
+    ClientTimeout,
     ContentTypeError,
     ServerDisconnectedError,
     web,
@@ -560,11 +561,26 @@ async def handle_runner_log(request):
     span = aiozipkin.request_span(request)
     with span.new_child("runner:log"):
         url = URL(request.app["runner_url"]) / "log" / run_id / filename
+        params = {}
+        if "offset" in request.query:
+            params["offset"] = request.query["offset"]
+        headers = {}
+        if "Range" in request.headers:
+            headers["Range"] = request.headers["Range"]
         try:
-            async with request.app["http_client_session"].get(url) as resp:
+            async with request.app["http_client_session"].get(
+                url, params=params, headers=headers
+            ) as resp:
                 body = await resp.read()
                 return web.Response(
-                    body=body, status=resp.status, content_type="text/plain"
+                    body=body,
+                    status=resp.status,
+                    content_type="text/plain",
+                    headers={
+                        name: resp.headers[name]
+                        for name in ("X-Next-Offset", "Content-Range")
+                        if name in resp.headers
+                    },
                 )
         except ContentTypeError as e:
             return web.Response(text=f"runner returned error {e}", status=400)
@@ -574,6 +590,44 @@ async def handle_runner_log(request):
             return web.Response(text="timeout contacting runner", status=502)
 
 
+@docs()
+@routes.get("/active-runs/{run_id}/log/{filename}/follow", name="run-log-follow")
+async def handle_runner_log_follow(request):
+    run_id = request.match_info["run_id"]
+    filename = request.match_info["filename"]
+    url = URL(request.app["runner_url"]) / "log" / run_id / filename / "follow"
+    params = {}
+    if "offset" in request.query:
+        params["offset"] = request.query["offset"]
+    headers = {}
+    if "Last-Event-ID" in request.headers:
+        headers["Last-Event-ID"] = request.headers["Last-Event-ID"]
+    try:
+        async with request.app["http_client_session"].get(
+            url, params=params, headers=headers, timeout=ClientTimeout(total=None)
+        ) as resp:
+            if resp.status != 200:
+                return web.Response(
+                    body=await resp.read(),
+                    status=resp.status,
+                    content_type="text/plain",
+                )
+            response = web.StreamResponse(
+                status=200,
+                headers={
+                    "Content-Type": "text/event-stream",
+                    "Cache-Control": "no-cache",
+                },
+            )
+            await response.prepare(request)
+            async for chunk in resp.content.iter_any():
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+    except ClientConnectorError:
+        return web.Response(text="unable to contact runner", status=502)
+
+
 @docs()
 @routes.get("/publish/{publish_id}", name="publish-details")
 async def handle_publish_id(request):
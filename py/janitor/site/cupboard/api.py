@@ -34,6 +34,9 @@ from ..setup import setup_logfile_manager, setup_postgres
 BUILD_LOG_FILENAME = "build.log"
 DIST_LOG_FILENAME = "dist.log"
 
+# Number of runs to send to the runner in a single schedule request
+MASS_RESCHEDULE_BATCH_SIZE = 1000
+
 
 routes = web.RouteTableDef()
 
@@ -118,42 +121,45 @@ AND """
 
     async def do_reschedule():
         schedule_url = URL(request.app["runner_url"]) / "schedule"
-        for run in runs:
-            logging.info("Rescheduling %s, %s", run["codebase"], run["campaign"])
+        for i in range(0, len(runs), MASS_RESCHEDULE_BATCH_SIZE):
+            batch = runs[i : i + MASS_RESCHEDULE_BATCH_SIZE]
+            logging.info("Rescheduling %d runs", len(batch))
             try:
                 async with session.post(
                     schedule_url,
-                    json={
-                        "codebase": run["codebase"],
-                        "campaign": run["campaign"],
-                        "requester": "reschedule",
-                        "refresh": refresh,
-                        "offset": offset,
-                        "bucket": "reschedule",
-                        "estimated_duration": (
-                            run["duration"].total_seconds()
-                            if run.get("duration")
-                            else None
-                        ),
-                    },
+                    json=[
+                        {
+                            "codebase": run["codebase"],
+                            "campaign": run["campaign"],
+                            "requester": "reschedule",
+                            "refresh": refresh,
+                            "offset": offset,
+                            "bucket": "reschedule",
+                            "estimated_duration": (
+                                run["duration"].total_seconds()
+                                if run.get("duration")
+                                else None
+                            ),
+                        }
+                        for run in batch
+                    ],
                     raise_for_status=True,
-                ):
-                    pass
+                ) as resp:
+                    for result in await resp.json():
+                        if "error" in result:
+                            logging.debug(
+                                "Not rescheduling %s/%s: %s",
+                                result["codebase"],
+                                result["campaign"],
+                                result["error"],
+                            )
             except ClientResponseError as e:
-                if e.status == 400:
-                    logging.debug(
-                        "Not rescheduling %s/%s: candidate unavailable",
-                        run["codebase"],
-                        run["campaign"],
-                    )
-                else:
-                    logging.exception(
-                        "Unable to reschedule %s/%s: %d: %s",
-                        run["codebase"],
-                        run["campaign"],
-                        e.status,
-                        e.message,
-                    )
+                logging.exception(
+                    "Unable to reschedule batch of %d runs: %d: %s",
+                    len(batch),
+                    e.status,
+                    e.message,
+                )
 
     await spawn(request, do_reschedule())
     return web.json_response(
@@ -29,7 +29,7 @@ from yarl import URL
 
 from janitor import state
 from janitor._site import find_build_log_failure, find_dist_log_failure
-from janitor.logs import LogRetrievalError
+from janitor.logs import LogRetrievalError, read_log_lines
 from janitor.queue import Queue
 from janitor.site import BuildDiffUnavailable, DebdiffRetrievalError, get_archive_diff
 
@@ -271,6 +271,45 @@ WHERE followup.origin = $1""",
 
     kwargs["get_log"] = get_log
 
+    async def find_log_failure(name, finder):
+        """Find the failure in a log and the lines to display around it.
+
+        The failure location recorded in the log index at import time is
+        used where possible, in which case only the relevant part of the
+        log is retrieved.
+        """
+        try:
+            index = await logfile_manager.get_log_index(
+                run["codebase"], run["id"], name
+            )
+        except (LogRetrievalError, PermissionError):
+            index = None
+        failure = index.get("failure") if index else None
+        if failure is not None and failure["length"] == FAIL_BUILD_LOG_LEN:
+            line_count = failure["line_count"]
+            include_lines = failure["include_lines"]
+            first_line, last_line = include_lines or (max(1, line_count), None)
+            lines = await read_log_lines(
+                logfile_manager,
+                run["codebase"],
+                run["id"],
+                name,
+                first_line,
+                last_line or index["line_count"],
+                index=index,
+            )
+            if lines is not None:
+                return (
+                    line_count,
+                    include_lines,
+                    failure["highlight_lines"],
+                    BytesIO(b"".join(lines)),
+                    first_line,
+                )
+        logf = await get_log(name)
+        line_count, include_lines, highlight_lines = finder(logf, FAIL_BUILD_LOG_LEN)
+        return line_count, include_lines, highlight_lines, None, 1
+
     if run.get("failure_stage"):
         if run["failure_stage"] == "codemod/dist":
             primary_log = "dist"
@@ -296,13 +335,13 @@ WHERE followup.origin = $1""",
             primary_log = None
 
     if primary_log == "dist":
-        logf = await get_log(DIST_LOG_FILENAME)
-        line_count, include_lines, highlight_lines = find_dist_log_failure(
-            logf, FAIL_BUILD_LOG_LEN
-        )
-        kwargs["dist_log_line_count"] = line_count
-        kwargs["dist_log_include_lines"] = include_lines
-        kwargs["dist_log_highlight_lines"] = highlight_lines
+        (
+            kwargs["dist_log_line_count"],
+            kwargs["dist_log_include_lines"],
+            kwargs["dist_log_highlight_lines"],
+            kwargs["dist_log_excerpt"],
+            kwargs["dist_log_first_line"],
+        ) = await find_log_failure(DIST_LOG_FILENAME, find_dist_log_failure)
     elif primary_log == "build":
         kwargs["earlier_build_log_names"] = []
         i = 1
@@ -311,13 +350,13 @@ WHERE followup.origin = $1""",
             kwargs["earlier_build_log_names"].append((i, log_name))
             i += 1
 
-        logf = await get_log(BUILD_LOG_FILENAME)
-        line_count, include_lines, highlight_lines = find_build_log_failure(
-            logf, FAIL_BUILD_LOG_LEN
-        )
-        kwargs["build_log_line_count"] = line_count
-        kwargs["build_log_include_lines"] = include_lines
-        kwargs["build_log_highlight_lines"] = highlight_lines
+        (
+            kwargs["build_log_line_count"],
+            kwargs["build_log_include_lines"],
+            kwargs["build_log_highlight_lines"],
+            kwargs["build_log_excerpt"],
+            kwargs["build_log_first_line"],
+        ) = await find_log_failure(BUILD_LOG_FILENAME, find_build_log_failure)
 
     kwargs["primary_log"] = primary_log
 
@@ -61,11 +61,11 @@ def setup_postgres(app):
 
 
 def setup_logfile_manager(app, trace_configs=None):
-    from ..logs import get_log_manager
+    from ..logs import CachingLogFileManager, get_log_manager
 
     async def startup_logfile_manager(app):
-        app["logfile_manager"] = get_log_manager(
-            app["config"].logs_location, trace_configs=trace_configs
+        app["logfile_manager"] = CachingLogFileManager(
+            get_log_manager(app["config"].logs_location, trace_configs=trace_configs)
         )
         await app["logfile_manager"].__aenter__()
 
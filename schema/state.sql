@@ -21,6 +21,8 @@ CREATE TABLE IF NOT EXISTS codebase (
    vcs_type vcs_type,
    value int,
    inactive boolean not null default false,
+   -- last time this row was added or modified
+   updated_at timestamp not null default clock_timestamp(),
    hostname text generated always as (substring(branch_url, '.*://(?:[^/@]*@)?([^/]*)'::text)) stored,
    unique(branch_url, subpath),
    unique(name),
@@ -29,6 +31,25 @@ CREATE TABLE IF NOT EXISTS codebase (
 );
 CREATE INDEX ON codebase (branch_url);
 CREATE INDEX ON codebase (name);
+CREATE INDEX ON codebase (hostname);
+CREATE INDEX ON codebase (updated_at);
+
+CREATE OR REPLACE FUNCTION trigger_set_updated_at()
+  RETURNS TRIGGER
+  LANGUAGE PLPGSQL
+  AS $$
+    BEGIN
+    -- Use the time of the change rather than the start of the transaction,
+    -- so that exports can tell which changes they may not have seen yet.
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+    END;
+$$;
+
+CREATE OR REPLACE TRIGGER codebase_set_updated_at
+  BEFORE UPDATE ON codebase
+  FOR EACH ROW
+  EXECUTE FUNCTION trigger_set_updated_at();
 
 CREATE TYPE merge_proposal_status AS ENUM ('open', 'closed', 'merged', 'applied', 'abandoned', 'rejected');
 CREATE TABLE IF NOT EXISTS merge_proposal (
@@ -165,6 +186,8 @@ CREATE TABLE IF NOT EXISTS queue (
    refresh boolean default false,
    requester text,
    change_set text references change_set(id) on delete cascade,
+   -- Set while a runner has claimed this item but not yet assigned it.
+   claimed_until timestamp,
    check (command != '')
 );
 CREATE UNIQUE INDEX queue_codebase_suite_set ON queue(codebase, suite, coalesce(change_set, ''));
@@ -193,6 +216,8 @@ CREATE TABLE IF NOT EXISTS candidate (
    change_set text references change_set(id) on delete cascade,
    codebase text not null,
    id serial primary key not null,
+   -- last time this row was added or modified
+   updated_at timestamp not null default clock_timestamp(),
    check (command != ''),
    check (value > 0),
    constraint candidate_codebase_fkey foreign key(codebase) references codebase(name) on delete cascade
@@ -200,6 +225,12 @@ CREATE TABLE IF NOT EXISTS candidate (
 CREATE UNIQUE INDEX candidate_codebase_suite_set ON candidate (codebase, suite, coalesce(change_set, ''));
 CREATE INDEX ON candidate (suite);
 CREATE INDEX ON candidate(change_set);
+CREATE INDEX ON candidate (updated_at);
+
+CREATE OR REPLACE TRIGGER candidate_set_updated_at
+  BEFORE UPDATE ON candidate
+  FOR EACH ROW
+  EXECUTE FUNCTION trigger_set_updated_at();
 
 CREATE TABLE last_run (
    codebase text not null references codebase(name),
@@ -389,6 +420,7 @@ CREATE OR REPLACE FUNCTION refresh_last_run(_codebase text, _campaign text)
         last_run_id := last_run.id;
     ELSE
         DELETE FROM last_run WHERE codebase = _codebase AND campaign = _campaign;
+        PERFORM refresh_publish_ready(_codebase, _campaign);
         RETURN;
     END IF;
 
@@ -425,6 +457,7 @@ CREATE OR REPLACE FUNCTION refresh_last_run(_codebase text, _campaign text)
     INSERT INTO last_run (codebase, campaign, last_run_id, last_effective_run_id, last_unabsorbed_run_id) VALUES (
           _codebase, _campaign, last_run.id, last_effective_run_id, last_unabsorbed_run_id)
          ON CONFLICT (codebase, campaign) DO UPDATE SET last_run_id = EXCLUDED.last_run_id, last_effective_run_id = EXCLUDED.last_effective_run_id, last_unabsorbed_run_id = EXCLUDED.last_unabsorbed_run_id;
+    PERFORM refresh_publish_ready(_codebase, _campaign);
     END;
 $$;
 
@@ -479,6 +512,155 @@ CREATE OR REPLACE TRIGGER run_refresh_change_set_state
   FOR EACH ROW
   EXECUTE FUNCTION run_trigger_refresh_change_set_state();
 
+-- Aggregated statistics for non-transient runs, per codebase/campaign and
+-- per campaign. These are maintained by the run_refresh_run_statistics
+-- trigger, so that the scheduler doesn't have to scan the run table.
+-- duration_count is the number of runs with a known duration.
+CREATE TABLE IF NOT EXISTS run_statistics (
+   codebase text not null,
+   campaign campaign_name not null,
+   run_count integer not null default 0,
+   success_count integer not null default 0,
+   duration_sum interval not null default '0',
+   duration_count integer not null default 0,
+   -- Exponentially weighted mean of the durations of runs other than worker
+   -- failures, favouring recent runs. Each new run gets a weight of 0.25.
+   recent_duration interval,
+   unique (codebase, campaign)
+);
+
+-- The per campaign statistics are spread over several rows (by a hash of the
+-- codebase name), so that runs finishing concurrently for different
+-- codebases don't all have to wait for a lock on the same row. Readers add
+-- up the shards.
+CREATE TABLE IF NOT EXISTS campaign_run_statistics (
+   campaign campaign_name not null,
+   shard smallint not null,
+   run_count integer not null default 0,
+   success_count integer not null default 0,
+   duration_sum interval not null default '0',
+   duration_count integer not null default 0,
+   -- Exponentially weighted mean of the durations of runs other than worker
+   -- failures in this shard, favouring recent runs.
+   recent_duration interval,
+   primary key (campaign, shard)
+);
+
+CREATE OR REPLACE FUNCTION run_trigger_refresh_run_statistics()
+  RETURNS TRIGGER
+  LANGUAGE PLPGSQL
+  AS $$
+    DECLARE _weight double precision;
+    DECLARE _recent interval;
+    BEGIN
+    IF TG_OP != 'INSERT' AND OLD.failure_transient IS NOT TRUE THEN
+      UPDATE run_statistics SET
+        run_count = run_count - 1,
+        success_count = success_count - (OLD.result_code = 'success')::integer,
+        duration_sum = duration_sum - coalesce(OLD.finish_time - OLD.start_time, interval '0'),
+        duration_count = duration_count - (OLD.finish_time - OLD.start_time IS NOT NULL)::integer
+        WHERE codebase = OLD.codebase AND campaign = OLD.suite;
+      UPDATE campaign_run_statistics SET
+        run_count = run_count - 1,
+        success_count = success_count - (OLD.result_code = 'success')::integer,
+        duration_sum = duration_sum - coalesce(OLD.finish_time - OLD.start_time, interval '0'),
+        duration_count = duration_count - (OLD.finish_time - OLD.start_time IS NOT NULL)::integer
+        WHERE campaign = OLD.suite AND shard = hashtext(OLD.codebase) & 15;
+    END IF;
+    IF TG_OP != 'DELETE' AND NEW.failure_transient IS NOT TRUE THEN
+      -- Only new runs move the weighted mean; it can't be unwound. It is
+      -- only set from an updated run if there was no mean yet.
+      IF TG_OP = 'INSERT' THEN
+        _weight := 0.25;
+      ELSE
+        _weight := 0.0;
+      END IF;
+      IF NEW.result_code != 'worker-failure' THEN
+        _recent := NEW.finish_time - NEW.start_time;
+      END IF;
+      INSERT INTO run_statistics (codebase, campaign, run_count, success_count, duration_sum, duration_count, recent_duration) VALUES (
+        NEW.codebase, NEW.suite, 1, (NEW.result_code = 'success')::integer,
+        coalesce(NEW.finish_time - NEW.start_time, interval '0'),
+        (NEW.finish_time - NEW.start_time IS NOT NULL)::integer, _recent)
+        ON CONFLICT (codebase, campaign) DO UPDATE SET
+        run_count = run_statistics.run_count + 1,
+        success_count = run_statistics.success_count + EXCLUDED.success_count,
+        duration_sum = run_statistics.duration_sum + EXCLUDED.duration_sum,
+        duration_count = run_statistics.duration_count + EXCLUDED.duration_count,
+        recent_duration = coalesce(run_statistics.recent_duration * (1 - _weight) + EXCLUDED.recent_duration * _weight, run_statistics.recent_duration, EXCLUDED.recent_duration);
+      INSERT INTO campaign_run_statistics (campaign, shard, run_count, success_count, duration_sum, duration_count, recent_duration) VALUES (
+        NEW.suite, hashtext(NEW.codebase) & 15, 1, (NEW.result_code = 'success')::integer,
+        coalesce(NEW.finish_time - NEW.start_time, interval '0'),
+        (NEW.finish_time - NEW.start_time IS NOT NULL)::integer, _recent)
+        ON CONFLICT (campaign, shard) DO UPDATE SET
+        run_count = campaign_run_statistics.run_count + 1,
+        success_count = campaign_run_statistics.success_count + EXCLUDED.success_count,
+        duration_sum = campaign_run_statistics.duration_sum + EXCLUDED.duration_sum,
+        duration_count = campaign_run_statistics.duration_count + EXCLUDED.duration_count,
+        recent_duration = coalesce(campaign_run_statistics.recent_duration * (1 - _weight) + EXCLUDED.recent_duration * _weight, campaign_run_statistics.recent_duration, EXCLUDED.recent_duration);
+    END IF;
+
+    RETURN NEW;
+    END;
+$$;
+
+CREATE OR REPLACE TRIGGER run_refresh_run_statistics
+  AFTER INSERT OR DELETE OR UPDATE OF codebase, suite, result_code, start_time, finish_time, failure_transient
+  ON run
+  FOR EACH ROW
+  EXECUTE FUNCTION run_trigger_refresh_run_statistics();
+
+-- Weight of the index'th of count durations (in order of insertion) in an
+-- exponentially weighted mean that gives each new duration a weight of 0.25.
+CREATE OR REPLACE FUNCTION recent_weight(index bigint, count bigint)
+  RETURNS double precision
+  LANGUAGE SQL
+  IMMUTABLE
+  AS $$
+    SELECT CASE WHEN index = 1 THEN 0.75 ^ (count - 1) ELSE 0.25 * 0.75 ^ (count - index) END;
+$$;
+
+-- Recalculate the run statistics from scratch, e.g. after they were created
+-- for an existing database. The weighted means are rebuilt as if the runs
+-- had been inserted in order of finish time.
+CREATE OR REPLACE FUNCTION refresh_run_statistics()
+  RETURNS void
+  LANGUAGE PLPGSQL
+  AS $$
+    BEGIN
+    DELETE FROM run_statistics;
+    DELETE FROM campaign_run_statistics;
+    INSERT INTO run_statistics (codebase, campaign, run_count, success_count, duration_sum, duration_count, recent_duration)
+      SELECT codebase, suite, count(*), count(*) FILTER (WHERE result_code = 'success'),
+        coalesce(sum(duration), interval '0'), count(duration),
+        sum(duration * recent_weight(recent_index, recent_count)) FILTER (WHERE result_code != 'worker-failure')
+      FROM (
+        SELECT codebase, suite, result_code, finish_time - start_time AS duration,
+          row_number() OVER w AS recent_index, count(*) OVER w AS recent_count
+        FROM run WHERE failure_transient IS NOT TRUE
+        WINDOW w AS (
+          PARTITION BY codebase, suite, result_code != 'worker-failure' AND finish_time - start_time IS NOT NULL
+          ORDER BY finish_time, id
+          ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+      ) AS runs
+      GROUP BY codebase, suite;
+    INSERT INTO campaign_run_statistics (campaign, shard, run_count, success_count, duration_sum, duration_count, recent_duration)
+      SELECT suite, shard, count(*), count(*) FILTER (WHERE result_code = 'success'),
+        coalesce(sum(duration), interval '0'), count(duration),
+        sum(duration * recent_weight(recent_index, recent_count)) FILTER (WHERE result_code != 'worker-failure')
+      FROM (
+        SELECT suite, hashtext(codebase) & 15 AS shard, result_code, finish_time - start_time AS duration,
+          row_number() OVER w AS recent_index, count(*) OVER w AS recent_count
+        FROM run WHERE failure_transient IS NOT TRUE
+        WINDOW w AS (
+          PARTITION BY suite, hashtext(codebase) & 15, result_code != 'worker-failure' AND finish_time - start_time IS NOT NULL
+          ORDER BY finish_time, id
+          ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+      ) AS runs
+      GROUP BY suite, shard;
+    END;
+$$;
+
 create or replace view campaigns as select distinct suite as name from run;
 
 CREATE OR REPLACE VIEW perpetual_candidates AS
@@ -612,6 +794,179 @@ WHERE
   result_code = 'success')
 SELECT * FROM publishable WHERE ARRAY_LENGTH(unpublished_branches, 1) > 0;
 
+-- Runs that the publisher should consider, in the order in which it
+-- considers them. This is maintained by triggers on the tables that
+-- publish_ready is built from, so that the publisher doesn't have to
+-- evaluate publish_ready for all runs.
+CREATE TABLE IF NOT EXISTS publish_ready_run (
+   run_id text not null primary key references run (id) on delete cascade,
+   codebase text not null,
+   campaign campaign_name not null,
+   publishing boolean not null,
+   value integer not null,
+   finish_time timestamp not null
+);
+CREATE INDEX ON publish_ready_run (codebase, campaign);
+CREATE INDEX ON publish_ready_run (publishing, value, finish_time, run_id);
+
+CREATE OR REPLACE FUNCTION refresh_publish_ready(_codebase text, _campaign text)
+  RETURNS void
+  LANGUAGE PLPGSQL
+  AS $$
+    BEGIN
+    DELETE FROM publish_ready_run WHERE codebase = _codebase AND campaign = _campaign;
+    INSERT INTO publish_ready_run (run_id, codebase, campaign, publishing, value, finish_time)
+      SELECT id, codebase, suite, change_set_state = 'publishing', coalesce(value, 0),
+        coalesce(finish_time, start_time, 'epoch')
+      FROM publish_ready
+      WHERE codebase = _codebase AND suite = _campaign
+      AND publish_status = 'approved'
+      AND change_set_state IN ('ready', 'publishing')
+      AND EXISTS (SELECT FROM unnest(unpublished_branches) WHERE mode IN ('propose', 'attempt-push', 'push-derived', 'push'))
+      ON CONFLICT (run_id) DO NOTHING;
+    END;
+$$;
+
+CREATE OR REPLACE FUNCTION refresh_publish_ready(run_id text)
+  RETURNS void
+  LANGUAGE PLPGSQL
+  AS $$
+    DECLARE row RECORD;
+    BEGIN
+
+    SELECT codebase, suite INTO row FROM run WHERE id = run_id;
+    IF FOUND THEN
+        perform refresh_publish_ready(row.codebase, row.suite);
+    END IF;
+    END;
+$$;
+
+-- Recalculate publish_ready_run from scratch, e.g. after it was created
+-- for an existing database.
+CREATE OR REPLACE FUNCTION refresh_publish_ready()
+  RETURNS void
+  LANGUAGE PLPGSQL
+  AS $$
+    BEGIN
+    DELETE FROM publish_ready_run;
+    PERFORM refresh_publish_ready(codebase, campaign) FROM last_run;
+    END;
+$$;
+
+-- Runs are covered by refresh_last_run; result branches can also change
+-- without affecting the last run. Result branches are stored a run at a
+-- time, so refresh once per statement rather than once per branch.
+CREATE OR REPLACE FUNCTION new_result_branch_trigger_refresh_publish_ready()
+  RETURNS TRIGGER
+  LANGUAGE PLPGSQL
+  AS $$
+    BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_publish_ready(codebase, suite) FROM (
+            SELECT DISTINCT codebase, suite FROM run
+            WHERE id IN (SELECT run_id FROM new_result_branches)) AS changed;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_publish_ready(codebase, suite) FROM (
+            SELECT DISTINCT codebase, suite FROM run
+            WHERE id IN (SELECT run_id FROM old_result_branches)) AS changed;
+    ELSE
+        PERFORM refresh_publish_ready(codebase, suite) FROM (
+            SELECT DISTINCT codebase, suite FROM run
+            WHERE id IN (
+                SELECT run_id FROM new_result_branches
+                UNION SELECT run_id FROM old_result_branches)) AS changed;
+    END IF;
+    RETURN NULL;
+    END;
+$$;
+
+CREATE OR REPLACE TRIGGER new_result_branch_insert_refresh_publish_ready
+  AFTER INSERT
+  ON new_result_branch
+  REFERENCING NEW TABLE AS new_result_branches
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION new_result_branch_trigger_refresh_publish_ready();
+
+CREATE OR REPLACE TRIGGER new_result_branch_update_refresh_publish_ready
+  AFTER UPDATE
+  ON new_result_branch
+  REFERENCING OLD TABLE AS old_result_branches NEW TABLE AS new_result_branches
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION new_result_branch_trigger_refresh_publish_ready();
+
+CREATE OR REPLACE TRIGGER new_result_branch_delete_refresh_publish_ready
+  AFTER DELETE
+  ON new_result_branch
+  REFERENCING OLD TABLE AS old_result_branches
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION new_result_branch_trigger_refresh_publish_ready();
+
+CREATE OR REPLACE FUNCTION change_set_trigger_refresh_publish_ready()
+  RETURNS TRIGGER
+  LANGUAGE PLPGSQL
+  AS $$
+    DECLARE row RECORD;
+    BEGIN
+    FOR row IN SELECT DISTINCT codebase, suite FROM run WHERE change_set = NEW.id LOOP
+        perform refresh_publish_ready(row.codebase, row.suite);
+    END LOOP;
+    RETURN NEW;
+    END;
+$$;
+
+CREATE OR REPLACE TRIGGER change_set_refresh_publish_ready
+  AFTER UPDATE OF state
+  ON change_set
+  FOR EACH ROW
+  EXECUTE FUNCTION change_set_trigger_refresh_publish_ready();
+
+CREATE OR REPLACE FUNCTION candidate_trigger_refresh_publish_ready()
+  RETURNS TRIGGER
+  LANGUAGE PLPGSQL
+  AS $$
+    BEGIN
+    IF TG_OP != 'INSERT' THEN
+        perform refresh_publish_ready(OLD.codebase, OLD.suite::text);
+    END IF;
+    IF TG_OP != 'DELETE' THEN
+        perform refresh_publish_ready(NEW.codebase, NEW.suite::text);
+    END IF;
+    RETURN NEW;
+    END;
+$$;
+
+CREATE OR REPLACE TRIGGER candidate_refresh_publish_ready
+  AFTER INSERT OR DELETE
+  ON candidate
+  FOR EACH ROW
+  EXECUTE FUNCTION candidate_trigger_refresh_publish_ready();
+
+-- Candidate uploads set these columns whether or not they changed.
+CREATE OR REPLACE TRIGGER candidate_update_refresh_publish_ready
+  AFTER UPDATE OF codebase, suite, publish_policy
+  ON candidate
+  FOR EACH ROW
+  WHEN (OLD.publish_policy IS DISTINCT FROM NEW.publish_policy
+        OR OLD.codebase IS DISTINCT FROM NEW.codebase
+        OR OLD.suite IS DISTINCT FROM NEW.suite)
+  EXECUTE FUNCTION candidate_trigger_refresh_publish_ready();
+
+CREATE OR REPLACE FUNCTION named_publish_policy_trigger_refresh_publish_ready()
+  RETURNS TRIGGER
+  LANGUAGE PLPGSQL
+  AS $$
+    BEGIN
+    PERFORM refresh_publish_ready(codebase, suite::text) FROM candidate WHERE publish_policy = NEW.name;
+    RETURN NEW;
+    END;
+$$;
+
+CREATE OR REPLACE TRIGGER named_publish_policy_refresh_publish_ready
+  AFTER UPDATE OF per_branch_policy
+  ON named_publish_policy
+  FOR EACH ROW
+  EXECUTE FUNCTION named_publish_policy_trigger_refresh_publish_ready();
+
 CREATE TABLE IF NOT EXISTS review (
  run_id text not null references run (id),
  comment text,
@@ -37,5 +37,6 @@ setup(
         RustBin("janitor-mail-filter", "mail-filter/Cargo.toml", features=["cmdline"]),
         RustBin("janitor-worker", "worker/Cargo.toml", features=["cli", "debian"]),
         RustBin("janitor-dist", "worker/Cargo.toml", features=["cli", "debian"]),
+        RustBin("janitor-publish-one", "publish/Cargo.toml"),
     ]
 )
@@ -6,7 +6,7 @@ use std::os::unix::fs::MetadataExt;
 use std::path::{Path, PathBuf};
 use tokio::fs as async_fs;
 
-use crate::logs::{Error, LogFileManager};
+use crate::logs::{open_compressed_log, Error, LogFileManager};
 
 #[derive(Debug)]
 pub struct FileSystemLogFileManager {
@@ -31,6 +31,19 @@ impl FileSystemLogFileManager {
                 .join(format!("{}.gz", name)),
         ]
     }
+
+    /// Retrieve a zstd compression dictionary by id.
+    async fn get_dictionary(&self, dict_id: u32) -> Result<Option<Vec<u8>>, Error> {
+        let path = self
+            .log_directory
+            .join(".dictionaries")
+            .join(format!("{}.zdict", dict_id));
+        match async_fs::read(&path).await {
+            Ok(data) => Ok(Some(data)),
+            Err(e) if e.kind() == io::ErrorKind::NotFound => Ok(None),
+            Err(e) => Err(Error::from(e)),
+        }
+    }
 }
 
 #[async_trait]
@@ -52,8 +65,7 @@ impl LogFileManager for FileSystemLogFileManager {
             if path.exists() {
                 if path.extension().and_then(|ext| ext.to_str()) == Some("gz") {
                     let file = std::fs::File::open(path)?;
-                    let gz = flate2::read::GzDecoder::new(file);
-                    return Ok(Box::new(gz));
+                    return open_compressed_log(file, |dict_id| self.get_dictionary(dict_id)).await;
                 } else {
                     let file = std::fs::File::open(path)?;
                     return Ok(Box::new(file));
@@ -316,6 +328,86 @@ mod tests {
         assert_eq!(content, "log line 1\nlog line 2\n");
     }
 
+    #[tokio::test]
+    async fn test_get_log_multiple_gzip_members() {
+        use flate2::write::GzEncoder;
+        use flate2::Compression;
+        use std::io::Write;
+
+        let (td, mgr) = setup();
+        let dir = td.path().join("codebase").join("run-1");
+        std::fs::create_dir_all(&dir).unwrap();
+        let mut data = Vec::new();
+        for chunk in ["log line 1\n", "log line 2\n"] {
+            let mut encoder = GzEncoder::new(Vec::new(), Compression::default());
+            encoder.write_all(chunk.as_bytes()).unwrap();
+            data.extend(encoder.finish().unwrap());
+        }
+        std::fs::write(dir.join("build.log.gz"), data).unwrap();
+
+        let mut reader = mgr.get_log("codebase", "run-1", "build.log").await.unwrap();
+        let mut content = String::new();
+        reader.read_to_string(&mut content).unwrap();
+        assert_eq!(content, "log line 1\nlog line 2\n");
+    }
+
+    #[tokio::test]
+    async fn test_get_log_zstd_with_dictionary() {
+        let (td, mgr) = setup();
+        let samples: Vec<Vec<u8>> = (0..1000)
+            .map(|i| {
+                format!(
+                    "I: build step {} of package example-{}: compiling src/module_{}.c\n",
+                    i,
+                    i % 17,
+                    i % 31
+                )
+                .into_bytes()
+            })
+            .collect();
+        let dictionary = zstd::dict::from_samples(&samples, 4096).unwrap();
+        let dict_id = zstd::zstd_safe::get_dict_id_from_dict(&dictionary)
+            .unwrap()
+            .get();
+        let dict_dir = td.path().join(".dictionaries");
+        std::fs::create_dir_all(&dict_dir).unwrap();
+        std::fs::write(dict_dir.join(format!("{}.zdict", dict_id)), &dictionary).unwrap();
+
+        // Each block of the log is a separate frame.
+        let dir = td.path().join("codebase").join("run-1");
+        std::fs::create_dir_all(&dir).unwrap();
+        let mut data = Vec::new();
+        for chunk in [&samples[0], &samples[1]] {
+            let mut encoder =
+                zstd::stream::write::Encoder::with_dictionary(Vec::new(), 3, &dictionary).unwrap();
+            io::Write::write_all(&mut encoder, chunk).unwrap();
+            data.extend(encoder.finish().unwrap());
+        }
+        std::fs::write(dir.join("build.log.gz"), data).unwrap();
+
+        let mut reader = mgr.get_log("codebase", "run-1", "build.log").await.unwrap();
+        let mut content = Vec::new();
+        reader.read_to_end(&mut content).unwrap();
+        assert_eq!(content, [samples[0].clone(), samples[1].clone()].concat());
+
+        // Logs compressed with an unknown dictionary can't be read.
+        std::fs::write(
+            dir.join("other.log.gz"),
+            zstd::bulk::Compressor::with_dictionary(
+                3,
+                &zstd::dict::from_samples(&samples[1..], 4096).unwrap(),
+            )
+            .unwrap()
+            .compress(&samples[0])
+            .unwrap(),
+        )
+        .unwrap();
+        assert!(matches!(
+            mgr.get_log("codebase", "run-1", "other.log").await,
+            Err(Error::LogRetrieval(_))
+        ));
+    }
+
     #[tokio::test]
     async fn test_import_with_custom_basename() {
         let (_td, mgr) = setup();
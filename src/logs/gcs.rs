@@ -1,7 +1,6 @@
 use async_trait::async_trait;
 use bytes::Bytes;
 use chrono::{DateTime, Utc};
-use flate2::read::GzDecoder;
 use flate2::write::GzEncoder;
 use flate2::Compression;
 use google_cloud_gax::paginator::ItemPaginator;
@@ -12,7 +11,7 @@ use std::path::PathBuf;
 use tokio::fs::File;
 use tokio::io::AsyncReadExt;
 
-use crate::logs::{Error, LogFileManager};
+use crate::logs::{open_compressed_log, Error, LogFileManager};
 
 pub struct GCSLogFileManager {
     bucket_name: String,
@@ -61,6 +60,41 @@ impl GCSLogFileManager {
     fn get_object_name(&self, codebase: &str, run_id: &str, name: &str) -> String {
         format!("{}/{}/{}.gz", codebase, run_id, name)
     }
+
+    async fn read_object(&self, bucket: &str, object_name: &str) -> Result<Vec<u8>, Error> {
+        let mut response = self
+            .storage
+            .read_object(bucket, object_name)
+            .send()
+            .await
+            .map_err(|e| {
+                if e.to_string().contains("Not Found") {
+                    Error::NotFound
+                } else {
+                    Error::Other(e.to_string())
+                }
+            })?;
+
+        let mut contents = Vec::new();
+        while let Some(chunk) = response.next().await {
+            let chunk = chunk.map_err(|e| Error::Other(e.to_string()))?;
+            contents.extend_from_slice(&chunk);
+        }
+        Ok(contents)
+    }
+
+    /// Retrieve a zstd compression dictionary by id.
+    async fn get_dictionary(&self, dict_id: u32) -> Result<Option<Vec<u8>>, Error> {
+        let bucket = self.bucket_path();
+        match self
+            .read_object(&bucket, &format!("dictionaries/{}.zdict", dict_id))
+            .await
+        {
+            Ok(contents) => Ok(Some(contents)),
+            Err(Error::NotFound) => Ok(None),
+            Err(e) => Err(e),
+        }
+    }
 }
 
 #[async_trait]
@@ -97,28 +131,10 @@ impl LogFileManager for GCSLogFileManager {
         let bucket = self.bucket_path();
         let object_name = self.get_object_name(codebase, run_id, name);
 
-        let mut response = self
-            .storage
-            .read_object(&bucket, &object_name)
-            .send()
-            .await
-            .map_err(|e| {
-                if e.to_string().contains("Not Found") {
-                    Error::NotFound
-                } else {
-                    Error::Other(e.to_string())
-                }
-            })?;
-
-        let mut contents = Vec::new();
-        while let Some(chunk) = response.next().await {
-            let chunk = chunk.map_err(|e| Error::Other(e.to_string()))?;
-            contents.extend_from_slice(&chunk);
-        }
+        let contents = self.read_object(&bucket, &object_name).await?;
 
         let cursor = Cursor::new(contents);
-        let decoder = GzDecoder::new(cursor);
-        Ok(Box::new(decoder) as Box<dyn Read + Send + Sync>)
+        open_compressed_log(cursor, |dict_id| self.get_dictionary(dict_id)).await
     }
 
     async fn import_log(
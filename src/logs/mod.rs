@@ -1,6 +1,9 @@
 use async_trait::async_trait;
 use chrono::{DateTime, Utc};
-use std::io::{self, Read};
+use std::collections::HashMap;
+use std::future::Future;
+use std::io::{self, Read, Seek, SeekFrom};
+use std::sync::{Arc, Mutex};
 use std::time::Duration;
 
 mod filesystem;
@@ -84,6 +87,71 @@ fn increment_upload_success() {
     }
 }
 
+/// Magic bytes at the start of each zstd frame.
+const ZSTD_MAGIC: [u8; 4] = [0x28, 0xb5, 0x2f, 0xfd];
+
+/// Maximum size of a zstd frame header, which includes the dictionary id.
+const ZSTD_FRAME_HEADER_SIZE_MAX: u64 = 18;
+
+/// Compression dictionaries that have been retrieved, by dictionary id.
+///
+/// Dictionaries are never changed once stored, so they can be kept around.
+static ZSTD_DICTIONARIES: LazyLock<Mutex<HashMap<u32, Arc<Vec<u8>>>>> =
+    LazyLock::new(|| Mutex::new(HashMap::new()));
+
+/// Open a reader for the decompressed contents of a stored log.
+///
+/// Logs are stored either as gzip (possibly with several members) or as zstd
+/// frames, optionally compressed with a dictionary; this looks at the
+/// contents rather than the name to tell them apart.
+///
+/// # Arguments
+/// * `reader` - Reader for the compressed log.
+/// * `get_dictionary` - Retrieves the raw compression dictionary with the
+///   given id, or `None` if it doesn't exist.
+pub(crate) async fn open_compressed_log<R, F, Fut>(
+    mut reader: R,
+    get_dictionary: F,
+) -> Result<Box<dyn Read + Send + Sync>, Error>
+where
+    R: Read + Seek + Send + Sync + 'static,
+    F: FnOnce(u32) -> Fut,
+    Fut: Future<Output = Result<Option<Vec<u8>>, Error>>,
+{
+    let mut header = Vec::new();
+    (&mut reader)
+        .take(ZSTD_FRAME_HEADER_SIZE_MAX)
+        .read_to_end(&mut header)?;
+    reader.seek(SeekFrom::Start(0))?;
+
+    if !header.starts_with(&ZSTD_MAGIC) {
+        return Ok(Box::new(flate2::read::MultiGzDecoder::new(reader)));
+    }
+
+    let dict_id = match zstd::zstd_safe::get_dict_id_from_frame(&header) {
+        None => return Ok(Box::new(zstd::stream::read::Decoder::new(reader)?)),
+        Some(dict_id) => dict_id.get(),
+    };
+    let cached = ZSTD_DICTIONARIES.lock().unwrap().get(&dict_id).cloned();
+    let dictionary = match cached {
+        Some(dictionary) => dictionary,
+        None => {
+            let dictionary = Arc::new(get_dictionary(dict_id).await?.ok_or_else(|| {
+                Error::LogRetrieval(format!("Missing compression dictionary {}", dict_id))
+            })?);
+            ZSTD_DICTIONARIES
+                .lock()
+                .unwrap()
+                .insert(dict_id, dictionary.clone());
+            dictionary
+        }
+    };
+    Ok(Box::new(zstd::stream::read::Decoder::with_dictionary(
+        io::BufReader::new(reader),
+        &dictionary,
+    )?))
+}
+
 /// A trait for managing logs.
 ///
 /// This trait is implemented by various log file managers, which
@@ -1,6 +1,5 @@
 use async_trait::async_trait;
 use chrono::{DateTime, Utc};
-use flate2::read::GzDecoder;
 use flate2::write::GzEncoder;
 use flate2::Compression;
 use reqwest::{Client, StatusCode};
@@ -8,7 +7,7 @@ use std::io::{self, Cursor, Read};
 use std::path::Path;
 use std::time::Duration;
 
-use crate::logs::{Error, LogFileManager};
+use crate::logs::{open_compressed_log, Error, LogFileManager};
 
 pub struct S3LogFileManager {
     base_url: String,
@@ -40,6 +39,30 @@ impl S3LogFileManager {
     fn get_url(&self, codebase: &str, run_id: &str, name: &str) -> String {
         format!("{}{}", self.base_url, self.get_key(codebase, run_id, name))
     }
+
+    /// Retrieve a zstd compression dictionary by id.
+    async fn get_dictionary(&self, dict_id: u32) -> Result<Option<Vec<u8>>, Error> {
+        let url = format!("{}dictionaries/{}.zdict", self.base_url, dict_id);
+
+        let resp = self
+            .client
+            .get(&url)
+            .send()
+            .await
+            .map_err(|_| Error::ServiceUnavailable)?;
+
+        match resp.status() {
+            StatusCode::OK => {
+                let bytes = resp.bytes().await.map_err(|_| Error::ServiceUnavailable)?;
+                Ok(Some(bytes.to_vec()))
+            }
+            StatusCode::NOT_FOUND | StatusCode::FORBIDDEN => Ok(None),
+            status => Err(Error::Other(format!(
+                "Unexpected response code: {}",
+                status
+            ))),
+        }
+    }
 }
 
 #[async_trait]
@@ -81,8 +104,7 @@ impl LogFileManager for S3LogFileManager {
             StatusCode::OK => {
                 let bytes = resp.bytes().await.map_err(|_| Error::ServiceUnavailable)?;
                 let cursor = Cursor::new(bytes.to_vec());
-                let decoder = GzDecoder::new(cursor);
-                Ok(Box::new(decoder))
+                open_compressed_log(cursor, |dict_id| self.get_dictionary(dict_id)).await
             }
             StatusCode::NOT_FOUND => Err(Error::NotFound),
             StatusCode::FORBIDDEN => Err(Error::PermissionDenied),
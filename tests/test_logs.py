@@ -15,13 +15,29 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import asyncio
+import fcntl
+import gzip
 import os
+import sqlite3
 import tempfile
 from datetime import datetime
 
 import pytest
 
-from janitor.logs import FileSystemLogFileManager, GCSLogFileManager, S3LogFileManager
+from janitor import logs
+from janitor.logs import (
+    COMPRESSION_CHUNK_SIZE,
+    CachingLogFileManager,
+    FileSystemLogFileManager,
+    GCSLogFileManager,
+    PackFileLogFileManager,
+    S3LogFileManager,
+    compress_log,
+    copy_log,
+    import_log,
+    read_log_lines,
+)
 
 
 def test_s3_log_file_manager():
@@ -53,3 +69,341 @@ async def test_file_log_file_manager():
             assert [x async for x in lm.iter_logs()] == [("mypkg", "run-id", [logname])]
             await lm.delete_log("mypkg", "run-id", logname)
             assert not await lm.has_log("mypkg", "run-id", logname)
+
+
+async def test_compress_log():
+    data = b"".join(b"line %d\n" % i for i in range(COMPRESSION_CHUNK_SIZE // 4))
+    with tempfile.NamedTemporaryFile(suffix=".log") as f:
+        f.write(data)
+        f.flush()
+        with tempfile.TemporaryFile() as outf:
+            await compress_log(f.name, outf, mtime=0)
+            outf.seek(0)
+            assert gzip.decompress(outf.read()) == data
+
+
+async def test_read_log_lines():
+    lines = [b"line %d\n" % i for i in range(1, 50001)]
+    with tempfile.TemporaryDirectory() as td, tempfile.TemporaryDirectory() as sd:
+        async with FileSystemLogFileManager(td) as lm:
+            path = os.path.join(sd, "foo.log")
+            with open(path, "wb") as f:
+                f.writelines(lines)
+            await lm.import_log("mypkg", "run-id", path)
+            index = await lm.get_log_index("mypkg", "run-id", "foo.log")
+            assert index["line_count"] == 50000
+            assert len(index["blocks"]) > 2
+            # The blocks together are still a regular gzip file
+            assert (await lm.get_log("mypkg", "run-id", "foo.log")).read() == (
+                b"".join(lines)
+            )
+            for first, last in [(1, 1), (1, 20), (30000, 30015), (49990, 50000)]:
+                assert (
+                    await read_log_lines(lm, "mypkg", "run-id", "foo.log", first, last)
+                    == lines[first - 1 : last]
+                )
+            assert await read_log_lines(lm, "mypkg", "run-id", "bar.log", 1, 10) is None
+            assert [x async for x in lm.iter_logs()] == [
+                ("mypkg", "run-id", ["foo.log"])
+            ]
+
+
+async def test_import_log():
+    with tempfile.TemporaryDirectory() as td:
+        async with FileSystemLogFileManager(td) as lm:
+            with tempfile.NamedTemporaryFile(suffix=".log") as f:
+                f.write(b"foo bar\n")
+                f.flush()
+                logname = os.path.basename(f.name)
+                await import_log(lm, "mypkg", "run-id", logname, f.name)
+            assert (await lm.get_log("mypkg", "run-id", logname)).read() == b"foo bar\n"
+
+
+async def test_import_build_log_failure():
+    build_log = [
+        b"dh_auto_build\n",
+        b"\tmake -j4\n",
+        b"foo.c:1:10: fatal error: bar.h: No such file or directory\n",
+        b"make: *** [Makefile:2: foo] Error 1\n",
+        b"dh_auto_build: error: make -j4 returned exit code 2\n",
+        b"dpkg-buildpackage: error: debian/rules binary subprocess returned "
+        b"exit status 2\n",
+    ]
+    with tempfile.TemporaryDirectory() as td, tempfile.TemporaryDirectory() as sd:
+        async with FileSystemLogFileManager(td) as lm:
+            path = os.path.join(sd, "build.log")
+            with open(path, "wb"):
+                pass
+            await import_log(lm, "mypkg", "run-1", "build.log", path)
+            assert (await lm.get_log("mypkg", "run-1", "build.log")).read() == b""
+            with open(path, "wb") as f:
+                f.writelines(build_log)
+            await import_log(lm, "mypkg", "run-2", "build.log", path)
+            assert (await lm.get_log("mypkg", "run-2", "build.log")).read() == (
+                b"".join(build_log)
+            )
+            pytest.importorskip("janitor._site")
+            index = await lm.get_log_index("mypkg", "run-2", "build.log")
+            assert index["failure"]["line_count"] == len(build_log)
+
+
+async def test_copy_log():
+    with tempfile.TemporaryDirectory() as td:
+        from_lm = FileSystemLogFileManager(os.path.join(td, "from"))
+        async with PackFileLogFileManager(os.path.join(td, "to")) as to_lm:
+            path = os.path.join(td, "foo.log")
+            with open(path, "wb") as f:
+                f.write(b"foo bar\n" * 1000)
+            await from_lm.import_log("mypkg", "run-id", path)
+            assert await copy_log(from_lm, to_lm, "mypkg", "run-id", "foo.log") == 8000
+            assert (await to_lm.get_log("mypkg", "run-id", "foo.log")).read() == (
+                b"foo bar\n" * 1000
+            )
+            index = await to_lm.get_log_index("mypkg", "run-id", "foo.log")
+            assert index["line_count"] == 1000
+            with pytest.raises(FileNotFoundError):
+                await copy_log(from_lm, to_lm, "mypkg", "run-id", "missing.log")
+
+
+async def test_s3_log_file_manager_roundtrip(monkeypatch):
+    pytest.importorskip("aiobotocore")
+    moto_server = pytest.importorskip("moto.server")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    server = moto_server.ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        async with S3LogFileManager(f"http://{host}:{port}", bucket_name="logs") as lm:
+            await lm.s3.create_bucket(Bucket="logs")
+            assert not await lm.has_log("mypkg", "run-id", "foo.log")
+            with pytest.raises(FileNotFoundError):
+                await lm.get_log("mypkg", "run-id", "foo.log")
+            with pytest.raises(FileNotFoundError):
+                await lm.get_ctime("mypkg", "run-id", "foo.log")
+            with tempfile.TemporaryDirectory() as td:
+                path = os.path.join(td, "foo.log")
+                with open(path, "wb") as f:
+                    f.write(b"foo bar\n")
+                await lm.import_log("mypkg", "run-id", path)
+                monkeypatch.setattr(logs, "S3_MULTIPART_THRESHOLD", 0)
+                await lm.import_log("mypkg", "run-id", path, basename="bar.log")
+            for name in ["foo.log", "bar.log"]:
+                assert await lm.has_log("mypkg", "run-id", name)
+                assert (await lm.get_log("mypkg", "run-id", name)).read() == (
+                    b"foo bar\n"
+                )
+                assert await read_log_lines(lm, "mypkg", "run-id", name, 1, 1) == [
+                    b"foo bar\n"
+                ]
+            assert isinstance(
+                await lm.get_ctime("mypkg", "run-id", "foo.log"), datetime
+            )
+            assert [x async for x in lm.iter_logs()] == [
+                ("mypkg", "run-id", ["bar.log", "foo.log"])
+            ]
+            await lm.delete_log("mypkg", "run-id", "foo.log")
+            assert not await lm.has_log("mypkg", "run-id", "foo.log")
+    finally:
+        server.stop()
+
+
+class CountingLogFileManager(FileSystemLogFileManager):
+    def __init__(self, log_directory) -> None:
+        super().__init__(log_directory)
+        self.retrieved: list[str] = []
+
+    async def get_log(self, codebase, run_id, name, timeout=None):
+        self.retrieved.append(name)
+        await asyncio.sleep(0)
+        return await super().get_log(codebase, run_id, name, timeout=timeout)
+
+
+async def test_caching_log_file_manager():
+    with tempfile.TemporaryDirectory() as td, tempfile.TemporaryDirectory() as sd:
+        inner = CountingLogFileManager(td)
+        async with CachingLogFileManager(inner, max_size=25) as lm:
+            for name in ["a.log", "b.log", "c.log"]:
+                path = os.path.join(sd, name)
+                with open(path, "wb") as f:
+                    f.write(name[:1].encode() * 10)
+                await lm.import_log("mypkg", "run-id", path)
+
+            # Concurrent misses share a single retrieval
+            logs = await asyncio.gather(
+                *[lm.get_log("mypkg", "run-id", "a.log") for i in range(3)]
+            )
+            assert [f.read() for f in logs] == [b"a" * 10] * 3
+            assert inner.retrieved == ["a.log"]
+            assert (await lm.get_log("mypkg", "run-id", "a.log")).read() == b"a" * 10
+            assert inner.retrieved == ["a.log"]
+            assert lm.size == 10
+
+            # Only two logs fit; the least recently used one is evicted.
+            await lm.get_log("mypkg", "run-id", "b.log")
+            await lm.get_log("mypkg", "run-id", "a.log")
+            await lm.get_log("mypkg", "run-id", "c.log")
+            assert lm.size == 20
+            await lm.get_log("mypkg", "run-id", "a.log")
+            await lm.get_log("mypkg", "run-id", "b.log")
+            assert inner.retrieved == ["a.log", "b.log", "c.log", "b.log"]
+
+            with pytest.raises(FileNotFoundError):
+                await lm.get_log("mypkg", "run-id", "d.log")
+
+            await lm.delete_log("mypkg", "run-id", "a.log")
+            assert not await lm.has_log("mypkg", "run-id", "a.log")
+            assert lm.size == 10
+
+
+async def test_caching_log_file_manager_cancel():
+    with tempfile.TemporaryDirectory() as td, tempfile.TemporaryDirectory() as sd:
+        inner = CountingLogFileManager(td)
+        async with CachingLogFileManager(inner) as lm:
+            path = os.path.join(sd, "a.log")
+            with open(path, "wb") as f:
+                f.write(b"a" * 10)
+            await lm.import_log("mypkg", "run-id", path)
+
+            # Cancelling the request that started the retrieval does not
+            # affect the other requests waiting for it.
+            first = asyncio.ensure_future(lm.get_log("mypkg", "run-id", "a.log"))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(lm.get_log("mypkg", "run-id", "a.log"))
+            await asyncio.sleep(0)
+            first.cancel()
+            assert (await second).read() == b"a" * 10
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            assert inner.retrieved == ["a.log"]
+            assert (await lm.get_log("mypkg", "run-id", "a.log")).read() == b"a" * 10
+            assert inner.retrieved == ["a.log"]
+
+
+async def test_pack_file_log_file_manager():
+    with tempfile.TemporaryDirectory() as td, tempfile.TemporaryDirectory() as sd:
+        async with PackFileLogFileManager(td) as lm:
+            assert not await lm.has_log("mypkg", "run-id", "foo.log")
+            with pytest.raises(FileNotFoundError):
+                await lm.get_log("mypkg", "run-id", "foo.log")
+            with pytest.raises(FileNotFoundError):
+                await lm.get_ctime("mypkg", "run-id", "foo.log")
+            with pytest.raises(FileNotFoundError):
+                await lm.delete_log("mypkg", "run-id", "foo.log")
+            for codebase, run_id, name in [
+                ("mypkg", "run-id", "foo.log"),
+                ("mypkg", "run-id", "bar.log"),
+                ("otherpkg", "other-id", "foo.log"),
+            ]:
+                path = os.path.join(sd, name)
+                with open(path, "wb") as f:
+                    f.write(f"{codebase} {name}\n".encode())
+                await lm.import_log(codebase, run_id, path)
+            assert [n for n in os.listdir(td) if n.endswith(".pack")] != []
+            assert (await lm.get_log("mypkg", "run-id", "foo.log")).read() == (
+                b"mypkg foo.log\n"
+            )
+            assert await read_log_lines(
+                lm, "otherpkg", "other-id", "foo.log", 1, 1
+            ) == [b"otherpkg foo.log\n"]
+            assert isinstance(
+                await lm.get_ctime("mypkg", "run-id", "foo.log"), datetime
+            )
+            assert [x async for x in lm.iter_logs()] == [
+                ("mypkg", "run-id", ["bar.log", "foo.log"]),
+                ("otherpkg", "other-id", ["foo.log"]),
+            ]
+            await lm.delete_log("mypkg", "run-id", "foo.log")
+            assert not await lm.has_log("mypkg", "run-id", "foo.log")
+
+            # The pack that is currently being appended to is left alone.
+            assert await lm.compact(min_garbage_ratio=0) == []
+            [pack] = [n for n in os.listdir(td) if n.endswith(".pack")]
+            os.rename(os.path.join(td, pack), os.path.join(td, "2000-01-01.pack"))
+            await lm._run(
+                lambda: lm._db.execute("UPDATE log SET pack = '2000-01-01.pack'")
+            )
+            assert await lm.compact(min_garbage_ratio=0) == ["2000-01-01.pack"]
+            assert not os.path.exists(os.path.join(td, "2000-01-01.pack"))
+            assert (await lm.get_log("mypkg", "run-id", "bar.log")).read() == (
+                b"mypkg bar.log\n"
+            )
+            assert (await lm.get_log("otherpkg", "other-id", "foo.log")).read() == (
+                b"otherpkg foo.log\n"
+            )
+
+
+async def test_pack_file_log_file_manager_compact_locked():
+    with tempfile.TemporaryDirectory() as td:
+        async with PackFileLogFileManager(td) as lm:
+            path = os.path.join(td, "2000-01-01.pack")
+            with open(path, "ab") as f:
+                # Another process is still appending to a pack from before
+                # midnight, and has not indexed its log yet.
+                fcntl.flock(f, fcntl.LOCK_EX)
+                compaction = asyncio.ensure_future(lm.compact(min_garbage_ratio=0))
+                await asyncio.sleep(0.1)
+                assert not compaction.done()
+                f.write(b"data")
+                f.flush()
+                db = sqlite3.connect(os.path.join(td, "index.sqlite"))
+                with db:
+                    db.execute(
+                        "INSERT INTO log VALUES "
+                        "('mypkg', 'run-id', 'foo.log', '2000-01-01.pack', 0, 4, 0, "
+                        "NULL)"
+                    )
+                db.close()
+                fcntl.flock(f, fcntl.LOCK_UN)
+            assert await compaction == ["2000-01-01.pack"]
+            assert await lm.get_log_range("mypkg", "run-id", "foo.log", 0, 4) == (
+                b"data"
+            )
+
+
+@pytest.mark.parametrize(
+    "manager_cls", [FileSystemLogFileManager, PackFileLogFileManager]
+)
+async def test_zstd_dictionary_compression(manager_cls):
+    zstandard = pytest.importorskip("zstandard")
+    samples = [
+        b"".join(
+            b"dpkg-buildpackage: info: source package pkg%d step %d\n" % (i, j)
+            for j in range(100)
+        )
+        for i in range(200)
+    ]
+    dictionary = zstandard.train_dictionary(4096, samples)
+    with tempfile.TemporaryDirectory() as td, tempfile.TemporaryDirectory() as sd:
+        async with manager_cls(td) as lm:
+            path = os.path.join(sd, "gzip.log")
+            with open(path, "wb") as f:
+                f.write(samples[0])
+            await lm.import_log("mypkg", "run-id", path)
+
+            assert await lm.get_dictionary() is None
+            await lm.store_dictionary(dictionary.dict_id(), dictionary.as_bytes())
+            lm.compression = "zstd"
+            lm.compression_dictionary = await lm.get_dictionary()
+            assert lm.compression_dictionary == dictionary.as_bytes()
+            path = os.path.join(sd, "zstd.log")
+            with open(path, "wb") as f:
+                f.write(samples[1])
+            await lm.import_log("mypkg", "run-id", path)
+            index = await lm.get_log_index("mypkg", "run-id", "zstd.log")
+            assert index["compression"] == "zstd"
+
+            # Both formats can be read
+            assert (await lm.get_log("mypkg", "run-id", "gzip.log")).read() == (
+                samples[0]
+            )
+            assert (await lm.get_log("mypkg", "run-id", "zstd.log")).read() == (
+                samples[1]
+            )
+            assert (
+                await read_log_lines(lm, "mypkg", "run-id", "zstd.log", 2, 3)
+                == (samples[1].splitlines(True)[1:3])
+            )
+            [(codebase, run_id, names)] = [x async for x in lm.iter_logs()]
+            assert sorted(names) == ["gzip.log", "zstd.log"]
@@ -0,0 +1,459 @@
+#!/usr/bin/python
+# Copyright (C) 2022 Jelmer Vernooij <jelmer@jelmer.uk>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from breezy.errors import UnexpectedHttpStatus
+from silver_platter import BranchRateLimited
+
+from janitor import publish
+from janitor.publish import (
+    ExistingMergeProposalScan,
+    PooledWorkerProcess,
+    PublishWorker,
+    PublishWorkerPool,
+    WorkerInvalidResponse,
+)
+
+# Stand-in for janitor-publish-one --serve: echoes requests back, along with
+# its pid and the number of requests it has handled.
+FAKE_WORKER = """\
+import json, os, struct, sys
+
+jobs = 0
+while True:
+    header = sys.stdin.buffer.read(4)
+    if not header:
+        break
+    (length,) = struct.unpack(">I", header)
+    request = json.loads(sys.stdin.buffer.read(length))
+    if request.get("crash"):
+        sys.exit(101)
+    jobs += 1
+    body = json.dumps(
+        {"returncode": 0, "response": {"pid": os.getpid(), "jobs": jobs,
+                                       "request": request}}
+    ).encode()
+    sys.stdout.buffer.write(struct.pack(">I", len(body)) + body)
+    sys.stdout.buffer.flush()
+"""
+
+FAKE_WORKER_ARGS = [sys.executable, "-c", FAKE_WORKER]
+
+
+def test_worker_args():
+    assert PublishWorker()._worker_args() == ["janitor-publish-one"]
+    assert PublishWorker(template_env_path="/templates")._worker_args() == [
+        "janitor-publish-one",
+        "--template-env-path=/templates",
+    ]
+
+
+async def test_pooled_worker_process_request():
+    worker = await PooledWorkerProcess.start(FAKE_WORKER_ARGS)
+    try:
+        request = {"campaign": "lintian-fixes", "description": "café " * 1000}
+        returncode, response = await worker.request(request)
+        assert returncode == 0
+        assert response["request"] == request
+        assert response["jobs"] == 1
+        returncode, response = await worker.request({})
+        assert response["jobs"] == 2
+    finally:
+        await worker.close()
+    assert worker.process.returncode == 0
+
+
+async def test_pool_recycles_after_max_jobs():
+    pool = PublishWorkerPool(FAKE_WORKER_ARGS, 1, max_jobs=2)
+    try:
+        responses = [(await pool.run({}))[1] for i in range(3)]
+    finally:
+        await pool.close()
+    assert [r["jobs"] for r in responses] == [1, 2, 1]
+    assert responses[0]["pid"] == responses[1]["pid"]
+    assert responses[1]["pid"] != responses[2]["pid"]
+
+
+async def test_pool_worker_crash():
+    pool = PublishWorkerPool(FAKE_WORKER_ARGS, 1)
+    try:
+        (_, first) = await pool.run({})
+        with pytest.raises(WorkerInvalidResponse):
+            await pool.run({"crash": True})
+        # The crashed worker is replaced
+        (_, second) = await pool.run({})
+    finally:
+        await pool.close()
+    assert second["jobs"] == 1
+    assert first["pid"] != second["pid"]
+
+
+class FakeMergeProposal:
+    def __init__(self, url, status="open", error=None) -> None:
+        self.url = url
+        self.status = status
+        self.error = error
+
+    def is_merged(self):
+        if self.error is not None:
+            raise self.error
+        return self.status == "merged"
+
+    def is_closed(self):
+        return self.status == "closed"
+
+
+class FakeForge:
+    def __init__(self, base_url, proposals, errors=None, listing_error=None) -> None:
+        self.base_url = base_url
+        self.proposals = proposals
+        self.errors = errors or {}
+        self.listing_error = listing_error
+
+    def iter_my_proposals(self, status=None):
+        for mp in self.proposals:
+            if mp.status == status:
+                yield mp
+        if self.listing_error is not None:
+            raise self.listing_error
+
+    def get_proposal_by_url(self, url):
+        if url in self.errors:
+            raise self.errors[url]
+        for mp in self.proposals:
+            if mp.url == url:
+                return mp
+        raise AssertionError(f"unexpected lookup of {url}")
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.base_url!r})"
+
+
+class FakeConnection:
+    def __init__(self, open_urls) -> None:
+        self.open_urls = open_urls
+        self.hosts: list[str] = []
+
+    async def fetch(self, query, seen, host):
+        self.hosts.append(host)
+        return [{"url": url} for url in self.open_urls if url not in seen]
+
+
+class FakeDatabase:
+    def __init__(self, conn=None) -> None:
+        self.conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def create_scan(forges, monkeypatch, check_existing_mp, **kwargs):
+    monkeypatch.setattr(publish, "iter_forge_instances", lambda: iter(forges))
+    monkeypatch.setattr(publish, "check_existing_mp", check_existing_mp)
+    kwargs.setdefault("db", FakeDatabase())
+    kwargs.setdefault("forge_rate_limiter", {})
+    return ExistingMergeProposalScan(
+        redis=None,
+        config=None,
+        publish_worker=None,
+        bucket_rate_limiter=None,
+        vcs_managers={},
+        concurrency_per_forge=1,
+        **kwargs,
+    )
+
+
+async def test_scan_forges_separately(monkeypatch):
+    forges = [
+        FakeForge(
+            f"https://{name}.example.com",
+            [FakeMergeProposal(f"https://{name}.example.com/{i}") for i in range(3)],
+        )
+        for name in ["a", "b"]
+    ]
+    checked = []
+
+    async def check_existing_mp(*, mp, **kwargs):
+        checked.append(mp.url)
+        if mp.url == "https://a.example.com/0":
+            raise BranchRateLimited(mp.url, "rate limited", retry_after=60)
+        return False
+
+    scan = create_scan(forges, monkeypatch, check_existing_mp)
+    assert await scan.run()
+    # Being rate limited by one forge does not affect the other
+    assert sorted(checked) == [
+        "https://a.example.com/0",
+        "https://b.example.com/0",
+        "https://b.example.com/1",
+        "https://b.example.com/2",
+    ]
+    assert list(scan.forge_rate_limiter) == [forges[0]]
+    assert scan.was_forge_ratelimited
+
+
+async def test_scan_shares_modify_limit(monkeypatch):
+    forges = [
+        FakeForge(
+            f"https://{name}.example.com",
+            [FakeMergeProposal(f"https://{name}.example.com/{i}") for i in range(2)],
+        )
+        for name in ["a", "b"]
+    ]
+    check_only = []
+
+    async def check_existing_mp(**kwargs):
+        check_only.append(kwargs["check_only"])
+        return True
+
+    scan = create_scan(forges, monkeypatch, check_existing_mp, modify_limit=2)
+    assert await scan.run()
+    assert scan.modified_mps == 4
+    assert sorted(check_only) == [False, False, False, True]
+    assert scan.check_only
+
+
+async def test_scan_rate_limit_expiry(monkeypatch):
+    expired = FakeForge("https://a.example.com", [])
+    limited = FakeForge(
+        "https://b.example.com", [FakeMergeProposal("https://b.example.com/0")]
+    )
+    now = datetime.utcnow()
+    forge_rate_limiter = {
+        expired: now - timedelta(minutes=1),
+        limited: now + timedelta(minutes=30),
+    }
+    checked = []
+
+    async def check_existing_mp(*, mp, **kwargs):
+        checked.append(mp.url)
+        return False
+
+    scan = create_scan(
+        [expired, limited],
+        monkeypatch,
+        check_existing_mp,
+        forge_rate_limiter=forge_rate_limiter,
+    )
+    assert not scan.is_rate_limited(expired)
+    assert expired not in forge_rate_limiter
+    assert not scan.was_forge_ratelimited
+    assert scan.is_rate_limited(limited)
+    assert scan.was_forge_ratelimited
+    assert await scan.run()
+    assert checked == []
+    assert list(forge_rate_limiter) == [limited]
+
+
+async def test_scan_vanished_mps(monkeypatch):
+    forge = FakeForge(
+        "https://a.example.com",
+        [
+            FakeMergeProposal("https://a.example.com/open"),
+            FakeMergeProposal("https://a.example.com/merged", "merged"),
+            FakeMergeProposal(
+                "https://a.example.com/status-error",
+                "closed",
+                error=UnexpectedHttpStatus("https://a.example.com/status-error", 500),
+            ),
+        ],
+        errors={
+            "https://a.example.com/lookup-error": UnexpectedHttpStatus(
+                "https://a.example.com/lookup-error", 502
+            )
+        },
+    )
+    conn = FakeConnection(
+        [
+            "https://a.example.com/open",
+            "https://a.example.com/merged",
+            "https://a.example.com/status-error",
+            "https://a.example.com/lookup-error",
+        ]
+    )
+    checked = []
+
+    async def check_existing_mp(*, mp, status, **kwargs):
+        checked.append((mp.url, status))
+        return False
+
+    scan = create_scan(
+        [forge],
+        monkeypatch,
+        check_existing_mp,
+        db=FakeDatabase(conn),
+        full_scans={forge: datetime.utcnow()},
+        full_scan_interval=timedelta(hours=1),
+    )
+    assert await scan.run()
+    assert scan.incremental
+    assert conn.hosts == ["a.example.com"]
+    assert sorted(checked) == [
+        ("https://a.example.com/merged", "merged"),
+        ("https://a.example.com/open", "open"),
+    ]
+    assert scan.unexpected == 2
+    assert not scan.was_forge_ratelimited
+
+
+async def test_scan_vanished_mps_rate_limited(monkeypatch):
+    forge = FakeForge(
+        "https://a.example.com",
+        [FakeMergeProposal("https://a.example.com/merged", "merged")],
+        errors={
+            "https://a.example.com/limited": BranchRateLimited(
+                "https://a.example.com/limited", "rate limited", retry_after=60
+            )
+        },
+    )
+    conn = FakeConnection(
+        ["https://a.example.com/limited", "https://a.example.com/merged"]
+    )
+    checked = []
+
+    async def check_existing_mp(*, mp, **kwargs):
+        checked.append(mp.url)
+        return False
+
+    scan = create_scan(
+        [forge],
+        monkeypatch,
+        check_existing_mp,
+        db=FakeDatabase(conn),
+        full_scans={forge: datetime.utcnow()},
+        full_scan_interval=timedelta(hours=1),
+    )
+    assert await scan.run()
+    assert checked == []
+    assert list(scan.forge_rate_limiter) == [forge]
+    assert scan.was_forge_ratelimited
+
+
+async def test_scan_incomplete_listing(monkeypatch):
+    forge = FakeForge(
+        "https://a.example.com",
+        [FakeMergeProposal("https://a.example.com/open")],
+        listing_error=UnexpectedHttpStatus("https://a.example.com/api", 502),
+    )
+    conn = FakeConnection(
+        ["https://a.example.com/open", "https://a.example.com/unlisted"]
+    )
+    checked = []
+
+    async def check_existing_mp(*, mp, **kwargs):
+        checked.append(mp.url)
+        return False
+
+    last_full_scan = datetime.utcnow()
+    full_scans = {forge: last_full_scan}
+    scan = create_scan(
+        [forge],
+        monkeypatch,
+        check_existing_mp,
+        db=FakeDatabase(conn),
+        full_scans=full_scans,
+        full_scan_interval=timedelta(hours=1),
+    )
+    assert await scan.run()
+    # Merge proposals missing from a listing that was cut short are not
+    # looked up as vanished.
+    assert checked == ["https://a.example.com/open"]
+    assert conn.hosts == []
+
+    # Nor does a full scan with an incomplete listing count as one.
+    full_scans[forge] = last_full_scan - timedelta(hours=2)
+    scan = create_scan(
+        [forge],
+        monkeypatch,
+        check_existing_mp,
+        db=FakeDatabase(conn),
+        full_scans=full_scans,
+        full_scan_interval=timedelta(hours=1),
+    )
+    assert await scan.run()
+    assert not scan.incremental
+    assert full_scans[forge] == last_full_scan - timedelta(hours=2)
+
+
+async def test_iter_publish_ready_batches(con, monkeypatch):
+    monkeypatch.setattr(publish, "PUBLISH_READY_BATCH_SIZE", 2)
+    await con.execute(
+        "INSERT INTO named_publish_policy (name, per_branch_policy) "
+        "VALUES ('propose', ARRAY[ROW('main', 'propose', NULL)"
+        "::branch_publish_policy])"
+    )
+    finish_time = datetime(2024, 1, 1)
+    # Runs with equal values and finish times are ordered by id, so that
+    # batches can't skip or repeat them.
+    runs = [
+        ("r0", 10, finish_time, "ready"),
+        ("r1", 5, finish_time, "ready"),
+        ("r2", 5, finish_time, "ready"),
+        ("r3", 5, finish_time - timedelta(days=1), "ready"),
+        ("r4", 1, finish_time, "publishing"),
+        ("r5", 5, finish_time, "ready"),
+        ("r6", 10, finish_time, "done"),
+    ]
+    for run_id, value, run_finish_time, change_set_state in runs:
+        codebase = f"c{run_id}"
+        await con.execute("INSERT INTO codebase (name) VALUES ($1)", codebase)
+        await con.execute(
+            "INSERT INTO candidate (codebase, suite, command, publish_policy) "
+            "VALUES ($1, 'lintian-fixes', 'lintian-brush', 'propose')",
+            codebase,
+        )
+        await con.execute(
+            "INSERT INTO change_set (id, campaign) VALUES ($1, 'lintian-fixes')",
+            run_id,
+        )
+        await con.execute(
+            "INSERT INTO run (id, start_time, finish_time, result_code, suite, "
+            "logfilenames, change_set, codebase, value, revision, publish_status) "
+            "VALUES ($1, $2, $2, 'success', 'lintian-fixes', '{}', $1, $3, $4, "
+            "'rev', 'approved')",
+            run_id,
+            run_finish_time,
+            codebase,
+            value,
+        )
+        await con.execute(
+            "INSERT INTO new_result_branch (run_id, role, base_revision, revision) "
+            "VALUES ($1, 'main', 'base', 'rev')",
+            run_id,
+        )
+        await con.execute(
+            "UPDATE change_set SET state = $2 WHERE id = $1",
+            run_id,
+            change_set_state,
+        )
+
+    assert [run.id async for (run, _, _, _) in publish.iter_publish_ready(con)] == [
+        "r4",
+        "r0",
+        "r5",
+        "r2",
+        "r1",
+        "r3",
+    ]
+    assert [
+        run.id async for (run, _, _, _) in publish.iter_publish_ready(con, run_id="r3")
+    ] == ["r3"]
@@ -1,4 +1,7 @@
-from janitor.queue import Queue
+import random
+from datetime import timedelta
+
+from janitor.queue import Queue, QueuePositionIndex
 
 
 async def test_get_buckets(con):
@@ -46,3 +49,205 @@ async def test_vcs_only(con):
     assert queue_item.codebase == "foo"
     assert queue_item.campaign == "bar"
     assert vcs_info == {"vcs_type": "git"}
+
+
+async def test_claim_items(con):
+    queue = Queue(con)
+    await con.execute(
+        "INSERT INTO codebase (name, branch_url, url) VALUES "
+        "('foo', 'https://example.com/foo', 'https://example.com/foo'), "
+        "('bar', 'https://example.org/bar', 'https://example.org/bar')"
+    )
+    await queue.add(codebase="foo", campaign="cam", command="true")
+    await queue.add(codebase="bar", campaign="cam", command="true", offset=1.0)
+    [(item, vcs_info, host)] = await queue.claim_items(5, exclude_hosts={"example.com"})
+    assert item.codebase == "bar"
+    assert vcs_info == {"branch_url": "https://example.org/bar"}
+    assert host == "example.org"
+    # Claimed items are not handed out again
+    [(item, vcs_info, host)] = await queue.claim_items(5)
+    assert item.codebase == "foo"
+    assert await queue.claim_items(5) == []
+    await queue.release_items([item.id])
+    [(item, vcs_info, host)] = await queue.claim_items(5)
+    assert item.codebase == "foo"
+
+
+def test_position_index():
+    index = QueuePositionIndex()
+    assert index.get_position("c", "foo") == (None, None)
+    index.update(
+        1,
+        bucket="default",
+        priority=10,
+        estimated_duration=timedelta(seconds=5),
+        campaign="c",
+        codebase="foo",
+    )
+    index.update(
+        2,
+        bucket="default",
+        priority=5,
+        estimated_duration=timedelta(seconds=3),
+        campaign="c",
+        codebase="bar",
+    )
+    index.update(
+        3,
+        bucket="manual",
+        priority=100,
+        estimated_duration=None,
+        campaign="c",
+        codebase="blah",
+    )
+    assert index.get_position("c", "blah") == (1, timedelta(0))
+    assert index.get_position("c", "bar") == (2, timedelta(0))
+    assert index.get_position("c", "foo") == (3, timedelta(seconds=3))
+    # Reprioritize
+    index.update(
+        1,
+        bucket="default",
+        priority=-1,
+        estimated_duration=timedelta(seconds=5),
+        campaign="c",
+        codebase="foo",
+    )
+    assert index.get_position("c", "foo") == (2, timedelta(0))
+    assert index.get_position("c", "bar") == (3, timedelta(seconds=5))
+    index.remove(1)
+    index.remove(1)
+    assert index.get_position("c", "foo") == (None, None)
+    index.remove_candidate("c", "blah")
+    assert index.get_position("c", "bar") == (1, timedelta(0))
+    assert len(index) == 1
+
+
+def test_position_index_many():
+    index = QueuePositionIndex()
+    index.BLOCK_SIZE = 4
+    rng = random.Random(42)
+    items = {}
+    for i in range(1, 200):
+        items[i] = (rng.choice(["default", "manual"]), rng.randint(-50, 50), i % 7)
+        index.update(
+            i,
+            bucket=items[i][0],
+            priority=items[i][1],
+            estimated_duration=timedelta(seconds=items[i][2]),
+            campaign="c",
+            codebase=f"cb{i}",
+        )
+    for i in range(1, 200, 3):
+        del items[i]
+        index.remove(i)
+    expected = sorted(items, key=lambda i: (items[i][0] != "manual", items[i][1], i))
+    wait = 0
+    for position, i in enumerate(expected, 1):
+        assert index.get_position("c", f"cb{i}") == (position, timedelta(seconds=wait))
+        wait += items[i][2]
+
+
+async def test_get_position(con):
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo'), ('bar')")
+    queue = Queue(con)
+    assert await queue.get_position("cam", "foo") == (None, None)
+    await queue.add(
+        codebase="foo",
+        campaign="cam",
+        command="true",
+        estimated_duration=timedelta(seconds=10),
+    )
+    await queue.add(codebase="bar", campaign="cam", command="true", offset=1.0)
+    assert tuple(await queue.get_position("cam", "foo")) == (1, timedelta(0))
+    assert tuple(await queue.get_position("cam", "bar")) == (
+        2,
+        timedelta(seconds=10),
+    )
+    index = QueuePositionIndex()
+    await index.load(con)
+    queue = Queue(con, index)
+    assert await queue.get_position("cam", "bar") == (2, timedelta(seconds=10))
+    await queue.delete_candidate("cam", "foo")
+    assert await queue.get_position("cam", "bar") == (1, timedelta(0))
+
+
+async def test_position_index_rollback(con):
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo'), ('bar')")
+    index = QueuePositionIndex()
+    await index.load(con)
+    queue = Queue(con, index)
+    try:
+        async with queue.transaction():
+            await queue.add(codebase="foo", campaign="cam", command="true")
+            # Not visible until the transaction commits
+            assert index.get_position("cam", "foo") == (None, None)
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert index.get_position("cam", "foo") == (None, None)
+    async with queue.transaction():
+        await queue.add(codebase="bar", campaign="cam", command="true")
+        assert index.get_position("cam", "bar") == (None, None)
+    assert index.get_position("cam", "bar") == (1, timedelta(0))
+
+
+async def test_position_index_replay_during_load():
+    class FakeTransaction:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+    class FakeConnection:
+        def transaction(self):
+            return FakeTransaction()
+
+        async def cursor(self, query, prefetch):
+            yield {
+                "id": 1,
+                "bucket": "default",
+                "priority": 0,
+                "estimated_duration": None,
+                "suite": "cam",
+                "codebase": "foo",
+            }
+            # Committed after the snapshot was taken
+            index.update(
+                2,
+                bucket="default",
+                priority=-1,
+                estimated_duration=None,
+                campaign="cam",
+                codebase="bar",
+            )
+            index.remove(1)
+
+    index = QueuePositionIndex()
+    await index.load(FakeConnection())
+    assert index.get_position("cam", "foo") == (None, None)
+    assert index.get_position("cam", "bar") == (1, timedelta(0))
+
+
+async def test_add_many(con):
+    queue = Queue(con)
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo'), ('bar')")
+    assert await queue.add(
+        codebase="foo", campaign="cam", command="true", offset=-5
+    ) == (
+        1,
+        "default",
+    )
+    ids = await queue.add_many(
+        [
+            {"codebase": "foo", "campaign": "cam", "command": "true", "offset": 10},
+            {"codebase": "bar", "campaign": "cam", "command": "true", "offset": 3},
+            {"codebase": "bar", "campaign": "cam", "command": "true", "offset": 1},
+        ]
+    )
+    assert ids[0] == (1, "default")
+    assert ids[1] == ids[2]
+    assert ids[1][0] != 1
+    assert await con.fetchval("SELECT priority FROM queue WHERE codebase = 'bar'") == (
+        -5 + 1
+    )
@@ -15,6 +15,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
 
+import json
 import os
 from datetime import datetime, timedelta
 from io import BytesIO
@@ -23,6 +24,7 @@ import aiozipkin
 from aiohttp import MultipartWriter
 from fakeredis.aioredis import FakeRedis
 
+from janitor import runner
 from janitor.config import read_string as read_config_string
 from janitor.debian import dpkg_vendor
 from janitor.logs import LogFileManager
@@ -145,6 +147,127 @@ async def test_ready(aiohttp_client):
     assert text == "ok"
 
 
+class GrowingLogBackchannel(Backchannel):
+    def __init__(self, logs) -> None:
+        self.logs = logs
+
+    async def get_log_file(self, name, offset=0):
+        try:
+            return BytesIO(self.logs[name][offset:])
+        except KeyError as e:
+            raise FileNotFoundError(name) from e
+
+
+class ActiveRunsStub:
+    def __init__(self, runs) -> None:
+        self.runs = runs
+
+    async def get_run(self, run_id):
+        return self.runs.get(run_id)
+
+
+async def test_log_offset(aiohttp_client):
+    active_run = ActiveRun(
+        campaign="test",
+        change_set=None,
+        command="blah",
+        queue_id=12,
+        log_id="some-id",
+        start_time=datetime.utcnow(),
+        codebase="test-1.1",
+        vcs_info={},
+        backchannel=GrowingLogBackchannel({"worker.log": b"line 1\nline 2\n"}),
+        worker_name="tester",
+        instigated_context=None,
+        estimated_duration=timedelta(seconds=10),
+    )
+    client = await create_client(
+        aiohttp_client, ActiveRunsStub({"some-id": active_run})
+    )
+
+    resp = await client.get("/log/some-id/worker.log")
+    assert resp.status == 200
+    assert await resp.read() == b"line 1\nline 2\n"
+    assert resp.headers["X-Next-Offset"] == "14"
+
+    resp = await client.get("/log/some-id/worker.log", params={"offset": "7"})
+    assert resp.status == 206
+    assert await resp.read() == b"line 2\n"
+    assert resp.headers["Content-Range"] == "bytes 7-13/*"
+
+    resp = await client.get("/log/some-id/worker.log", headers={"Range": "bytes=14-"})
+    assert resp.status == 204
+    assert resp.headers["X-Next-Offset"] == "14"
+
+    resp = await client.get("/log/some-id/worker.log", params={"offset": "x"})
+    assert resp.status == 400
+
+    resp = await client.get("/log/some-id/other.log")
+    assert resp.status == 404
+
+
+class FinishingActiveRunsStub(ActiveRunsStub):
+    """Active runs that finish after they have been looked up a few times."""
+
+    def __init__(self, runs, lookups) -> None:
+        super().__init__(runs)
+        self.lookups = lookups
+
+    async def get_run(self, run_id):
+        self.lookups -= 1
+        if self.lookups < 0:
+            return None
+        return await super().get_run(run_id)
+
+
+async def test_log_follow(aiohttp_client, monkeypatch):
+    monkeypatch.setattr(runner, "LOG_FOLLOW_POLL_INTERVAL", 0)
+    logs = {"worker.log": b"line 1\r\nline 2\rpartial"}
+    active_run = ActiveRun(
+        campaign="test",
+        change_set=None,
+        command="blah",
+        queue_id=12,
+        log_id="some-id",
+        start_time=datetime.utcnow(),
+        codebase="test-1.1",
+        vcs_info={},
+        backchannel=GrowingLogBackchannel(logs),
+        worker_name="tester",
+        instigated_context=None,
+        estimated_duration=timedelta(seconds=10),
+    )
+    client = await create_client(
+        aiohttp_client, FinishingActiveRunsStub({"some-id": active_run}, 2)
+    )
+    resp = await client.get("/log/some-id/worker.log/follow")
+    assert resp.status == 200
+    assert resp.headers["Content-Type"] == "text/event-stream"
+    # The incomplete last line is held back until the run has finished.
+    assert await resp.text() == (
+        "event: append\nid: 8\ndata: line 1\ndata: \n\n"
+        ": keepalive\n\n"
+        "event: append\nid: 22\ndata: line 2\ndata: partial\n\n"
+        "event: end\nid: 22\ndata: \n\n"
+    )
+
+    logs["worker.log"] += b" line\n"
+    client = await create_client(
+        aiohttp_client, FinishingActiveRunsStub({"some-id": active_run}, 1)
+    )
+    resp = await client.get(
+        "/log/some-id/worker.log/follow", headers={"Last-Event-ID": "8"}
+    )
+    assert resp.status == 200
+    assert await resp.text() == (
+        "event: append\nid: 28\ndata: line 2\ndata: partial line\ndata: \n\n"
+        "event: end\nid: 28\ndata: \n\n"
+    )
+
+    resp = await client.get("/log/other-id/worker.log/follow")
+    assert resp.status == 404
+
+
 def test_committer_env():
     assert committer_env(None) == {}
     assert committer_env("Joe Example <joe@example.com>") == {
@@ -226,7 +349,7 @@ async def test_register_run():
     assert await qp.active_run_count() == 1
     assert await qp.redis.hkeys("active-runs") == [b"some-id"]
     assert await qp.redis.hkeys("assigned-queue-items") == [b"12"]
-    assert await qp.redis.hkeys("last-keepalive") == [b"some-id"]
+    assert await qp.redis.zrange("keepalives", 0, -1) == [b"some-id"]
 
     assert await qp.get_run("nonexistent-id") is None
     assert (await qp.get_run("some-id")).queue_id == 12
@@ -234,10 +357,84 @@ async def test_register_run():
     await qp.unclaim_run("some-id")
     assert await qp.redis.hkeys("active-runs") == []
     assert await qp.redis.hkeys("assigned-queue-items") == []
-    assert await qp.redis.hkeys("last-keepalive") == []
+    assert await qp.redis.zrange("keepalives", 0, -1) == []
     assert await qp.active_run_count() == 0
 
 
+async def test_queue_status_events():
+    qp = await create_queue_processor()
+    async with qp.redis.pubsub() as ch:
+        await ch.subscribe("queue")
+        await ch.get_message(timeout=1)
+        for queue_id, log_id in enumerate(["kept-id", "brief-id"]):
+            await qp.register_run(
+                ActiveRun(
+                    campaign="test",
+                    change_set=None,
+                    command="blah",
+                    queue_id=queue_id,
+                    log_id=log_id,
+                    start_time=datetime.utcnow(),
+                    codebase="test-1.1",
+                    vcs_info={},
+                    backchannel=Backchannel(),
+                    worker_name="tester",
+                    instigated_context=None,
+                    estimated_duration=timedelta(seconds=10),
+                )
+            )
+        await qp.unclaim_run("brief-id")
+        await qp.queue_status.flush()
+        msg = json.loads((await ch.get_message(timeout=1))["data"])
+        # The run that came and went within the window is never announced.
+        assert msg["type"] == "delta"
+        assert msg["seq"] == 1
+        assert [(e["type"], e["id"]) for e in msg["events"]] == [
+            ("run-added", "kept-id")
+        ]
+        assert msg["events"][0]["run"]["codebase"] == "test-1.1"
+
+        await qp.unclaim_run("kept-id")
+        await qp.queue_status.publish_snapshot()
+        msg = json.loads((await ch.get_message(timeout=1))["data"])
+        # Pending events are superseded by the snapshot.
+        assert msg == {
+            "type": "snapshot",
+            "seq": 2,
+            "avoid_hosts": [],
+            "processing": [],
+            "rate_limit_hosts": {},
+        }
+
+
+async def test_expired_runs():
+    qp = await create_queue_processor()
+    for queue_id, log_id in enumerate(["fresh-id", "stale-id"]):
+        await qp.register_run(
+            ActiveRun(
+                campaign="test",
+                change_set=None,
+                command="blah",
+                queue_id=queue_id,
+                log_id=log_id,
+                start_time=datetime.utcnow(),
+                codebase="test-1.1",
+                vcs_info={},
+                backchannel=Backchannel(),
+                worker_name="tester",
+                instigated_context=None,
+                estimated_duration=timedelta(seconds=10),
+            )
+        )
+    assert await qp._expired_runs() == []
+    await qp.redis.zadd("keepalives", {"stale-id": 0, "finished-id": 0})
+    [(active_run, keepalive_age)] = await qp._expired_runs()
+    assert active_run.log_id == "stale-id"
+    assert keepalive_age > timedelta(days=1)
+    # Entries for runs that are no longer active are dropped.
+    assert await qp.redis.zscore("keepalives", "finished-id") is None
+
+
 async def test_submit_codebase(aiohttp_client, db):
     qp = await create_queue_processor(db)
     client = await create_client(aiohttp_client, qp)
@@ -246,7 +443,12 @@ async def test_submit_codebase(aiohttp_client, db):
         json=[{"name": "foo", "branch_url": "https://example.com/foo.git"}],
     )
     assert resp.status == 200
-    assert {} == await resp.json()
+    assert {
+        "added": 1,
+        "changed": 0,
+        "removed": 0,
+        "rescheduled": 0,
+    } == await resp.json()
 
     resp = await client.get("/codebases")
     assert resp.status == 200
@@ -265,6 +467,101 @@ async def test_submit_codebase(aiohttp_client, db):
     ] == await resp.json()
 
 
+async def test_sync_codebases(aiohttp_client, db):
+    qp = await create_queue_processor(db)
+    client = await create_client(aiohttp_client, qp, campaigns=["mycampaign"])
+    resp = await client.post(
+        "/codebases",
+        json=[
+            {"name": "foo", "branch_url": "https://example.com/foo.git"},
+            {"name": "bar", "branch_url": "https://example.com/bar.git"},
+        ],
+    )
+    assert resp.status == 200
+    resp = await client.post(
+        "/candidates",
+        json=[{"campaign": "mycampaign", "codebase": "foo", "command": "true"}],
+    )
+    assert resp.status == 200
+
+    # Unchanged codebases are left alone
+    resp = await client.post(
+        "/codebases",
+        json=[{"name": "foo", "branch_url": "https://example.com/foo.git"}],
+    )
+    assert resp.status == 200
+    assert {
+        "added": 0,
+        "changed": 0,
+        "removed": 0,
+        "rescheduled": 0,
+    } == await resp.json()
+
+    async with db.acquire() as conn:
+        await conn.execute(
+            "UPDATE queue SET bucket = 'manual', refresh = false WHERE codebase = 'foo'"
+        )
+
+    resp = await client.post(
+        "/codebases",
+        params={"sync": "true"},
+        json=[
+            {"name": "foo", "branch_url": "https://example.com/new-foo.git"},
+            {"name": "blah", "branch_url": "https://example.com/blah.git"},
+        ],
+    )
+    assert resp.status == 200
+    assert {
+        "added": 1,
+        "changed": 1,
+        "removed": 1,
+        "rescheduled": 1,
+    } == await resp.json()
+    async with db.acquire() as conn:
+        inactive = await conn.fetchval(
+            "SELECT inactive FROM codebase WHERE name = 'bar'"
+        )
+        queued = await conn.fetchrow(
+            "SELECT bucket, refresh FROM queue WHERE codebase = 'foo'"
+        )
+    assert inactive
+    # The moved codebase is refreshed, without leaving its bucket
+    assert tuple(queued) == ("manual", True)
+
+
+async def test_export_codebases_ndjson(aiohttp_client, db):
+    qp = await create_queue_processor(db)
+    client = await create_client(aiohttp_client, qp)
+    resp = await client.post(
+        "/codebases",
+        json=[
+            {"name": "foo", "branch_url": "https://example.com/foo.git"},
+            {"name": "bar", "branch_url": "https://example.com/bar.git"},
+        ],
+    )
+    assert resp.status == 200
+
+    resp = await client.get("/codebases", params={"format": "ndjson"})
+    assert resp.status == 200
+    assert resp.content_type == "application/x-ndjson"
+    lines = (await resp.text()).splitlines()
+    assert sorted(json.loads(line)["name"] for line in lines) == ["bar", "foo"]
+    since = resp.headers["X-Export-Timestamp"]
+
+    resp = await client.post(
+        "/codebases",
+        json=[{"name": "foo", "branch_url": "https://example.com/foo.git", "value": 3}],
+    )
+    assert resp.status == 200
+
+    resp = await client.get("/codebases", params={"since": since})
+    assert resp.status == 200
+    assert [entry["name"] for entry in await resp.json()] == ["foo"]
+
+    resp = await client.get("/codebases", params={"since": "yesterday"})
+    assert resp.status == 400
+
+
 async def test_candidate_invalid_value(aiohttp_client, db, tmp_path):
     vcs = tmp_path / "vcs"
     vcs.mkdir()
@@ -380,6 +677,15 @@ async def test_submit_candidate(aiohttp_client, db, tmp_path):
                 )
             ],
         )  # type: ignore
+        mpwriter.append(
+            BytesIO(b"build output\n"),
+            headers=[  # type: ignore
+                (
+                    "Content-Disposition",
+                    "attachment; filename=\"worker.log\"; filename*=utf-8''worker.log",
+                )
+            ],
+        )  # type: ignore
 
     resp = await client.post(f"/active-runs/{assignment['id']}/finish", data=mpwriter)
     assert resp.status == 201
@@ -388,8 +694,8 @@ async def test_submit_candidate(aiohttp_client, db, tmp_path):
     assert ret == {
         "id": assignment["id"],
         "artifacts": None,
-        "filenames": [],
-        "logs": [],
+        "filenames": ["worker.log"],
+        "logs": ["worker.log"],
         "result": {
             "branches": None,
             "branch_url": None,
@@ -404,7 +710,7 @@ async def test_submit_candidate(aiohttp_client, db, tmp_path):
             "failure_stage": None,
             "finish_time": ts,
             "log_id": assignment["id"],
-            "logfilenames": [],
+            "logfilenames": ["worker.log"],
             "main_branch_revision": None,
             "remotes": None,
             "resume": None,
@@ -416,6 +722,7 @@ async def test_submit_candidate(aiohttp_client, db, tmp_path):
             "value": None,
         },
     }
+    assert await qp.logfile_manager.has_log("foo", assignment["id"], "worker.log")
 
     await qp.stop()
 
@@ -460,6 +767,52 @@ async def test_submit_unknown_candidate_publish_policy(aiohttp_client, db):
     assert ("unknown_publish_policies", ["some-policy"]) in (await resp.json()).items()
 
 
+async def test_submit_candidates_ndjson(aiohttp_client, db):
+    qp = await create_queue_processor(db)
+    client = await create_client(aiohttp_client, qp, campaigns=["mycampaign"])
+    resp = await client.post(
+        "/codebases",
+        json=[{"name": "foo", "branch_url": "https://example.com/foo.git"}],
+    )
+    assert resp.status == 200
+    candidates = [
+        {"codebase": "foo", "campaign": "mycampaign", "command": "false"},
+        {"codebase": "bar", "campaign": "mycampaign", "command": "true"},
+        {"codebase": "foo", "campaign": "mycampaign", "command": "true"},
+    ]
+    resp = await client.post(
+        "/candidates",
+        data="".join(json.dumps(candidate) + "\n" for candidate in candidates),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status == 200
+    result = await resp.json()
+    assert result["unknown_codebases"] == ["bar"]
+    assert [(entry["codebase"], entry["queue-id"]) for entry in result["success"]] == [
+        ("foo", 1),
+        ("foo", 1),
+    ]
+    async with db.acquire() as conn:
+        command = await conn.fetchval(
+            "SELECT command FROM candidate WHERE codebase = 'foo'"
+        )
+    assert command == "true"
+
+
+async def test_submit_candidates_invalid_json(aiohttp_client):
+    client = await create_client(aiohttp_client, campaigns=["mycampaign"])
+    resp = await client.post(
+        "/candidates",
+        data=b'[{"codebase": "foo", "campaign": "mycampaign"} {}]',
+        headers={"Content-Type": "application/json"},
+    )
+    assert resp.status == 400
+    resp = await client.post(
+        "/candidates", data=b"[", headers={"Content-Type": "application/json"}
+    )
+    assert resp.status == 400
+
+
 async def test_submit_unknown_campaign(aiohttp_client, db):
     qp = await create_queue_processor(db)
     client = await create_client(aiohttp_client, qp)
@@ -0,0 +1,371 @@
+from datetime import datetime, timedelta
+
+from debian.changelog import Version
+
+from janitor.schedule import (
+    DebianVersionIndex,
+    bulk_add_to_queue,
+    bulk_estimate_success_probability_and_duration,
+    calculate_offset,
+    do_schedule_many,
+    estimate_duration,
+    estimate_success_probability_and_duration,
+)
+
+
+def test_calculate_offset_first_run_bonus():
+    first = calculate_offset(
+        estimated_duration=timedelta(seconds=60),
+        normalized_codebase_value=0.5,
+        estimated_probability_of_success=0.5,
+        candidate_value=10.0,
+        total_previous_runs=0,
+        success_chance=None,
+    )
+    later = calculate_offset(
+        estimated_duration=timedelta(seconds=60),
+        normalized_codebase_value=0.5,
+        estimated_probability_of_success=0.5,
+        candidate_value=10.0,
+        total_previous_runs=1,
+        success_chance=None,
+    )
+    assert first < later
+
+
+async def _add_run(con, run_id, codebase, campaign, result_code, duration, **kwargs):
+    start_time = datetime.utcnow() - timedelta(hours=2)
+    await con.execute(
+        "INSERT INTO change_set (id, campaign) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+        run_id,
+        campaign,
+    )
+    await con.execute(
+        "INSERT INTO run (id, start_time, finish_time, result_code, suite, "
+        "logfilenames, change_set, codebase, context, failure_transient) "
+        "VALUES ($1, $2, $3, $4, $5, '{}', $1, $6, $7, $8)",
+        run_id,
+        kwargs.get("start_time", start_time),
+        kwargs.get("start_time", start_time) + duration,
+        result_code,
+        campaign,
+        codebase,
+        kwargs.get("context"),
+        kwargs.get("failure_transient"),
+    )
+
+
+async def test_bulk_estimate_matches(con):
+    await con.execute(
+        "INSERT INTO codebase (name, value) VALUES ('foo', 10), ('bar', 5), ('baz', 1)"
+    )
+    await _add_run(con, "r1", "foo", "lintian-fixes", "success", timedelta(minutes=60))
+    await _add_run(
+        con,
+        "r2",
+        "foo",
+        "lintian-fixes",
+        "some-failure",
+        timedelta(minutes=30),
+        context="x",
+        start_time=datetime.utcnow() - timedelta(hours=1),
+    )
+    await _add_run(
+        con,
+        "r3",
+        "foo",
+        "lintian-fixes",
+        "worker-failure",
+        timedelta(minutes=10),
+        start_time=datetime.utcnow() - timedelta(days=3),
+    )
+    await _add_run(
+        con,
+        "r4",
+        "bar",
+        "lintian-fixes",
+        "success",
+        timedelta(minutes=100),
+        failure_transient=True,
+    )
+    await _add_run(con, "r5", "bar", "fresh-releases", "success", timedelta(minutes=45))
+    await _add_run(
+        con, "r6", "foo", "fresh-releases", "worker-failure", timedelta(minutes=9)
+    )
+    todo = [
+        ("foo", "lintian-fixes", "x"),
+        ("foo", "lintian-fixes", "y"),
+        ("foo", "lintian-fixes", None),
+        ("foo", "fresh-releases", None),
+        ("bar", "lintian-fixes", "x"),
+        ("baz", "lintian-fixes", None),
+        ("baz", "unknown", ""),
+    ]
+    expected = [
+        (11 / 21 * 0.1, timedelta(minutes=52.5), 2),
+        (11 / 21, timedelta(minutes=52.5), 2),
+        (11 / 21 * 0.5, timedelta(minutes=52.5), 2),
+        # Worker failures don't count towards the durations, so this falls
+        # back to the mean for the codebase.
+        (1 / 11 * 0.5, timedelta(minutes=109 / 4), 1),
+        (1.0, timedelta(minutes=45), 0),
+        (1.0, timedelta(seconds=2000), 0),
+        (1.0, timedelta(seconds=15), 0),
+    ]
+    assert [
+        await estimate_success_probability_and_duration(con, *item) for item in todo
+    ] == expected
+    assert await bulk_estimate_success_probability_and_duration(con, todo) == expected
+    # Rebuilding the statistics gives the same recency-weighted means.
+    await con.execute("SELECT refresh_run_statistics()")
+    assert await bulk_estimate_success_probability_and_duration(con, todo) == expected
+
+
+async def test_run_statistics(con):
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo')")
+    await _add_run(con, "r1", "foo", "lintian-fixes", "success", timedelta(minutes=10))
+    await _add_run(
+        con, "r2", "foo", "lintian-fixes", "some-failure", timedelta(minutes=20)
+    )
+    await _add_run(
+        con,
+        "r3",
+        "foo",
+        "lintian-fixes",
+        "worker-failure",
+        timedelta(minutes=30),
+        failure_transient=True,
+    )
+    row = await con.fetchrow(
+        "SELECT run_count, success_count, duration_sum, duration_count "
+        "FROM run_statistics "
+        "WHERE codebase = 'foo' AND campaign = 'lintian-fixes'"
+    )
+    assert tuple(row) == (2, 1, timedelta(minutes=30), 2)
+    assert await estimate_duration(con, "foo", "lintian-fixes") == timedelta(
+        minutes=12.5
+    )
+    await con.execute("UPDATE run SET failure_transient = True WHERE id = 'r2'")
+    await con.execute("UPDATE run SET result_code = 'some-failure' WHERE id = 'r1'")
+    # A run without a known duration counts as a run, but doesn't affect the
+    # mean duration.
+    await con.execute("UPDATE run SET finish_time = NULL WHERE id = 'r3'")
+    await con.execute("UPDATE run SET failure_transient = NULL WHERE id = 'r3'")
+    row = await con.fetchrow(
+        "SELECT sum(run_count), sum(success_count), sum(duration_sum), "
+        "sum(duration_count) FROM campaign_run_statistics "
+        "WHERE campaign = 'lintian-fixes'"
+    )
+    assert tuple(row) == (2, 0, timedelta(minutes=10), 1)
+    # The weighted mean only moves for new runs.
+    assert await estimate_duration(con, "foo", "lintian-fixes") == timedelta(
+        minutes=12.5
+    )
+    await con.execute("SELECT refresh_run_statistics()")
+    row = await con.fetchrow(
+        "SELECT run_count, success_count, duration_sum, duration_count, "
+        "recent_duration FROM run_statistics "
+        "WHERE codebase = 'foo' AND campaign = 'lintian-fixes'"
+    )
+    assert tuple(row) == (2, 0, timedelta(minutes=10), 1, timedelta(minutes=10))
+
+
+async def test_publish_ready_run(con):
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo')")
+    await con.execute(
+        "INSERT INTO named_publish_policy (name, per_branch_policy) "
+        "VALUES ('propose', ARRAY[ROW('main', 'propose', NULL)"
+        "::branch_publish_policy])"
+    )
+    await con.execute(
+        "INSERT INTO candidate (codebase, suite, command, publish_policy) "
+        "VALUES ('foo', 'lintian-fixes', 'lintian-brush', 'propose')"
+    )
+    await _add_run(con, "r1", "foo", "lintian-fixes", "success", timedelta(minutes=5))
+    await con.execute(
+        "INSERT INTO new_result_branch (run_id, role, base_revision, revision) "
+        "VALUES ('r1', 'main', 'base', 'rev')"
+    )
+
+    async def ready():
+        return [
+            row["run_id"]
+            for row in await con.fetch("SELECT run_id FROM publish_ready_run")
+        ]
+
+    assert await ready() == []
+    await con.execute(
+        "UPDATE run SET revision = 'rev', publish_status = 'approved' WHERE id = 'r1'"
+    )
+    assert await ready() == ["r1"]
+    await con.execute(
+        "UPDATE named_publish_policy SET per_branch_policy = "
+        "ARRAY[ROW('main', 'build-only', NULL)::branch_publish_policy]"
+    )
+    assert await ready() == []
+    await con.execute(
+        "UPDATE named_publish_policy SET per_branch_policy = "
+        "ARRAY[ROW('main', 'propose', NULL)::branch_publish_policy]"
+    )
+    assert await ready() == ["r1"]
+    await con.execute("UPDATE new_result_branch SET absorbed = True")
+    assert await ready() == []
+    await con.execute("UPDATE new_result_branch SET absorbed = False")
+    await con.execute("SELECT refresh_publish_ready()")
+    assert await ready() == ["r1"]
+    await con.execute("UPDATE candidate SET publish_policy = NULL")
+    assert await ready() == []
+    await con.execute("UPDATE candidate SET publish_policy = 'propose'")
+    assert await ready() == ["r1"]
+    await con.execute("DELETE FROM new_result_branch")
+    assert await ready() == []
+
+
+async def test_publish_ready_run_transitions(con):
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo')")
+    await con.execute(
+        "INSERT INTO named_publish_policy (name, per_branch_policy) "
+        "VALUES ('propose', ARRAY[ROW('main', 'propose', NULL)"
+        "::branch_publish_policy])"
+    )
+    await con.execute(
+        "INSERT INTO candidate (codebase, suite, command, publish_policy) "
+        "VALUES ('foo', 'lintian-fixes', 'lintian-brush', 'propose')"
+    )
+
+    async def ready():
+        return [
+            tuple(row)
+            for row in await con.fetch(
+                "SELECT run_id, publishing FROM publish_ready_run"
+            )
+        ]
+
+    start_time = datetime.utcnow() - timedelta(hours=2)
+    await _add_run(
+        con,
+        "r1",
+        "foo",
+        "lintian-fixes",
+        "success",
+        timedelta(minutes=5),
+        start_time=start_time,
+    )
+    await con.execute(
+        "INSERT INTO new_result_branch (run_id, role, base_revision, revision) "
+        "VALUES ('r1', 'main', 'base', 'rev')"
+    )
+    await con.execute(
+        "UPDATE run SET revision = 'rev', publish_status = 'approved' WHERE id = 'r1'"
+    )
+    assert await ready() == [("r1", False)]
+
+    # A review changes the publish status of the run.
+    await con.execute("UPDATE run SET publish_status = 'rejected' WHERE id = 'r1'")
+    assert await ready() == []
+    await con.execute("UPDATE run SET publish_status = 'approved' WHERE id = 'r1'")
+    assert await ready() == [("r1", False)]
+
+    await con.execute("UPDATE change_set SET state = 'done' WHERE id = 'r1'")
+    assert await ready() == []
+    await con.execute("UPDATE change_set SET state = 'publishing' WHERE id = 'r1'")
+    assert await ready() == [("r1", True)]
+    await con.execute("UPDATE change_set SET state = 'ready' WHERE id = 'r1'")
+    assert await ready() == [("r1", False)]
+
+    await con.execute(
+        "UPDATE new_result_branch SET absorbed = True WHERE run_id = 'r1'"
+    )
+    assert await ready() == []
+    await con.execute(
+        "UPDATE new_result_branch SET absorbed = False WHERE run_id = 'r1'"
+    )
+    assert await ready() == [("r1", False)]
+
+    # A newer run replaces r1 as soon as it is inserted, but only becomes
+    # publishable once it has been approved.
+    await _add_run(
+        con,
+        "r2",
+        "foo",
+        "lintian-fixes",
+        "success",
+        timedelta(minutes=5),
+        start_time=start_time + timedelta(minutes=30),
+    )
+    assert await ready() == []
+    await con.execute(
+        "INSERT INTO new_result_branch (run_id, role, base_revision, revision) "
+        "VALUES ('r2', 'main', 'base', 'rev')"
+    )
+    await con.execute(
+        "UPDATE run SET revision = 'rev', publish_status = 'approved' WHERE id = 'r2'"
+    )
+    assert await ready() == [("r2", False)]
+
+
+async def test_bulk_add_to_queue(con):
+    await con.execute(
+        "INSERT INTO codebase (name, value) VALUES ('foo', 10), ('bar', 5)"
+    )
+    await _add_run(con, "r1", "foo", "lintian-fixes", "success", timedelta(minutes=60))
+    todo = [
+        ("foo", None, "lintian-brush", "lintian-fixes", 10, 0.5),
+        ("bar", None, "lintian-brush", "lintian-fixes", 20, None),
+    ]
+    scheduled = await bulk_add_to_queue(con, todo)
+    assert [(queue_id, bucket) for (_, _, queue_id, bucket) in scheduled] == [
+        (1, "default"),
+        (2, "default"),
+    ]
+    assert scheduled[0][1] == timedelta(minutes=60)
+    # Scheduling the same items again keeps the existing entries.
+    assert await bulk_add_to_queue(con, todo) == scheduled
+
+
+async def test_do_schedule_many(con):
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo'), ('bar')")
+    await con.execute(
+        "INSERT INTO candidate (codebase, suite, command) "
+        "VALUES ('foo', 'lintian-fixes', 'lintian-brush')"
+    )
+    await _add_run(con, "r1", "foo", "lintian-fixes", "success", timedelta(minutes=5))
+    scheduled = await do_schedule_many(
+        con,
+        [
+            {"codebase": "foo", "campaign": "lintian-fixes", "bucket": "reschedule"},
+            {"codebase": "bar", "campaign": "lintian-fixes"},
+            {"codebase": "bar", "campaign": "fresh-releases", "command": "true"},
+        ],
+    )
+    assert scheduled == [
+        (-1.0, timedelta(minutes=5), 1, "reschedule"),
+        None,
+        (-1.0, timedelta(seconds=15), 2, "default"),
+    ]
+
+
+async def test_debian_version_index(con):
+    await con.execute(
+        "CREATE TABLE all_debian_versions (source text, version debversion)"
+    )
+    await con.execute(
+        "INSERT INTO all_debian_versions VALUES ('foo', '1.0-1'), ('foo', '1.2-1')"
+    )
+    index = DebianVersionIndex()
+    relations = [
+        [[{"name": "foo", "version": [">=", "1.1"]}]],
+        [[{"name": "foo", "version": [">>", "1.2-1"]}]],
+        [[{"name": "bar"}], [{"name": "foo", "version": ["=", "1.0-1"]}]],
+        [[{"name": "bar"}, {"name": "foo", "version": ["<<", "1.0-1"]}]],
+        [[{"name": "bar"}, {"name": "foo"}]],
+    ]
+    assert await index.deps_satisfied_many(con, relations) == [
+        True,
+        False,
+        False,
+        False,
+        True,
+    ]
+    index.add("foo", Version("1.3-1"))
+    assert index.dep_available("foo", version=(">>", Version("1.2-1")))
@@ -0,0 +1,56 @@
+import random
+from datetime import datetime, timedelta
+
+from janitor.simulate import (
+    SimulationReport,
+    _pick_run,
+    simulate,
+    synthesise_history,
+)
+
+
+def test_report():
+    report = SimulationReport(
+        workers=2, duration=timedelta(hours=2), runs=10, value=50.0
+    )
+    assert report.runs_per_hour == 5.0
+    assert report.value_per_hour == 25.0
+    assert report.latency_percentile(50) is None
+    report.latencies.extend([4.0, 1.0, 3.0, 2.0])
+    assert report.latency_percentile(50) == 3.0
+    assert report.latency_percentile(99) == 4.0
+
+
+async def test_simulate(con):
+    rng = random.Random(42)
+    await synthesise_history(con, codebases=10, rng=rng)
+    report = await simulate(con, workers=2, duration=timedelta(hours=6), rng=rng)
+    assert report.scheduled > 0
+    assert report.runs > 0
+    assert len(report.latencies) >= report.runs
+    assert report.successes <= report.runs
+
+
+async def test_pick_run_skips_unfinished(con):
+    await con.execute("INSERT INTO codebase (name) VALUES ('foo')")
+    await con.execute(
+        "INSERT INTO change_set (id, campaign) VALUES ('r1', 'lintian-fixes')"
+    )
+    start_time = datetime.utcnow() - timedelta(hours=1)
+    await con.execute(
+        "INSERT INTO run (id, command, start_time, finish_time, result_code, "
+        "suite, logfilenames, change_set, codebase) "
+        "VALUES ('r1', 'true', $1, NULL, 'success', 'lintian-fixes', '{}', "
+        "'r1', 'foo')",
+        start_time,
+    )
+    rng = random.Random(42)
+    assert await _pick_run(con, "foo", "lintian-fixes", rng) is None
+    await con.execute(
+        "UPDATE run SET finish_time = $1 WHERE id = 'r1'",
+        start_time + timedelta(minutes=5),
+    )
+    assert await _pick_run(con, "foo", "lintian-fixes", rng) == (
+        timedelta(minutes=5),
+        "success",
+    )
@@ -7,6 +7,7 @@ use axum::{
 };
 use janitor::api::worker::{Assignment, Metadata};
 use std::sync::{Arc, RwLock};
+use tokio::io::{AsyncReadExt, AsyncSeekExt};
 #[derive(Template)]
 #[template(path = "index.html")]
 pub struct IndexTemplate<'a> {
@@ -163,9 +164,22 @@ async fn get_log_id(State(state): State<Arc<RwLock<AppState>>>) -> Json<Option<S
     )
 }
 
+/// Parse the start offset of an open-ended `Range: bytes=N-` header.
+///
+/// Other range forms are ignored, in which case the full file is returned.
+fn parse_range_start(headers: &HeaderMap) -> Option<u64> {
+    let value = headers.get(axum::http::header::RANGE)?.to_str().ok()?;
+    let (start, end) = value.strip_prefix("bytes=")?.split_once('-')?;
+    if !end.is_empty() {
+        return None;
+    }
+    start.trim().parse().ok()
+}
+
 async fn get_log_file(
     State(state): State<Arc<RwLock<AppState>>>,
     Path(filename): Path<String>,
+    request_headers: HeaderMap,
 ) -> Response {
     // filenames should only contain characters that are safe to use in URLs
     if filename.contains('/') || filename.contains('\\') {
@@ -184,7 +198,7 @@ async fn get_log_file(
             .unwrap();
     };
 
-    let file = match tokio::fs::File::open(&p).await {
+    let mut file = match tokio::fs::File::open(&p).await {
         Ok(f) => f,
         Err(e) if e.kind() == std::io::ErrorKind::NotFound => {
             return Response::builder()
@@ -200,17 +214,59 @@ async fn get_log_file(
         }
     };
 
-    let stream = tokio_util::io::ReaderStream::new(file);
-
-    let body = axum::body::Body::from_stream(stream);
-
     let mut headers = HeaderMap::new();
     headers.insert(
         axum::http::header::CONTENT_TYPE,
         "text/plain".parse().unwrap(),
     );
+    headers.insert(axum::http::header::ACCEPT_RANGES, "bytes".parse().unwrap());
 
-    (StatusCode::OK, headers, body).into_response()
+    let offset = match parse_range_start(&request_headers) {
+        Some(offset) => offset,
+        None => {
+            let body = axum::body::Body::from_stream(tokio_util::io::ReaderStream::new(file));
+            return (StatusCode::OK, headers, body).into_response();
+        }
+    };
+
+    // The log may still be growing; only serve the bytes that exist now, so
+    // that the Content-Range we send matches the body.
+    let size = match file.metadata().await {
+        Ok(m) => m.len(),
+        Err(e) => {
+            return Response::builder()
+                .status(StatusCode::INTERNAL_SERVER_ERROR)
+                .body(format!("Error reading log file: {}", e).into())
+                .unwrap();
+        }
+    };
+
+    if offset >= size {
+        headers.insert(
+            axum::http::header::CONTENT_RANGE,
+            format!("bytes */{}", size).parse().unwrap(),
+        );
+        return (StatusCode::RANGE_NOT_SATISFIABLE, headers).into_response();
+    }
+
+    if let Err(e) = file.seek(std::io::SeekFrom::Start(offset)).await {
+        return Response::builder()
+            .status(StatusCode::INTERNAL_SERVER_ERROR)
+            .body(format!("Error seeking in log file: {}", e).into())
+            .unwrap();
+    }
+
+    headers.insert(
+        axum::http::header::CONTENT_RANGE,
+        format!("bytes {}-{}/{}", offset, size - 1, size)
+            .parse()
+            .unwrap(),
+    );
+
+    let stream = tokio_util::io::ReaderStream::new(file.take(size - offset));
+    let body = axum::body::Body::from_stream(stream);
+
+    (StatusCode::PARTIAL_CONTENT, headers, body).into_response()
 }
 
 async fn get_artifact_file(
@@ -548,6 +604,40 @@ mod tests {
         assert_eq!(get_body(response).await, "No such log file");
     }
 
+    #[tokio::test]
+    async fn test_log_file_range() {
+        let state = Arc::new(RwLock::new(AppState::default()));
+        let td = tempfile::tempdir().unwrap();
+        std::fs::write(td.path().join("worker.log"), "line 1\nline 2\n").unwrap();
+        state.write().unwrap().output_directory = Some(td.path().to_path_buf());
+
+        let app = app(state.clone());
+        let request = Request::builder()
+            .uri("/logs/worker.log")
+            .header("Range", "bytes=7-")
+            .body(Body::empty())
+            .unwrap();
+        let response = app.clone().oneshot(request).await.unwrap();
+        assert_eq!(response.status(), 206);
+        assert_eq!(
+            response.headers().get("Content-Range").unwrap(),
+            "bytes 7-13/14"
+        );
+        assert_eq!(get_body(response).await, "line 2\n");
+
+        let request = Request::builder()
+            .uri("/logs/worker.log")
+            .header("Range", "bytes=14-")
+            .body(Body::empty())
+            .unwrap();
+        let response = app.oneshot(request).await.unwrap();
+        assert_eq!(response.status(), 416);
+        assert_eq!(
+            response.headers().get("Content-Range").unwrap(),
+            "bytes */14"
+        );
+    }
+
     #[tokio::test]
     async fn test_log_file_path_traversal() {
         let state = Arc::new(RwLock::new(AppState::default()));